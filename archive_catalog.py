@@ -0,0 +1,290 @@
+#! /usr/local/bin/python3
+"""Maintain a manifest of the archive sets in the rules_archive directory.
+
+   The manifest records, for each archive date, the path, size, mtime, SHA-256 checksum, and
+   number of rows of each of the set’s three files. It is saved as JSON in the cache directory
+   and brought up to date incrementally: the archive directory is rescanned only when its mtime
+   changes, and only new or modified files are checksummed and counted.
+
+   Rewriting a file in place leaves the directory’s mtime unchanged, so the files of an archive
+   set are checked against the manifest when the set is used (check_archive_set()), and the
+   manifest updated if they have changed. The CLI checks every file.
+
+   Files that can’t be read or decompressed are left out of their archive sets, which are then
+   incomplete, and listed in the catalog’s bad_files with the error. They are not scanned again
+   until they change.
+"""
+
+import bz2
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+from archive_files import archive_dir, archive_path, archive_suffixes, cache_dir
+from argparse import ArgumentParser
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+# Table name for each archive file name suffix
+suffix_tables = {suffix: table_name for table_name, suffix in archive_suffixes.items()}
+file_name_re = re.compile(rf'^(\d{{4}}-\d{{2}}-\d{{2}})_({'|'.join(suffix_tables)})\.csv\.bz2$')
+
+
+@dataclass
+class ArchiveFile:
+  path: str
+  size: int
+  mtime_ns: int
+  sha256: str
+  rows: int
+
+
+@dataclass
+class ArchiveSet:
+  archive_date: str
+  files: dict = field(default_factory=dict)  # ArchiveFile keyed by table name
+
+  @property
+  def is_complete(self) -> bool:
+    return all(table_name in self.files for table_name in archive_suffixes)
+
+
+@dataclass
+class Catalog:
+  archive_dir: Path
+  archive_sets: dict  # ArchiveSet keyed by archive date
+  dates: list         # Sorted dates of the complete archive sets
+  bad_files: dict = field(default_factory=dict)  # {size, mtime_ns, error} keyed by path
+  manifest_path: Path | None = None
+  dir_mtime_ns: int | None = None
+
+  def at_or_before(self, target_date: str) -> ArchiveSet | None:
+    """The latest complete archive set created at or before target_date (YYYY-MM-DD)."""
+    index = bisect_right(self.dates, target_date)
+    return self.archive_sets[self.dates[index - 1]] if index else None
+
+  def between(self, first_date: str, last_date: str) -> list:
+    """Dates of complete archive sets in the closed interval [first_date, last_date]."""
+    return self.dates[bisect_left(self.dates, first_date):bisect_right(self.dates, last_date)]
+
+
+# scan_file()
+# -------------------------------------------------------------------------------------------------
+def scan_file(path: Path) -> ArchiveFile:
+  """Checksum the compressed file and count its (decompressed) lines in a single pass."""
+  stat = path.stat()
+  sha256 = hashlib.sha256()
+  decompressor = bz2.BZ2Decompressor()
+  rows = 0
+  with open(path, 'rb') as infile:
+    while chunk := infile.read(1 << 20):
+      sha256.update(chunk)
+      while chunk:
+        if decompressor.eof:
+          # Multi-stream file: start over with the next stream
+          decompressor = bz2.BZ2Decompressor()
+        rows += decompressor.decompress(chunk).count(b'\n')
+        chunk = decompressor.unused_data if decompressor.eof else b''
+  if not decompressor.eof:
+    raise EOFError('Compressed file ended before the end-of-stream marker was reached')
+  return ArchiveFile(str(path), stat.st_size, stat.st_mtime_ns, sha256.hexdigest(), rows)
+
+
+# try_scan_file()
+# -------------------------------------------------------------------------------------------------
+def try_scan_file(path: Path) -> ArchiveFile | str:
+  """scan_file(), or the error message if the file can’t be read or decompressed."""
+  try:
+    return scan_file(path)
+  except (OSError, EOFError, ValueError) as err:
+    return f'{type(err).__name__}: {err}'
+
+
+# is_unchanged()
+# -------------------------------------------------------------------------------------------------
+def is_unchanged(path: str, size: int, mtime_ns: int) -> bool:
+  """Whether a file still exists with the size and mtime recorded in the manifest."""
+  try:
+    stat = os.stat(path)
+  except OSError:
+    return False
+  return stat.st_size == size and stat.st_mtime_ns == mtime_ns
+
+
+# complete_dates()
+# -------------------------------------------------------------------------------------------------
+def complete_dates(archive_sets: dict) -> list:
+  """Sorted dates of the complete archive sets."""
+  return sorted(archive_date for archive_date, archive_set in archive_sets.items()
+                if archive_set.is_complete)
+
+
+# scan_files()
+# -------------------------------------------------------------------------------------------------
+def scan_files(to_scan: list, bad_files: dict, jobs: int = 4, verbose: bool = False):
+  """Scan (archive_set, table_name, path, stat) files into their archive sets, or into bad_files
+     if they can’t be read.
+  """
+  if verbose:
+    print(f'Scanning {len(to_scan):,} new or changed archive files')
+  # bz2 decompression releases the GIL, so threads scan files in parallel.
+  with ThreadPoolExecutor(max_workers=jobs) as executor:
+    scanned = executor.map(try_scan_file, [path for _, _, path, _ in to_scan])
+    for (archive_set, table_name, path, stat), archive_file in zip(to_scan, scanned):
+      if isinstance(archive_file, ArchiveFile):
+        archive_set.files[table_name] = archive_file
+      else:
+        bad_files[str(path)] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                                'error': archive_file}
+        if verbose:
+          print(f'{path}: {archive_file}')
+
+
+# save_manifest()
+# -------------------------------------------------------------------------------------------------
+def save_manifest(catalog: Catalog):
+  """Write the catalog’s manifest, replacing the old one in a single step. Each writer has a temp
+     file of its own, so concurrent writers can’t mix their output.
+  """
+  manifest = {'dir_mtime_ns': catalog.dir_mtime_ns,
+              'bad_files': catalog.bad_files,
+              'archive_sets': {archive_date: {table_name: asdict(archive_file)
+                                              for table_name, archive_file
+                                              in catalog.archive_sets[archive_date].files.items()}
+                               for archive_date in sorted(catalog.archive_sets)}}
+  catalog.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+  with tempfile.NamedTemporaryFile('w', dir=catalog.manifest_path.parent, prefix='manifest_',
+                                   suffix='.tmp', delete=False) as outfile:
+    outfile.write(json.dumps(manifest, indent=1))
+  os.replace(outfile.name, catalog.manifest_path)
+
+
+# load_catalog()
+# -------------------------------------------------------------------------------------------------
+def load_catalog(archive_dir: Path = archive_dir, jobs: int = 4, verbose: bool = False,
+                 check_files: bool = False) -> Catalog:
+  """Read the manifest, update it if the archive directory has changed, and return the catalog.
+
+     With check_files, also rescan if any file in the manifest, or any bad file, has a different
+     size or mtime than recorded. That takes a stat() of every file; otherwise only the
+     directory’s is needed.
+  """
+  archive_dir = Path(archive_dir)
+  if not archive_dir.is_dir():
+    raise FileNotFoundError(f'Rules archive dir {archive_dir} not found')
+  dir_hash = hashlib.blake2b(str(archive_dir.resolve()).encode(), digest_size=6).hexdigest()
+  manifest_path = Path(cache_dir, f'manifest_{dir_hash}.json')
+  try:
+    manifest = json.loads(manifest_path.read_text())
+  except (FileNotFoundError, json.JSONDecodeError):
+    manifest = {'dir_mtime_ns': None, 'archive_sets': {}}
+  bad_files = manifest.get('bad_files', {})
+
+  archive_sets = {archive_date: ArchiveSet(archive_date,
+                                           {table_name: ArchiveFile(**archive_file)
+                                            for table_name, archive_file in files.items()})
+                  for archive_date, files in manifest['archive_sets'].items()}
+
+  known = {archive_file.path: archive_file
+           for archive_set in archive_sets.values()
+           for archive_file in archive_set.files.values()}
+  dir_mtime_ns = archive_dir.stat().st_mtime_ns
+  if (dir_mtime_ns != manifest['dir_mtime_ns']
+     or check_files and not (all(is_unchanged(path, archive_file.size, archive_file.mtime_ns)
+                                 for path, archive_file in known.items())
+                             and all(is_unchanged(path, bad['size'], bad['mtime_ns'])
+                                     for path, bad in bad_files.items()))):
+    # Rescan the directory, keeping entries for files whose size and mtime are unchanged.
+    known_bad, bad_files = bad_files, dict()
+    archive_sets = dict()
+    to_scan = []
+    with os.scandir(archive_dir) as entries:
+      for entry in entries:
+        if match := file_name_re.match(entry.name):
+          archive_date, table_name = match[1], suffix_tables[match[2]]
+          archive_set = archive_sets.setdefault(archive_date, ArchiveSet(archive_date))
+          stat = entry.stat()
+          archive_file = known.get(entry.path)
+          bad = known_bad.get(entry.path)
+          if (archive_file and archive_file.size == stat.st_size
+             and archive_file.mtime_ns == stat.st_mtime_ns):
+            archive_set.files[table_name] = archive_file
+          elif bad and bad['size'] == stat.st_size and bad['mtime_ns'] == stat.st_mtime_ns:
+            bad_files[entry.path] = bad
+          else:
+            to_scan.append((archive_set, table_name, Path(entry.path), stat))
+    if to_scan:
+      scan_files(to_scan, bad_files, jobs, verbose)
+    catalog = Catalog(archive_dir, archive_sets, complete_dates(archive_sets), bad_files,
+                      manifest_path, dir_mtime_ns)
+    save_manifest(catalog)
+    return catalog
+
+  return Catalog(archive_dir, archive_sets, complete_dates(archive_sets), bad_files,
+                 manifest_path, manifest['dir_mtime_ns'])
+
+
+# check_archive_set()
+# -------------------------------------------------------------------------------------------------
+def check_archive_set(catalog: Catalog, archive_date: str) -> ArchiveSet | None:
+  """The archive set for a date, after rescanning any of its files, readable or not, whose size
+     or mtime has changed since the manifest was written, and saving the manifest if there were
+     any. None if the catalog has no such set. The set is incomplete if a file has gone bad.
+  """
+  if (archive_set := catalog.archive_sets.get(archive_date)) is None:
+    return None
+  to_scan = []
+  for table_name in archive_suffixes:
+    path = archive_path(archive_date, table_name, catalog.archive_dir)
+    if archive_file := archive_set.files.get(table_name):
+      recorded = (archive_file.size, archive_file.mtime_ns)
+    elif bad := catalog.bad_files.get(str(path)):
+      recorded = (bad['size'], bad['mtime_ns'])
+    else:
+      continue
+    try:
+      stat = path.stat()
+    except FileNotFoundError:
+      # Removing a file changes the directory’s mtime, so the next load_catalog() drops it.
+      archive_set.files.pop(table_name, None)
+      continue
+    if (stat.st_size, stat.st_mtime_ns) != recorded:
+      archive_set.files.pop(table_name, None)
+      catalog.bad_files.pop(str(path), None)
+      to_scan.append((archive_set, table_name, path, stat))
+  if to_scan:
+    scan_files(to_scan, catalog.bad_files)
+    catalog.dates = complete_dates(catalog.archive_sets)
+    save_manifest(catalog)
+  return archive_set
+
+
+# main()
+# -------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+  parser = ArgumentParser('Update and list the rules archive manifest')
+  parser.add_argument('--archive_dir', '-d', default=archive_dir)
+  parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count())
+  parser.add_argument('--verbose', '-v', action='store_true')
+  args = parser.parse_args()
+
+  catalog = load_catalog(args.archive_dir, args.jobs, verbose=True, check_files=True)
+  print(f'{len(catalog.dates)} complete archive sets', end='')
+  if catalog.dates:
+    print(f' between {catalog.dates[0]} and {catalog.dates[-1]}')
+  else:
+    print()
+  for path, bad in catalog.bad_files.items():
+    print(f'Unreadable: {path}: {bad['error']}')
+  for archive_date, archive_set in sorted(catalog.archive_sets.items()):
+    if args.verbose or not archive_set.is_complete:
+      missing = [table_name for table_name in archive_suffixes
+                 if table_name not in archive_set.files]
+      rows = ' '.join(f'{archive_set.files[table_name].rows:>10,}'
+                      if table_name in archive_set.files else f'{"missing":>10}'
+                      for table_name in archive_suffixes)
+      print(f'{archive_date} {rows}{'  incomplete: ' + ', '.join(missing) if missing else ''}')
@@ -0,0 +1,193 @@
+"""Read rules_archive CSV files as rows ready to be loaded into a schema’s tables.
+
+   Each archive set consists of three bz2-compressed CSV files named for the date the set was
+   created: YYYY-MM-DD_effective_dates.csv.bz2, YYYY-MM-DD_source_courses.csv.bz2, and
+   YYYY-MM-DD_destination_courses.csv.bz2.
+
+   The archive and cache directory locations can be overridden with the RULES_ARCHIVE_DIR and
+   RULES_ARCHIVE_CACHE environment variables, for example to work with synthetic archives.
+
+   Files can be read a row at a time (read_rows) or in batches of columns (read_batches), which
+   normalize whole columns at once, using NumPy if it is installed. Both give the same values.
+
+   A frame archive (frame_archives.py), the same lines recompressed into zstd frames in rule_key
+   order, is read only when its .csv.zst path is given, decompressing frames in parallel. A bz2
+   path always reads the bz2 file, so rows come in the file’s order.
+"""
+
+import bz2
+import csv
+import io
+import os
+
+from itertools import chain, islice
+from pathlib import Path
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+archive_dir = Path(os.environ.get('RULES_ARCHIVE_DIR',
+                                  Path(Path.home(), 'Projects/cuny_curriculum/rules_archive')))
+cache_dir = Path(os.environ.get('RULES_ARCHIVE_CACHE', Path(Path.home(), '.cache/rules_archive')))
+
+# Archive file name suffix for each table
+archive_suffixes = {'transfer_rules': 'effective_dates',
+                    'source_courses': 'source_courses',
+                    'destination_courses': 'destination_courses'}
+
+# The columns of each table that get their values from the archive file rows. The remaining
+# columns (id, description) take their default values.
+table_columns = {'transfer_rules': ('rule_key', 'effective_date'),
+                 'source_courses': ('rule_key', 'src_inst', 'dst_inst', 'course_id', 'offer_nbr',
+                                    'min_credits', 'max_credits', 'credit_src',
+                                    'min_grade', 'max_grade'),
+                 'destination_courses': ('rule_key', 'course_id', 'offer_nbr', 'credits')}
+
+batch_bytes = 1 << 22  # Characters per read_batches() block
+
+
+# archive_path()
+# -------------------------------------------------------------------------------------------------
+def archive_path(archive_date: str, table_name: str, archive_dir: Path = archive_dir) -> Path:
+  """Path to the archive file for a table on a given (YYYY-MM-DD) archive date."""
+  return Path(archive_dir, f'{archive_date}_{archive_suffixes[table_name]}.csv.bz2')
+
+
+# normalize_source_course()
+# -------------------------------------------------------------------------------------------------
+def normalize_source_course(line: list) -> list:
+  """Break out the source and destination institutions and normalize the grade range."""
+  rule_key = line[0]
+  src_inst = rule_key[0:5]
+  dst_inst = rule_key[6:11]
+  line = [line[0], src_inst, dst_inst] + line[1:]
+  line[-2] = 0. if float(line[-2]) < 0.7 else float(line[-2])
+  line[-1] = min(float(line[-1]), 4.0)
+  return line
+
+
+# open_archive()
+# -------------------------------------------------------------------------------------------------
+def open_archive(path: Path):
+  """Open an archive file for reading as text: a .csv.zst path opens that frame archive, any
+     other path the bz2 file.
+  """
+  path = Path(path)
+  if path.suffix == '.zst':
+    from frame_archives import open_frames
+    return open_frames(path)
+  return bz2.open(path, mode='rt')
+
+
+# read_rows()
+# -------------------------------------------------------------------------------------------------
+def read_rows(table_name: str, path: Path):
+  """Generate the rows of an archive file, normalized for loading into table_name."""
+  with open_archive(path) as infile:
+    reader = csv.reader(infile)
+    if table_name == 'source_courses':
+      yield from map(normalize_source_course, reader)
+    else:
+      yield from reader
+
+
+# normalize_grades()
+# -------------------------------------------------------------------------------------------------
+def normalize_grades(min_grades: tuple, max_grades: tuple) -> tuple:
+  """normalize_source_course()’s grade rules applied to whole columns: minimum grades below 0.7
+     become 0.0, and maximum grades are capped at 4.0. Returns two lists of floats.
+  """
+  if numpy is not None:
+    min_grades = numpy.array(min_grades, dtype=float)
+    max_grades = numpy.array(max_grades, dtype=float)
+    return (numpy.where(min_grades < 0.7, 0., min_grades).tolist(),
+            numpy.minimum(max_grades, 4.0).tolist())
+  return ([0. if grade < 0.7 else grade for grade in map(float, min_grades)],
+          [min(grade, 4.0) for grade in map(float, max_grades)])
+
+
+# text_columns()
+# -------------------------------------------------------------------------------------------------
+def text_columns(text: str, num_fields: int) -> list | None:
+  """Split a block of complete CSV lines into columns, or return None if the block has quoted
+     values or any line without num_fields fields, and needs the csv module.
+
+     The whole block is split into fields at once, and every num_fields-th field is a column.
+     Each line’s last field keeps its newline, so the lines all have num_fields fields only if
+     every field of the last column ends with one.
+  """
+  if '"' in text:
+    return None
+  num_lines = text.count('\n')
+  fields = text.replace('\n', '\n,').split(',')
+  fields.pop()  # The empty string after the final newline
+  if len(fields) != num_lines * num_fields:
+    return None
+  last_column = ''.join(fields[num_fields - 1::num_fields])
+  if last_column.count('\n') != num_lines:
+    return None
+  return [*(fields[index::num_fields] for index in range(num_fields - 1)),
+          last_column[:-1].split('\n')]
+
+
+# read_batches()
+# -------------------------------------------------------------------------------------------------
+def read_batches(table_name: str, path: Path, batch_bytes: int = batch_bytes):
+  """Generate the rows of an archive file as batches of columns: one list or tuple per column of
+     table_columns[table_name], normalized the same way as read_rows().
+
+     The file is read in blocks of about batch_bytes characters. Archive values are never quoted,
+     so blocks are split into columns without parsing them line by line; if a quoted value does
+     turn up, the rest of the file is read with the csv module.
+  """
+  num_columns = len(table_columns[table_name])
+  # The rule_key is split into src_inst and dst_inst, which are not in the file.
+  num_fields = num_columns - 2 if table_name == 'source_courses' else num_columns
+
+  def normalized(columns):
+    if table_name != 'source_courses':
+      return columns
+    rule_keys = columns[0]
+    min_grades, max_grades = normalize_grades(columns[-2], columns[-1])
+    return [rule_keys,
+            [rule_key[0:5] for rule_key in rule_keys],
+            [rule_key[6:11] for rule_key in rule_keys],
+            *columns[1:-2], min_grades, max_grades]
+
+  with open_archive(path) as infile:
+    partial_line = ''
+    while chunk := infile.read(batch_bytes):
+      text = partial_line + chunk
+      end = text.rfind('\n') + 1
+      text, partial_line = text[:end], text[end:]
+      if text:
+        if (columns := text_columns(text, num_fields)) is None:
+          break
+        yield normalized(columns)
+    else:
+      # The end of the file, which might not end with a newline.
+      if not partial_line:
+        return
+      text, partial_line = partial_line + '\n', ''
+      if (columns := text_columns(text, num_fields)) is not None:
+        yield normalized(columns)
+        return
+
+    # Finish with the csv module, which handles quoted values, even ones that span lines.
+    reader = csv.reader(chain(io.StringIO(text + partial_line + infile.readline()), infile))
+    while rows := list(islice(reader, batch_bytes // 32)):
+      columns = list(zip(*rows))
+      if len(columns) != num_fields or any(len(row) != num_fields for row in rows):
+        raise ValueError(f'{path}: rows near line {reader.line_num} do not have {num_fields} '
+                         'fields')
+      yield normalized(columns)
+
+
+# batch_rows_of()
+# -------------------------------------------------------------------------------------------------
+def batch_rows_of(batches):
+  """Generate the rows of read_batches() batches, in the same form as read_rows()."""
+  for columns in batches:
+    yield from map(list, zip(*columns))
@@ -0,0 +1,202 @@
+"""Pipelined ingest: load an archive set’s three tables concurrently, overlapping decompression
+   and parsing with the database writes.
+
+   Each table gets a producer process that decompresses and parses its archive file and formats
+   the rows as blocks of COPY text, and an asyncio consumer that streams the blocks to the server
+   with COPY FROM STDIN on its own connection. Blocks pass through a bounded queue, so a producer
+   that gets ahead of its consumer waits, and memory stays bounded by the queue size.
+
+   The tables load in separate transactions, so they must not have foreign keys (or the unique
+   rule_key that the foreign keys reference) during the load; the caller adds the constraints
+   afterwards.
+"""
+
+import asyncio
+import multiprocessing
+import queue
+import time
+import traceback
+
+from archive_files import archive_path, read_batches, table_columns
+from columnar_cache import ColumnarArchive, is_cached
+from instrumentation import record
+from statistics import RunLengths
+
+batch_rows = 10_000   # Rows per COPY block from the columnar cache
+max_batches = 8       # Blocks queued per table
+poll_seconds = 5      # How long a consumer waits for a block before checking on its producer
+
+# Backslash, tab, newline, and carriage return have to be escaped in COPY text format.
+copy_escapes = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+# copy_line()
+# -------------------------------------------------------------------------------------------------
+def copy_line(row) -> str:
+  """A row in COPY text format: tab-separated, with None as \\N.
+
+     Values almost never need escaping, so the row is joined first and the values are escaped one
+     by one only if the joined line shows a need to.
+  """
+  line = '\t'.join(map(str, row))
+  if (line.count('\t') == len(row) - 1 and '\\' not in line and '\n' not in line
+     and '\r' not in line and None not in row):
+    return line + '\n'
+  return '\t'.join('\\N' if value is None else str(value).translate(copy_escapes)
+                   for value in row) + '\n'
+
+
+# copy_block()
+# -------------------------------------------------------------------------------------------------
+def copy_block(columns: list) -> str:
+  """A read_batches() batch of columns in COPY text format, joined a column at a time; rows with
+     values that need escaping go through copy_line() instead.
+  """
+  num_rows = len(columns[0])
+  text = '\n'.join(map('\t'.join, zip(*[column if isinstance(column[0], str)
+                                         else list(map(str, column))
+                                         for column in columns]))) + '\n'
+  if (text.count('\t') == num_rows * (len(columns) - 1) and text.count('\n') == num_rows
+     and '\\' not in text and '\r' not in text and 'None' not in text):
+    return text
+  return ''.join(map(copy_line, zip(*columns)))
+
+
+# produce()
+# -------------------------------------------------------------------------------------------------
+def produce(archive_date: str, table_name: str, blocks, count_keys: bool, archive_set=None):
+  """Producer process: put (num_rows, text) blocks of a table’s rows on the blocks queue, then
+     ('done', (parse_seconds, rows_per_key)), or ('error', traceback) if anything goes wrong.
+  """
+  try:
+    start = time.perf_counter()
+    waited = 0.0
+    rows_per_key = RunLengths() if count_keys else None
+
+    def put(num_rows, text):
+      nonlocal waited
+      put_start = time.perf_counter()
+      blocks.put((num_rows, text))
+      waited += time.perf_counter() - put_start
+
+    if is_cached(archive_date, archive_set):
+      lines = []
+      for row in ColumnarArchive(archive_date).rows(table_name):
+        lines.append(copy_line(row))
+        if count_keys:
+          rows_per_key.add(row[0])
+        if len(lines) == batch_rows:
+          put(len(lines), ''.join(lines))
+          lines = []
+      if lines:
+        put(len(lines), ''.join(lines))
+    else:
+      # Parse and format the bz2 file a block of columns at a time.
+      for columns in read_batches(table_name, archive_path(archive_date, table_name)):
+        if count_keys:
+          rows_per_key.update(columns[0])
+        put(len(columns[0]), copy_block(columns))
+    # Time spent blocked on a full queue is the consumer’s, not parsing.
+    blocks.put(('done', (time.perf_counter() - start - waited, rows_per_key)))
+  except Exception:
+    blocks.put(('error', traceback.format_exc()))
+
+
+# consume()
+# -------------------------------------------------------------------------------------------------
+async def consume(conninfo: str, table: str, columns: tuple, blocks, producer) -> tuple:
+  """Stream the blocks from a producer into a table. Returns (num_rows, parse_seconds,
+     rows_per_key). Raises RuntimeError if the producer fails, or exits without finishing.
+  """
+  import psycopg
+
+  loop = asyncio.get_running_loop()
+  num_rows = 0
+  async with await psycopg.AsyncConnection.connect(conninfo) as conn:
+    async with conn.cursor() as cursor:
+      async with cursor.copy(f"""
+      copy {table} ({', '.join(columns)}) from stdin
+      """) as copy:
+        polls_since_exit = 0
+        while True:
+          # The blocking get runs in a worker thread, so the other tables’ copies keep going.
+          try:
+            count, block = await loop.run_in_executor(None, blocks.get, True, poll_seconds)
+          except queue.Empty:
+            # A producer that was killed never sends 'done'. One that exited normally has
+            # flushed its blocks, so allow one more poll for them to arrive.
+            if not producer.is_alive():
+              polls_since_exit += 1
+              if polls_since_exit > 1:
+                raise RuntimeError(f'{table} producer exited with code {producer.exitcode} '
+                                   'before it finished')
+            continue
+          match count:
+            case 'done':
+              parse_seconds, rows_per_key = block
+              break
+            case 'error':
+              raise RuntimeError(f'{table} producer failed:\n{block}')
+            case _:
+              await copy.write(block)
+              num_rows += count
+  return num_rows, parse_seconds, rows_per_key
+
+
+# load_tables()
+# -------------------------------------------------------------------------------------------------
+def load_tables(conninfo: str, archive_date: str, schema_name: str,
+                rule_counts: dict | None = None, archive_set=None) -> dict:
+  """Load the three tables of an existing, constraint-free schema concurrently.
+
+     If rule_counts is a dict, the rows per rule_key of each table are counted into a
+     statistics.RunLengths under the table’s name. Returns a dict of (num_rows, seconds) tuples
+     keyed by table name.
+  """
+  queues = {table_name: multiprocessing.Queue(max_batches) for table_name in table_columns}
+  producers = [multiprocessing.Process(target=produce,
+                                       args=(archive_date, table_name, queues[table_name],
+                                             rule_counts is not None, archive_set),
+                                       daemon=True)
+               for table_name in table_columns]
+  for producer in producers:
+    producer.start()
+
+  async def load_table(table_name, producer):
+    start = time.perf_counter()
+    num_rows, parse_seconds, rows_per_key = await consume(
+        conninfo, f'{schema_name}.{table_name}', table_columns[table_name], queues[table_name],
+        producer)
+    seconds = time.perf_counter() - start
+    record(f'{table_name} decompress/parse', parse_seconds, num_rows, archive_date=archive_date)
+    record(f'{table_name} copy (pipelined)', seconds, num_rows, archive_date=archive_date)
+    if rule_counts is not None:
+      rule_counts[table_name] = rows_per_key
+    return table_name, (num_rows, seconds)
+
+  def stop_producers():
+    # A failed copy leaves the other producers running, or blocked on full queues, and their
+    # consumers’ worker threads blocked waiting for blocks.
+    for producer in producers:
+      if producer.is_alive():
+        producer.terminate()
+      producer.join()
+    for blocks in queues.values():
+      try:
+        blocks.put_nowait(('error', 'load cancelled'))
+      except queue.Full:
+        pass
+
+  async def load_all():
+    try:
+      return dict(await asyncio.gather(*[load_table(table_name, producer)
+                                         for table_name, producer
+                                         in zip(table_columns, producers)]))
+    except BaseException:
+      stop_producers()
+      raise
+
+  results = asyncio.run(load_all())
+  for producer in producers:
+    producer.join()
+  return results
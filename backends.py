@@ -0,0 +1,371 @@
+#! /usr/local/bin/python3
+"""Storage backends: the cuny_curriculum PostgreSQL database, or a single SQLite file for building
+   and querying archive snapshots locally, with no server.
+
+   PostgreSQL keeps each archive’s tables in a schema, such as a20250417.source_courses. A SQLite
+   file has no schemata, so the schema name becomes a prefix: a20250417_source_courses. Tables in
+   the public schema, such as cuny_courses, keep their names.
+
+   SQLite connections and cursors are context managers here, like psycopg’s, and a regexp()
+   function is registered so that “value regexp pattern” matches case-insensitively, like ~*.
+
+   The CLI creates cuny_courses in a SQLite file, from a CSV file (such as the one written by
+   synthetic_archive.py) or from the PostgreSQL database.
+"""
+
+import csv
+import re
+import sqlite3
+
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from pathlib import Path
+
+conninfo = 'dbname=cuny_curriculum'
+
+# Advisory lock key for installing table_versions triggers
+table_versions_lock = 20250501
+
+# cuny_courses columns used by the tools
+courses_columns = ['course_id', 'offer_nbr', 'institution', 'discipline', 'catalog_number',
+                   'title', 'course_status', 'designation', 'attributes']
+
+
+class PostgresBackend:
+  """The cuny_curriculum database server."""
+  name = 'postgres'
+  param = '%s'
+  regex_match = '~*'
+  is_distinct = 'is distinct from'
+  serial_key = 'serial primary key'
+
+  def __init__(self, conninfo: str = conninfo):
+    self.conninfo = conninfo
+
+  def connect(self, autocommit: bool = False):
+    import psycopg
+    return psycopg.connect(self.conninfo, autocommit=autocommit)
+
+  def dict_cursor(self, conn):
+    from psycopg.rows import dict_row
+    return conn.cursor(row_factory=dict_row)
+
+  def transaction(self, conn):
+    return conn.transaction()
+
+  def table(self, schema_name: str, table_name: str) -> str:
+    return f'{schema_name}.{table_name}'
+
+  def list_schemata(self, conn) -> list:
+    from list_schemata import list_schemata
+    return list_schemata(conn)
+
+  def create_schema(self, cursor, schema_name: str):
+    """(Re-)create an empty schema."""
+    cursor.execute(f'drop schema if exists {schema_name} cascade')
+    cursor.execute(f'create schema {schema_name}')
+
+  def create_index(self, cursor, schema_name: str, table_name: str, columns: tuple):
+    cursor.execute(f"""
+    create index on {schema_name}.{table_name} ({', '.join(columns)})
+    """)
+
+  def create_temp_table(self, cursor, table_name: str, columns: str):
+    """A temporary table that is dropped at the end of the current transaction."""
+    cursor.execute(f'create temporary table {table_name} ({columns}) on commit drop')
+
+  def column_exists(self, cursor, schema_name: str, table_name: str, column: str) -> bool:
+    cursor.execute("""
+    select 1 from information_schema.columns
+     where table_schema = %s and table_name = %s and column_name = %s
+    """, (schema_name, table_name, column))
+    return cursor.rowcount > 0
+
+  def copy_rows(self, cursor, table: str, columns: tuple, rows) -> int:
+    """Stream rows into a table using COPY FROM STDIN. Return the number of rows.
+
+       Rows are buffered by psycopg and sent to the server in large blocks rather than one round
+       trip per row.
+    """
+    num_rows = 0
+    with cursor.copy(f"""
+    copy {table} ({', '.join(columns)}) from stdin
+    """) as copy:
+      for row in rows:
+        copy.write_row(row)
+        num_rows += 1
+    return num_rows
+
+  def advisory_lock(self, cursor, key: int, shared: bool = False):
+    """Hold a lock on key until the end of the current transaction: shared ones let each other
+       through, and an exclusive one waits for, and keeps out, all others.
+    """
+    cursor.execute(f'select pg_advisory_xact_lock{'_shared' * shared}(%s)', (key, ))
+
+  def table_stamp(self, cursor, table_name: str) -> tuple | None:
+    """A public table’s version number, which changes whenever the table does; None if the
+       version can’t be kept.
+
+       The versions are kept in table_versions by a statement-level trigger, installed on the
+       table the first time it’s stamped, that bumps the table’s version in the same transaction
+       as every insert, update, delete, or truncate. So unlike the statistics counters, the
+       version can’t lag behind a change or be reset, and reading it doesn’t scan the table.
+    """
+    import psycopg
+    with cursor.connection.cursor() as version_cursor:
+      try:
+        with cursor.connection.transaction():
+          row = None
+          if self.column_exists(version_cursor, 'public', 'table_versions', 'version'):
+            # A table that was dropped and created again has lost its trigger.
+            version_cursor.execute("""
+            select version from table_versions
+             where table_name = %s
+               and exists (select 1 from pg_trigger
+                            where tgrelid = to_regclass(%s) and tgname = 'bump_table_version')
+            """, (table_name, table_name))
+            row = version_cursor.fetchone()
+          if row is None:
+            self.install_version_trigger(version_cursor, table_name)
+            version_cursor.execute("""
+            select version from table_versions where table_name = %s
+            """, (table_name, ))
+            row = version_cursor.fetchone()
+      except psycopg.errors.InsufficientPrivilege:
+        return None
+    return tuple(row)
+
+  def install_version_trigger(self, cursor, table_name: str):
+    """Create table_versions and the trigger that keeps a public table’s version in it. The
+       version changes, since the table might have changed while it had no trigger.
+    """
+    self.advisory_lock(cursor, table_versions_lock)
+    cursor.execute("""
+    create table if not exists table_versions (
+      table_name text primary key,
+      version bigint not null)
+    """)
+    cursor.execute("""
+    create or replace function bump_table_version() returns trigger as $$
+    begin
+      insert into table_versions values (tg_table_name, 1)
+        on conflict (table_name) do update set version = table_versions.version + 1;
+      return null;
+    end;
+    $$ language plpgsql
+    """)
+    cursor.execute(f"""
+    create or replace trigger bump_table_version
+      after insert or update or delete or truncate on {table_name}
+      for each statement execute function bump_table_version()
+    """)
+    cursor.execute("""
+    insert into table_versions values (%s, 0)
+      on conflict (table_name) do update set version = table_versions.version + 1
+    """, (table_name, ))
+
+
+class SQLiteCursor(sqlite3.Cursor):
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+    return False
+
+
+class SQLiteConnection(sqlite3.Connection):
+  """Closes on leaving a with block, after committing or rolling back, like a psycopg
+     connection.
+  """
+  def cursor(self, factory=SQLiteCursor):
+    return super().cursor(factory)
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    super().__exit__(exc_type, exc_value, traceback)
+    self.close()
+    return False
+
+
+# regexp()
+# -------------------------------------------------------------------------------------------------
+def regexp(pattern: str, value: str | None) -> bool:
+  """SQLite’s “value regexp pattern” operator, case-insensitive like PostgreSQL’s ~*."""
+  return value is not None and re.search(pattern, value, re.IGNORECASE) is not None
+
+
+class SQLiteBackend:
+  """A single-file SQLite database."""
+  name = 'sqlite'
+  param = '?'
+  regex_match = 'regexp'
+  is_distinct = 'is not'
+  serial_key = 'integer primary key'
+
+  def __init__(self, path: str | Path):
+    self.path = Path(path)
+
+  def connect(self, autocommit: bool = False):
+    conn = sqlite3.connect(self.path, factory=SQLiteConnection,
+                           isolation_level=None if autocommit else 'DEFERRED')
+    conn.create_function('regexp', 2, regexp, deterministic=True)
+    return conn
+
+  def dict_cursor(self, conn):
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    return cursor
+
+  @contextmanager
+  def transaction(self, conn):
+    if conn.in_transaction:
+      yield conn
+      return
+    conn.execute('begin')
+    try:
+      yield conn
+    except BaseException:
+      conn.rollback()
+      raise
+    conn.commit()
+
+  def table(self, schema_name: str, table_name: str) -> str:
+    return table_name if schema_name == 'public' else f'{schema_name}_{table_name}'
+
+  def list_schemata(self, conn) -> list:
+    """Names of the archive “schemata”: the prefixes of the a20*_transfer_rules tables."""
+    with conn.cursor() as cursor:
+      cursor.execute("""
+      select name from sqlite_master
+       where type = 'table' and name glob 'a20*_transfer_rules'
+      order by name""")
+      return [row[0].removesuffix('_transfer_rules') for row in cursor]
+
+  def create_schema(self, cursor, schema_name: str):
+    """Drop the schema’s tables, if any."""
+    cursor.execute("""
+    select name from sqlite_master where type = 'table' and name glob ?
+    """, (f'{schema_name}_*', ))
+    for table in [row[0] for row in cursor.fetchall()]:
+      cursor.execute(f'drop table {table}')
+
+  def create_index(self, cursor, schema_name: str, table_name: str, columns: tuple):
+    # SQLite index names are per database, not per schema, so they include the prefix.
+    table = self.table(schema_name, table_name)
+    cursor.execute(f"""
+    create index {table}_{'_'.join(columns)} on {table} ({', '.join(columns)})
+    """)
+
+  def create_temp_table(self, cursor, table_name: str, columns: str):
+    cursor.execute(f'drop table if exists temp.{table_name}')
+    cursor.execute(f'create temp table {table_name} ({columns})')
+
+  def column_exists(self, cursor, schema_name: str, table_name: str, column: str) -> bool:
+    cursor.execute(f'pragma table_info({self.table(schema_name, table_name)})')
+    return any(row[1] == column for row in cursor.fetchall())
+
+  def copy_rows(self, cursor, table: str, columns: tuple, rows) -> int:
+    """Insert rows with executemany, which runs in-process with no round trips. Return the
+       number of rows.
+    """
+    num_rows = 0
+
+    def counted(rows):
+      nonlocal num_rows
+      for row in rows:
+        num_rows += 1
+        yield row
+
+    placeholders = ', '.join(['?'] * len(columns))
+    cursor.executemany(f"""
+    insert into {table} ({', '.join(columns)}) values ({placeholders})
+    """, counted(rows))
+    return num_rows
+
+  def advisory_lock(self, cursor, key: int, shared: bool = False):
+    """Writes to the file are serialized already, so there is nothing to lock."""
+    pass
+
+  def table_stamp(self, cursor, table_name: str) -> None:
+    """The file is local, so there is nothing to gain from snapshots of its tables."""
+    return None
+
+
+# The default backend
+postgres = PostgresBackend()
+
+
+# get_backend()
+# -------------------------------------------------------------------------------------------------
+def get_backend(name: str = 'postgres', db_path: str | None = None):
+  """The backend for the --backend and --db command line options."""
+  if name == 'sqlite':
+    if not db_path:
+      exit('The sqlite backend needs a database file (--db)')
+    return SQLiteBackend(db_path)
+  return postgres
+
+
+# add_backend_arguments()
+# -------------------------------------------------------------------------------------------------
+def add_backend_arguments(parser: ArgumentParser):
+  parser.add_argument('--backend', '-b', choices=['postgres', 'sqlite'], default='postgres')
+  parser.add_argument('--db', metavar='PATH', help='SQLite database file for --backend sqlite')
+
+
+# create_courses_table()
+# -------------------------------------------------------------------------------------------------
+def create_courses_table(backend, cursor):
+  """(Re-)create public.cuny_courses with the columns the tools use."""
+  cursor.execute(f'drop table if exists cuny_courses{' cascade' * (backend.name == 'postgres')}')
+  cursor.execute("""
+  create table cuny_courses (
+    course_id       integer,
+    offer_nbr       integer,
+    institution     text,
+    discipline      text,
+    catalog_number  text,
+    title           text,
+    course_status   text,
+    designation     text,
+    attributes      text,
+    primary key (course_id, offer_nbr)
+  )
+  """)
+
+
+# load_courses_csv()
+# -------------------------------------------------------------------------------------------------
+def load_courses_csv(backend, conn, path: Path) -> int:
+  """(Re-)create cuny_courses from a CSV file with a header row. Returns the number of rows."""
+  with conn.cursor() as cursor:
+    create_courses_table(backend, cursor)
+    with open(path, newline='') as infile:
+      reader = csv.reader(infile)
+      columns = next(reader)
+      num_rows = backend.copy_rows(cursor, 'cuny_courses', columns, reader)
+    cursor.execute('analyze cuny_courses')
+  return num_rows
+
+
+# main()
+# -------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+  parser = ArgumentParser('Create cuny_courses in a SQLite database file')
+  parser.add_argument('db', metavar='PATH')
+  parser.add_argument('--courses_csv', '-c', metavar='CSV',
+                      help='load this CSV file instead of copying from PostgreSQL')
+  args = parser.parse_args()
+
+  sqlite = SQLiteBackend(args.db)
+  with sqlite.connect() as conn:
+    if args.courses_csv:
+      num_rows = load_courses_csv(sqlite, conn, Path(args.courses_csv))
+    else:
+      with postgres.connect() as pg_conn:
+        with pg_conn.cursor() as pg_cursor, conn.cursor() as cursor:
+          create_courses_table(sqlite, cursor)
+          pg_cursor.execute(f'select {', '.join(courses_columns)} from cuny_courses')
+          num_rows = sqlite.copy_rows(cursor, 'cuny_courses', courses_columns, pg_cursor)
+          cursor.execute('analyze cuny_courses')
+  print(f'{num_rows:,} courses in {args.db}')
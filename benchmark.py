@@ -0,0 +1,221 @@
+#! /usr/local/bin/python3
+"""Benchmark the tools against synthetic archives in a throwaway PostgreSQL instance.
+
+   Generates synthetic archive sets and cuny_courses rows (synthetic_archive.py), starts a
+   private PostgreSQL server in a scratch directory (or uses the server named by the PG*
+   environment variables with --existing), and runs each tool as a subprocess with
+   RULES_ARCHIVE_DIR, RULES_ARCHIVE_CACHE, PGHOST, and PGPORT pointing at the scratch setup.
+
+   The tools always use the cuny_curriculum database, and the benchmark replaces its
+   cuny_courses table and adds archive schemata to it. So --existing is refused unless that
+   database is empty, or was marked as a benchmark scratch database when an earlier run found
+   it empty.
+
+   For each step it reports wall time, throughput, and the peak RSS of the subprocess. Results can
+   be saved as JSON and compared with a saved baseline: the exit status is 1 if any step’s
+   throughput dropped, or its peak memory grew, by more than the tolerance.
+"""
+
+import json
+import os
+import psycopg
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from archive_catalog import scan_file
+from archive_files import archive_path, table_columns
+from argparse import ArgumentParser
+from backends import load_courses_csv, postgres
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from synthetic_archive import generate
+
+repo_dir = Path(__file__).resolve().parent
+
+# Table marking a cuny_curriculum database as the benchmark’s scratch database (--existing)
+scratch_marker = 'rules_benchmark_scratch'
+
+
+# pg_bindir()
+# -------------------------------------------------------------------------------------------------
+def pg_bindir() -> Path:
+  """Directory containing initdb and pg_ctl."""
+  if initdb := shutil.which('initdb'):
+    return Path(initdb).parent
+  result = subprocess.run(['pg_config', '--bindir'], capture_output=True, text=True, check=True)
+  return Path(result.stdout.strip())
+
+
+# throwaway_postgres()
+# -------------------------------------------------------------------------------------------------
+@contextmanager
+def throwaway_postgres(work_dir: Path, port: int):
+  """Run a private PostgreSQL server, listening only on a socket in work_dir, with an empty
+     cuny_curriculum database. Yields the environment variables for connecting to it.
+  """
+  bindir = pg_bindir()
+  data_dir = Path(work_dir, 'pgdata')
+  subprocess.run([Path(bindir, 'initdb'), '--auth=trust', '--no-sync', '-D', data_dir],
+                 check=True, capture_output=True)
+  options = (f"-F -k {work_dir} -p {port} -c listen_addresses='' "
+             '-c synchronous_commit=off -c full_page_writes=off')
+  subprocess.run([Path(bindir, 'pg_ctl'), '-D', data_dir, '-o', options, '-w',
+                  '-l', Path(work_dir, 'postgres.log'), 'start'],
+                 check=True, capture_output=True)
+  env = {'PGHOST': str(work_dir), 'PGPORT': str(port)}
+  try:
+    with psycopg.connect(f'host={work_dir} port={port} dbname=postgres',
+                         autocommit=True) as conn:
+      conn.execute('create database cuny_curriculum')
+    yield env
+  finally:
+    subprocess.run([Path(bindir, 'pg_ctl'), '-D', data_dir, '-m', 'immediate', 'stop'],
+                   capture_output=True)
+
+
+# claim_scratch_database()
+# -------------------------------------------------------------------------------------------------
+def claim_scratch_database(conn) -> bool:
+  """Whether the database is the benchmark’s to overwrite: it has the scratch marker table, or
+     it has no tables, views, or sequences at all, in which case the marker is created.
+  """
+  cursor = conn.execute("""
+  select count(*), count(*) filter (where n.nspname = 'public' and c.relname = %s)
+    from pg_class c join pg_namespace n on n.oid = c.relnamespace
+   where c.relkind in ('r', 'p', 'v', 'm', 'S', 'f')
+     and n.nspname not in ('pg_catalog', 'information_schema')
+     and n.nspname !~ '^pg_(toast|temp_|toast_temp_)'
+  """, (scratch_marker, ))
+  num_relations, has_marker = cursor.fetchone()
+  if has_marker:
+    return True
+  if num_relations:
+    return False
+  conn.execute(f'create table public.{scratch_marker} (created_at timestamptz default now())')
+  conn.commit()
+  return True
+
+
+# run_step()
+# -------------------------------------------------------------------------------------------------
+def run_step(name: str, args: list, env: dict, num_items: int, unit: str) -> dict:
+  """Run a tool as a subprocess, and measure its wall time and peak RSS."""
+  print(f'{name:24}', end='', flush=True)
+  with tempfile.TemporaryFile() as stderr:
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable] + args, cwd=repo_dir, env=env,
+                               stdout=subprocess.DEVNULL, stderr=stderr)
+    # wait4() gives the resource usage of this one child
+    _, status, rusage = os.wait4(process.pid, 0)
+    seconds = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode:
+      stderr.seek(0)
+      exit(f'\n{' '.join(args)} failed:\n{stderr.read().decode()}')
+  # ru_maxrss is in kilobytes on Linux and bytes on macOS
+  peak_mb = rusage.ru_maxrss / (1 << 20 if sys.platform == 'darwin' else 1 << 10)
+  result = {'seconds': seconds, 'items': num_items, 'unit': unit,
+            'rate': num_items / seconds, 'peak_mb': peak_mb}
+  print(f'{seconds:8.2f} sec {result['rate']:>12,.0f} {unit}/sec {peak_mb:8.1f} MB')
+  return result
+
+
+# regressions()
+# -------------------------------------------------------------------------------------------------
+def regressions(results: dict, baseline: dict, tolerance: float) -> list:
+  """Steps whose throughput or peak memory is worse than the baseline by more than tolerance."""
+  worse = []
+  for name, result in results.items():
+    if name not in baseline:
+      continue
+    if result['rate'] < baseline[name]['rate'] * (1 - tolerance):
+      worse.append(f'{name}: {result['rate']:,.0f} {result['unit']}/sec '
+                   f'(baseline {baseline[name]['rate']:,.0f})')
+    if result['peak_mb'] > baseline[name]['peak_mb'] * (1 + tolerance):
+      worse.append(f'{name}: {result['peak_mb']:.1f} MB '
+                   f'(baseline {baseline[name]['peak_mb']:.1f} MB)')
+  return worse
+
+
+# main()
+# -------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+  parser = ArgumentParser('Benchmark ingest, descriptions, and statistics on synthetic archives')
+  parser.add_argument('--rules', '-r', type=int, default=100_000)
+  parser.add_argument('--courses', '-c', type=int, default=2_000,
+                      help='courses per institution')
+  parser.add_argument('--insert', '-i', action='store_true',
+                      help='also benchmark the per-row insert loader (slow)')
+  parser.add_argument('--existing', '-e', action='store_true',
+                      help='use the server in the PG* environment instead of a throwaway one')
+  parser.add_argument('--port', '-p', type=int, default=54329)
+  parser.add_argument('--output', '-o', help='save the results as JSON')
+  parser.add_argument('--baseline', '-b', help='compare with saved JSON results')
+  parser.add_argument('--tolerance', '-t', type=float, default=0.2)
+  parser.add_argument('--keep', '-k', action='store_true', help='keep the scratch directory')
+  args = parser.parse_args()
+
+  if args.existing:
+    with psycopg.connect('dbname=cuny_curriculum') as conn:
+      if not claim_scratch_database(conn):
+        exit('The cuny_curriculum database named by the PG* environment variables has tables, '
+             'and the benchmark would overwrite them; point --existing at an empty database')
+
+  work_dir = Path(tempfile.mkdtemp(prefix='rules_bench_'))
+  archive_dir = Path(work_dir, 'archives')
+  print(f'Generating {args.rules:,} synthetic rules in {work_dir}')
+  archive_date = generate(archive_dir, args.rules, courses_per_institution=args.courses)[0]
+  schema_name = f'a{archive_date.replace('-', '')}'
+  rows = {table_name: scan_file(archive_path(archive_date, table_name, archive_dir)).rows
+          for table_name in table_columns}
+  total_rows = sum(rows.values())
+
+  if args.existing:
+    server = nullcontext(dict())
+  else:
+    server = throwaway_postgres(work_dir, args.port)
+
+  results = dict()
+  try:
+    with server as pg_env:
+      # libpq takes the server location from PGHOST and PGPORT, here and in the subprocesses.
+      os.environ.update(pg_env)
+      env = dict(os.environ, RULES_ARCHIVE_DIR=str(archive_dir),
+                 RULES_ARCHIVE_CACHE=str(Path(work_dir, 'cache')))
+      with psycopg.connect('dbname=cuny_curriculum') as conn:
+        load_courses_csv(postgres, conn, Path(archive_dir, 'cuny_courses.csv'))
+      # Build the archive catalog’s manifest first, so the ingest steps don’t include the scan.
+      subprocess.run([sys.executable, 'archive_catalog.py'], cwd=repo_dir, env=env,
+                     stdout=subprocess.DEVNULL, check=True)
+
+      if args.insert:
+        results['ingest (insert)'] = run_step(
+            'ingest (insert)', ['mk_tables.py', '-ad', archive_date, '-l', 'insert'],
+            env, total_rows, 'rows')
+      results['ingest (copy)'] = run_step(
+          'ingest (copy)', ['mk_tables.py', '-ad', archive_date], env, total_rows, 'rows')
+      results['statistics (schema)'] = run_step(
+          'statistics (schema)', ['statistics.py', schema_name], env,
+          rows['source_courses'] + rows['destination_courses'], 'rows')
+      results['statistics (file)'] = run_step(
+          'statistics (file)', ['statistics.py', archive_date], env,
+          rows['source_courses'] + rows['destination_courses'], 'rows')
+      results['descriptions'] = run_step(
+          'descriptions', ['mk_descriptions.py', '-sn', schema_name, '--update_db', 'all'],
+          env, rows['transfer_rules'], 'rules')
+  finally:
+    if not args.keep:
+      shutil.rmtree(work_dir, ignore_errors=True)
+
+  if args.output:
+    Path(args.output).write_text(json.dumps(results, indent=1))
+  if args.baseline:
+    if worse := regressions(results, json.loads(Path(args.baseline).read_text()), args.tolerance):
+      print('Regressions:')
+      for line in worse:
+        print(f'  {line}')
+      exit(1)
+    print(f'No regressions beyond {args.tolerance:.0%} of {args.baseline}')
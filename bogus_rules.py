@@ -0,0 +1,127 @@
+#! /usr/local/bin/python3
+"""Report transfer rules that reference courses not in cuny_courses, for many archives at once.
+
+   The set of valid (course_id, offer_nbr) keys is read from cuny_courses once, and each
+   archive’s source_courses and destination_courses are checked against it in parallel, either
+   from the archive schemata or directly from the archive files. For each archive and table,
+   the distinct (rule_key, course_id, offer_nbr) references to missing courses are written to
+   reports/<schema>.<table>.csv, and a summary of the counts per archive date is printed.
+"""
+
+import csv
+import os
+import psycopg
+
+from archive_catalog import check_archive_set, load_catalog
+from argparse import ArgumentParser
+from columnar_cache import archive_rows
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from list_schemata import list_schemata
+from pathlib import Path
+from psycopg_pool import ConnectionPool
+
+report_dir = Path(Path.cwd(), 'reports')
+table_names = ['source_courses', 'destination_courses']
+
+# Valid course keys, set in each worker process by set_valid_courses()
+valid_courses = set()
+
+
+# get_valid_courses()
+# -------------------------------------------------------------------------------------------------
+def get_valid_courses(conn) -> set:
+  """The (course_id, offer_nbr) keys of all courses in cuny_courses."""
+  with conn.cursor() as cursor:
+    cursor.execute('select course_id, offer_nbr from cuny_courses')
+    return set(cursor.fetchall())
+
+
+# set_valid_courses()
+# -------------------------------------------------------------------------------------------------
+def set_valid_courses(courses: set):
+  """Process pool initializer."""
+  global valid_courses
+  valid_courses = courses
+
+
+# write_report()
+# -------------------------------------------------------------------------------------------------
+def write_report(schema_name: str, table_name: str, bogus: set) -> int:
+  """Write the bogus references for a table to its report file. Returns the number written."""
+  with open(Path(report_dir, f'{schema_name}.{table_name}.csv'), 'w', newline='') as outfile:
+    csv.writer(outfile).writerows(sorted(bogus))
+  return len(bogus)
+
+
+# check_archive()
+# -------------------------------------------------------------------------------------------------
+def check_archive(archive_date: str, archive_set=None) -> tuple:
+  """Process pool worker: check an archive set’s files. Returns (schema_name, counts)."""
+  schema_name = f'a{archive_date.replace('-', '')}'
+  counts = dict()
+  for table_name in table_names:
+    bogus = set()
+    for row in archive_rows(archive_date, table_name, archive_set):
+      # Course ids are the columns following rule_key, or rule_key, src_inst, and dst_inst.
+      course_id, offer_nbr = (row[3], row[4]) if table_name == 'source_courses' else row[1:3]
+      course = (int(course_id), int(offer_nbr))
+      if course not in valid_courses:
+        bogus.add((row[0], ) + course)
+    counts[table_name] = write_report(schema_name, table_name, bogus)
+  return schema_name, counts
+
+
+# check_schema()
+# -------------------------------------------------------------------------------------------------
+def check_schema(pool, schema_name: str) -> tuple:
+  """Thread pool worker: check a schema’s tables. Returns (schema_name, counts)."""
+  counts = dict()
+  with pool.connection() as conn:
+    with conn.cursor() as cursor:
+      for table_name in table_names:
+        cursor.execute(f"""
+        select distinct rule_key, course_id, offer_nbr from {schema_name}.{table_name}
+        """)
+        bogus = {row for row in cursor if row[1:] not in valid_courses}
+        counts[table_name] = write_report(schema_name, table_name, bogus)
+  return schema_name, counts
+
+
+# main()
+# -------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+  parser = ArgumentParser('Report rules that reference courses missing from cuny_courses')
+  parser.add_argument('--files', '-f', action='store_true',
+                      help='check the archive files instead of the archive schemata')
+  parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count())
+  parser.add_argument('archives', nargs='*',
+                      help='schema names (or archive dates with --files); default is all')
+  args = parser.parse_args()
+
+  report_dir.mkdir(exist_ok=True)
+  jobs = max(1, args.jobs)
+  with psycopg.connect('dbname=cuny_curriculum') as conn:
+    valid_courses = get_valid_courses(conn)
+    schemata = [] if args.files else (args.archives or list_schemata(conn))
+  print(f'{len(valid_courses):,} courses in cuny_courses')
+
+  if args.files:
+    catalog = load_catalog()
+    archive_dates = args.archives or catalog.dates
+    with ProcessPoolExecutor(max_workers=jobs, initializer=set_valid_courses,
+                             initargs=(valid_courses, )) as executor:
+      results = list(executor.map(check_archive, archive_dates,
+                                  [check_archive_set(catalog, archive_date)
+                                   for archive_date in archive_dates]))
+  else:
+    with ConnectionPool('dbname=cuny_curriculum', min_size=1, max_size=jobs) as pool:
+      with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(lambda schema_name: check_schema(pool, schema_name),
+                                    schemata))
+
+  # Summary
+  print(f'{"Archive":10} {"Source":>10} {"Destination":>12}')
+  for schema_name, counts in sorted(results):
+    archive_date = f'{schema_name[1:5]}-{schema_name[5:7]}-{schema_name[7:9]}'
+    print(f'{archive_date:10} {counts['source_courses']:>10,} '
+          f'{counts['destination_courses']:>12,}')
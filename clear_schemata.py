@@ -1,20 +1,54 @@
 #! /usr/local/bin/python3
 # OBSOLETE Separate schemas for each archive date no longer being used.
 
-"""Drop all schemata created by mk_tables."""
+"""Drop all schemata created by mk_tables, and the descriptions in the rule_descriptions
+   dictionary that their rules used.
 
+   With --layout partitioned, detach and drop archive dates’ partitions of the partitioned tables
+   instead: all of them, or just the ones before a date.
+"""
+
+import datetime
+import partitioned_tables
 import psycopg
 
+from argparse import ArgumentParser
+from mk_descriptions import prune_dictionary
+
 if __name__ == '__main__':
+  parser = ArgumentParser('Drop archive schemata or partitions')
+  parser.add_argument('--layout', '-lo', choices=['schemata', 'partitioned'], default='schemata')
+  parser.add_argument('--before', '-b', metavar='YYYY-MM-DD',
+                      help='only drop the partitions of archive dates before this one')
+  args = parser.parse_args()
+  if args.before and args.layout != 'partitioned':
+    parser.error('--before needs --layout partitioned')
+  if args.before:
+    try:
+      before = datetime.date.fromisoformat(args.before)
+    except ValueError:
+      parser.error(f'{args.before} is not a YYYY-MM-DD date')
+
   with psycopg.connect('dbname=cuny_curriculum') as conn:
     with conn.cursor() as cursor:
-      cursor.execute("""
-      select schema_name
-        from information_schema.schemata
-       where schema_name ~* '^a20' -- names are “aYYYY-MM-DD”, so this selects all in 21st century
-       """)
-      rows = cursor.fetchall()
-      for row in rows:
-        schema_name = row[0]
-        print(f'Drop {schema_name}')
-        cursor.execute(f'drop schema {schema_name} cascade')
+      if args.layout == 'partitioned':
+        # Each date’s partitions are dropped in a transaction of their own.
+        conn.autocommit = True
+        for archive_date in partitioned_tables.list_partitions(cursor):
+          if args.before and datetime.date.fromisoformat(archive_date) >= before:
+            break
+          print(f'Drop {archive_date} partitions')
+          with conn.transaction():
+            partitioned_tables.drop_partitions(cursor, archive_date)
+      else:
+        cursor.execute("""
+        select schema_name
+          from information_schema.schemata
+         where schema_name ~* '^a20' -- names are “aYYYY-MM-DD”, so this selects all in 21st century
+         """)
+        rows = cursor.fetchall()
+        for row in rows:
+          schema_name = row[0]
+          print(f'Drop {schema_name}')
+          cursor.execute(f'drop schema {schema_name} cascade')
+        print(f'Drop {prune_dictionary(cursor):,} unused descriptions')
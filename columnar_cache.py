@@ -0,0 +1,231 @@
+#! /usr/local/bin/python3
+"""Convert archive sets to a compact columnar format that can be memory-mapped.
+
+   Each archive set is decompressed and parsed once, and its columns are written as raw arrays
+   in a directory named for the archive date under the cache directory:
+
+     rule_keys.txt                    Dictionary of rule_keys, one per line; other tables refer
+                                      to rule_keys by their (uint32) line index.
+     credit_src.txt                   Dictionary of source_courses.credit_src values.
+     <table>.<column>.<typecode>      One array per column, in native byte order.
+     meta.json                        Row counts, byte order, and checksums of the source files.
+
+   Integer columns are int32, credits and grades are float32, and effective dates are stored
+   as int32 proleptic Gregorian ordinals. Reading a cached archive maps the files into memory
+   and returns memoryviews of them, so nothing is decompressed or copied.
+
+   A cached archive set is current only while the checksums in its meta.json match the catalog’s
+   for the archive files; one built from files that have since been rewritten is rebuilt. The
+   functions here take the checked archive set (archive_catalog.check_archive_set()) from callers
+   that already have it, so the catalog is loaded once per run rather than once per call.
+"""
+
+import datetime
+import json
+import math
+import mmap
+import os
+import shutil
+import sys
+
+from archive_catalog import ArchiveSet, check_archive_set, load_catalog
+from archive_files import archive_path, batch_rows_of, cache_dir, read_batches
+from argparse import ArgumentParser
+from array import array
+from pathlib import Path
+
+columnar_dir = Path(cache_dir, 'columnar')
+
+# Typecode of each cached column, by table. rule_key and credit_src are dictionary-encoded.
+column_types = {'transfer_rules': {'rule_key': 'I', 'effective_date': 'i'},
+                'source_courses': {'rule_key': 'I', 'course_id': 'i', 'offer_nbr': 'i',
+                                   'min_credits': 'f', 'max_credits': 'f', 'credit_src': 'H',
+                                   'min_grade': 'f', 'max_grade': 'f'},
+                'destination_courses': {'rule_key': 'I', 'course_id': 'i', 'offer_nbr': 'i',
+                                        'credits': 'f'}}
+
+
+# to_float()
+# -------------------------------------------------------------------------------------------------
+def to_float(value) -> float:
+  """Archive value to float; empty strings become NaN (and are read back as None)."""
+  return math.nan if value == '' else float(value)
+
+
+# from_float32()
+# -------------------------------------------------------------------------------------------------
+def from_float32(value: float) -> float | None:
+  """Undo float32 rounding noise, so a stored 3.7 reads back as 3.7 rather than 3.7000000477."""
+  return None if math.isnan(value) else float(f'{value:.7g}')
+
+
+# checked_set()
+# -------------------------------------------------------------------------------------------------
+def checked_set(archive_date: str, archive_set: ArchiveSet | None = None) -> ArchiveSet | None:
+  """The archive set passed in, or the date’s set from the catalog, with its files checked."""
+  return archive_set or check_archive_set(load_catalog(), archive_date)
+
+
+# convert()
+# -------------------------------------------------------------------------------------------------
+def convert(archive_date: str, archive_set: ArchiveSet | None = None) -> Path:
+  """Write the columnar version of an archive set. Returns the directory written."""
+  archive_set = checked_set(archive_date, archive_set)
+  if archive_set is None or not archive_set.is_complete:
+    raise FileNotFoundError(f'{archive_date} archive set is incomplete')
+
+  rule_ids = dict()
+  credit_srcs = dict()
+  columns = {table_name: {column: array(typecode) for column, typecode in types.items()}
+             for table_name, types in column_types.items()}
+
+  for table_name, table in columns.items():
+    path = archive_set.files[table_name].path
+    for batch in read_batches(table_name, path):
+      table['rule_key'].extend([rule_ids.setdefault(rule_key, len(rule_ids))
+                                for rule_key in batch[0]])
+      match table_name:
+        case 'transfer_rules':
+          table['effective_date'].extend([datetime.date.fromisoformat(effective_date).toordinal()
+                                          for effective_date in batch[1]])
+        case 'source_courses':
+          table['course_id'].extend(map(int, batch[3]))
+          table['offer_nbr'].extend(map(int, batch[4]))
+          table['min_credits'].extend(map(to_float, batch[5]))
+          table['max_credits'].extend(map(to_float, batch[6]))
+          table['credit_src'].extend([credit_srcs.setdefault(credit_src, len(credit_srcs))
+                                      for credit_src in batch[7]])
+          table['min_grade'].extend(batch[8])
+          table['max_grade'].extend(batch[9])
+        case 'destination_courses':
+          table['course_id'].extend(map(int, batch[1]))
+          table['offer_nbr'].extend(map(int, batch[2]))
+          table['credits'].extend(map(to_float, batch[3]))
+
+  # Write into a scratch directory, and rename it into place when complete.
+  target_dir = Path(columnar_dir, archive_date)
+  scratch_dir = target_dir.with_name(f'{archive_date}.tmp')
+  shutil.rmtree(scratch_dir, ignore_errors=True)
+  scratch_dir.mkdir(parents=True)
+  Path(scratch_dir, 'rule_keys.txt').write_text(''.join(f'{key}\n' for key in rule_ids))
+  Path(scratch_dir, 'credit_src.txt').write_text(''.join(f'{src}\n' for src in credit_srcs))
+  for table_name, table in columns.items():
+    for column, values in table.items():
+      with open(Path(scratch_dir, f'{table_name}.{column}.{values.typecode}'), 'wb') as outfile:
+        values.tofile(outfile)
+  meta = {'archive_date': archive_date,
+          'byteorder': sys.byteorder,
+          'rows': {table_name: len(table['rule_key']) for table_name, table in columns.items()},
+          'sha256': {table_name: archive_set.files[table_name].sha256
+                     for table_name in column_types}}
+  Path(scratch_dir, 'meta.json').write_text(json.dumps(meta, indent=1))
+  shutil.rmtree(target_dir, ignore_errors=True)
+  scratch_dir.rename(target_dir)
+  return target_dir
+
+
+# is_cached()
+# -------------------------------------------------------------------------------------------------
+def is_cached(archive_date: str, archive_set: ArchiveSet | None = None) -> bool:
+  """Whether a completed columnar version of an archive set exists, made from the archive files
+     as they are now.
+  """
+  try:
+    meta = json.loads(Path(columnar_dir, archive_date, 'meta.json').read_text())
+  except (FileNotFoundError, json.JSONDecodeError):
+    return False
+  archive_set = checked_set(archive_date, archive_set)
+  if archive_set is None or not archive_set.is_complete:
+    return False
+  return all(meta['sha256'].get(table_name) == archive_set.files[table_name].sha256
+             for table_name in column_types)
+
+
+class ColumnarArchive:
+  """Read-only, memory-mapped access to a cached archive set."""
+
+  def __init__(self, archive_date: str):
+    self.archive_date = archive_date
+    self.path = Path(columnar_dir, archive_date)
+    self.meta = json.loads(Path(self.path, 'meta.json').read_text())
+    if self.meta['byteorder'] != sys.byteorder:
+      raise ValueError(f'{archive_date} columnar cache was written with '
+                       f'{self.meta['byteorder']}-endian byte order')
+    self.rule_keys = Path(self.path, 'rule_keys.txt').read_text().splitlines()
+    self.credit_srcs = Path(self.path, 'credit_src.txt').read_text().splitlines()
+
+  def num_rows(self, table_name: str) -> int:
+    return self.meta['rows'][table_name]
+
+  def column(self, table_name: str, column: str) -> memoryview:
+    """A column’s values as a memoryview of the mapped file."""
+    typecode = column_types[table_name][column]
+    with open(Path(self.path, f'{table_name}.{column}.{typecode}'), 'rb') as infile:
+      if os.fstat(infile.fileno()).st_size == 0:
+        return memoryview(array(typecode))
+      return memoryview(mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)).cast(typecode)
+
+  def rows(self, table_name: str):
+    """Generate the rows of a table in the same form as archive_files.read_rows()."""
+    rule_keys = self.rule_keys
+    columns = [self.column(table_name, column) for column in column_types[table_name]]
+    match table_name:
+      case 'transfer_rules':
+        for rule_id, effective_date in zip(*columns):
+          yield [rule_keys[rule_id], datetime.date.fromordinal(effective_date).isoformat()]
+      case 'source_courses':
+        credit_srcs = self.credit_srcs
+        for (rule_id, course_id, offer_nbr, min_credits, max_credits, credit_src,
+             min_grade, max_grade) in zip(*columns):
+          rule_key = rule_keys[rule_id]
+          yield [rule_key, rule_key[0:5], rule_key[6:11], course_id, offer_nbr,
+                 from_float32(min_credits), from_float32(max_credits), credit_srcs[credit_src],
+                 from_float32(min_grade), from_float32(max_grade)]
+      case 'destination_courses':
+        for rule_id, course_id, offer_nbr, credits in zip(*columns):
+          yield [rule_keys[rule_id], course_id, offer_nbr, from_float32(credits)]
+
+
+# cached_archive()
+# -------------------------------------------------------------------------------------------------
+def cached_archive(archive_date: str, archive_set: ArchiveSet | None = None) -> ColumnarArchive:
+  """The columnar version of an archive set, converting it first if it is missing or stale."""
+  archive_set = checked_set(archive_date, archive_set)
+  if not is_cached(archive_date, archive_set):
+    convert(archive_date, archive_set)
+  return ColumnarArchive(archive_date)
+
+
+# archive_rows()
+# -------------------------------------------------------------------------------------------------
+def archive_rows(archive_date: str, table_name: str, archive_set: ArchiveSet | None = None):
+  """Rows of an archive file, from the columnar cache if available, else from the bz2 file. A
+     stale cache is rebuilt first.
+  """
+  archive_set = checked_set(archive_date, archive_set)
+  if not is_cached(archive_date, archive_set) and Path(columnar_dir, archive_date).is_dir():
+    convert(archive_date, archive_set)
+  if is_cached(archive_date, archive_set):
+    return ColumnarArchive(archive_date).rows(table_name)
+  return batch_rows_of(read_batches(table_name, archive_path(archive_date, table_name)))
+
+
+# main()
+# -------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+  parser = ArgumentParser('Convert archive sets to columnar form')
+  parser.add_argument('--force', '-f', action='store_true')
+  parser.add_argument('archive_dates', nargs='*', metavar='YYYY-MM-DD',
+                      help='default is all archive dates not already converted')
+  args = parser.parse_args()
+
+  catalog = load_catalog()
+  archive_dates = args.archive_dates if args.archive_dates else catalog.dates
+  for archive_date in archive_dates:
+    archive_set = check_archive_set(catalog, archive_date)
+    if is_cached(archive_date, archive_set) and not args.force:
+      continue
+    print(f'{archive_date} ', end='', flush=True)
+    path = convert(archive_date, archive_set)
+    size = sum(file.stat().st_size for file in path.iterdir())
+    print(f'{size:,} bytes')
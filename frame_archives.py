@@ -0,0 +1,365 @@
+#! /usr/local/bin/python3
+"""Recompress archive files into independently compressed zstd frames, for parallel
+   decompression and random access by rule_key.
+
+   A bz2 archive file is a single stream: reading any of it means decompressing it from the
+   start, on one core. A frame archive, written to the frames directory under the cache directory
+   with the bz2 file’s name and a .csv.zst suffix, holds the same CSV lines sorted by rule_key
+   (stably, so each rule’s lines keep their order), split into frames of about frame_bytes. The
+   lines are sorted in runs of run_bytes, which are merged, so memory use doesn’t grow with the
+   size of the file. The frames concatenate to a standard .zst file. The frame index, in a
+   .csv.zst.json file, records each frame’s offset, length, number of lines, and first and last
+   rule_keys, plus the path, size, and mtime of the bz2 file it was made from.
+
+   The bz2 files remain the archive of record, and their directory is left untouched. A frame
+   archive is read only when a reader asks for it: current_frames() gives the frame archive for a
+   bz2 file if it is up to date, and archive_files.read_rows() and read_batches() read a .csv.zst
+   path given to them, decompressing its frames on several threads. Readers that want rule_key
+   order, like rule_diff.sorted_rows(), use it; loads read the bz2 files, so the serial ids they
+   assign follow the file order whether or not there is a frame archive. prefix_rows() reads only
+   the frames that can hold the rule_keys starting with a prefix, such as one sending/receiving
+   institution pair.
+
+   Archive values are never quoted in practice, so lines are sorted as they are. If a quoted
+   value does turn up, the records around it are parsed with the csv module and written back in
+   csv.writer’s form, and a record may then span lines.
+
+   Requires the zstandard package.
+"""
+
+import bz2
+import csv
+import heapq
+import io
+import json
+import os
+import tempfile
+
+from archive_catalog import load_catalog
+from archive_files import (archive_path, cache_dir, normalize_source_course, read_rows,
+                           table_columns)
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
+
+frames_dir = Path(cache_dir, 'frames')
+
+frame_bytes = 1 << 20   # Uncompressed bytes per frame
+run_bytes = 1 << 26     # Uncompressed bytes of lines sorted in memory at a time
+level = 10              # zstd compression level
+jobs = os.cpu_count()   # Threads for compressing and decompressing frames
+
+
+# frames_path()
+# -------------------------------------------------------------------------------------------------
+def frames_path(path: Path) -> Path:
+  """The frame archive for a bz2 archive file."""
+  return Path(frames_dir, Path(path).with_suffix('.zst').name)
+
+
+# index_path()
+# -------------------------------------------------------------------------------------------------
+def index_path(frames_path: Path) -> Path:
+  return frames_path.with_name(f'{frames_path.name}.json')
+
+
+# load_index()
+# -------------------------------------------------------------------------------------------------
+def load_index(frames_path: Path) -> dict:
+  return json.loads(index_path(frames_path).read_text())
+
+
+# current_frames()
+# -------------------------------------------------------------------------------------------------
+def current_frames(path: Path) -> Path | None:
+  """The frame archive for a bz2 archive file, if there is one made from the file as it is now
+     and zstandard is available to read it; otherwise None.
+  """
+  candidate = frames_path(path)
+  if zstandard is None or not candidate.is_file():
+    return None
+  try:
+    source = load_index(candidate)['source']
+    stat = Path(path).stat()
+  except (FileNotFoundError, json.JSONDecodeError, KeyError):
+    return None
+  if (source.get('path') != str(Path(path).resolve())
+     or source['size'] != stat.st_size or source['mtime_ns'] != stat.st_mtime_ns):
+    return None
+  return candidate
+
+
+# line_rule_key()
+# -------------------------------------------------------------------------------------------------
+def line_rule_key(line: bytes) -> bytes:
+  return line.split(b',', 1)[0]
+
+
+# chunk_records()
+# -------------------------------------------------------------------------------------------------
+def chunk_records(chunk: bytes) -> list:
+  """Split a chunk of complete CSV records into records, each ending with a newline.
+
+     Without quotes in the chunk, the records are its lines. Otherwise the chunk is parsed with
+     the csv module and each row written back by csv.writer, so quoted values can hold commas and
+     newlines.
+  """
+  if b'"' not in chunk:
+    lines = chunk.splitlines(keepends=True)
+    if not lines[-1].endswith(b'\n'):
+      lines[-1] += b'\n'
+    return lines
+  records = []
+  outfile = io.StringIO()
+  writer = csv.writer(outfile, lineterminator='\n')
+  for row in csv.reader(io.StringIO(chunk.decode(), newline='')):
+    writer.writerow(row)
+    records.append(outfile.getvalue().encode())
+    outfile.seek(0)
+    outfile.truncate()
+  return records
+
+
+# read_records()
+# -------------------------------------------------------------------------------------------------
+def read_records(infile):
+  """Generate the records of a file written by chunk_records(): lines, joined while a quoted
+     value is open.
+  """
+  record = b''
+  for line in infile:
+    record += line
+    if record.count(b'"') % 2 == 0:
+      yield record
+      record = b''
+  if record:
+    yield record
+
+
+# sorted_lines()
+# -------------------------------------------------------------------------------------------------
+def sorted_lines(path: Path, run_bytes: int = run_bytes):
+  """Generate the records of a bz2 archive file, each ending with a newline, stably sorted by
+     rule_key. Runs of about run_bytes are sorted in memory and spilled to temporary files, which
+     are merged. Records are lines unless the file has quoted values (chunk_records()).
+  """
+  with bz2.open(path) as infile, tempfile.TemporaryDirectory() as temp_dir:
+    run_paths = []
+    quoted = False
+    while chunk := infile.read(run_bytes):
+      chunk += infile.readline()
+      # An odd number of quotes means the chunk ends inside a quoted value.
+      while chunk.count(b'"') % 2 and (line := infile.readline()):
+        chunk += line
+      quoted = quoted or b'"' in chunk
+      lines = chunk_records(chunk)
+      del chunk
+      lines.sort(key=line_rule_key)
+      if not run_paths and not infile.peek(1):
+        # The whole file fits in one run.
+        yield from lines
+        return
+      run_paths.append(Path(temp_dir, f'run_{len(run_paths)}'))
+      with open(run_paths[-1], 'wb') as outfile:
+        outfile.writelines(lines)
+      del lines
+    runs = [open(run_path, 'rb') for run_path in run_paths]
+    try:
+      # heapq.merge() takes equal rule_keys from earlier runs first, so the sort stays stable.
+      yield from heapq.merge(*(map(read_records, runs) if quoted else runs), key=line_rule_key)
+    finally:
+      for run in runs:
+        run.close()
+
+
+# recompress()
+# -------------------------------------------------------------------------------------------------
+def recompress(path: Path, frame_bytes: int = frame_bytes, level: int = level,
+               jobs: int = jobs) -> Path:
+  """Write the frame archive and frame index for a bz2 archive file. Returns the frame archive’s
+     path.
+
+     Frames are compressed on jobs threads, with at most 2 × jobs of them in memory at once.
+  """
+  if zstandard is None:
+    raise ModuleNotFoundError('Frame archives need the zstandard package')
+  path = Path(path)
+  stat = path.stat()
+
+  def frames():
+    """The lines of each frame. Frames end at line boundaries."""
+    lines = []
+    size = 0
+    for line in sorted_lines(path):
+      lines.append(line)
+      size += len(line)
+      if size >= frame_bytes:
+        yield lines
+        lines, size = [], 0
+    if lines:
+      yield lines
+
+  def compress(lines):
+    return (zstandard.ZstdCompressor(level=level).compress(b''.join(lines)), len(lines),
+            line_rule_key(lines[0]).decode(), line_rule_key(lines[-1]).decode())
+
+  target = frames_path(path)
+  target.parent.mkdir(parents=True, exist_ok=True)
+  scratch = target.with_name(f'{target.name}.tmp')
+  index = {'source': {'path': str(path.resolve()),
+                      'size': stat.st_size,
+                      'mtime_ns': stat.st_mtime_ns},
+           'frame_bytes': frame_bytes,
+           'rows': 0,
+           'frames': []}
+  offset = 0
+  with ThreadPoolExecutor(max_workers=jobs) as executor, open(scratch, 'wb') as outfile:
+    pending = deque()
+
+    def write_next():
+      nonlocal offset
+      compressed, num_lines, first_key, last_key = pending.popleft().result()
+      outfile.write(compressed)
+      index['frames'].append([offset, len(compressed), num_lines, first_key, last_key])
+      index['rows'] += num_lines
+      offset += len(compressed)
+
+    for lines in frames():
+      pending.append(executor.submit(compress, lines))
+      if len(pending) >= 2 * jobs:
+        write_next()
+    while pending:
+      write_next()
+  # The index is written last, so a frame archive without one is incomplete and not used.
+  index_path(target).unlink(missing_ok=True)
+  scratch.replace(target)
+  index_path(scratch).write_text(json.dumps(index))
+  index_path(scratch).replace(index_path(target))
+  return target
+
+
+# prefix_frames()
+# -------------------------------------------------------------------------------------------------
+def prefix_frames(frames: list, prefix: str) -> list:
+  """The frames that can contain rule_keys starting with prefix."""
+  return [frame for frame in frames
+          if frame[4] >= prefix and (frame[3] < prefix or frame[3].startswith(prefix))]
+
+
+class FrameReader(io.RawIOBase):
+  """The decompressed contents of a sequence of frames, decompressed ahead of the reader on a
+     pool of threads (zstd releases the GIL).
+  """
+
+  def __init__(self, path: Path, frames: list, jobs: int = jobs):
+    self.fd = os.open(path, os.O_RDONLY)
+    self.frames = iter(frames)
+    self.executor = ThreadPoolExecutor(max_workers=jobs)
+    self.pending = deque()
+    self.buffer = memoryview(b'')
+    for _ in range(2 * jobs):
+      self.submit_next()
+
+  def decompress(self, frame) -> bytes:
+    offset, length, *_ = frame
+    return zstandard.ZstdDecompressor().decompress(os.pread(self.fd, length, offset))
+
+  def submit_next(self):
+    if (frame := next(self.frames, None)) is not None:
+      self.pending.append(self.executor.submit(self.decompress, frame))
+
+  def readable(self) -> bool:
+    return True
+
+  def readinto(self, buffer) -> int:
+    while not self.buffer:
+      if not self.pending:
+        return 0
+      self.buffer = memoryview(self.pending.popleft().result())
+      self.submit_next()
+    size = min(len(buffer), len(self.buffer))
+    buffer[:size] = self.buffer[:size]
+    self.buffer = self.buffer[size:]
+    return size
+
+  def close(self):
+    if not self.closed:
+      self.executor.shutdown(cancel_futures=True)
+      os.close(self.fd)
+    super().close()
+
+
+# open_frames()
+# -------------------------------------------------------------------------------------------------
+def open_frames(frames_path: Path, prefix: str | None = None, jobs: int = jobs):
+  """Open a frame archive for reading as text, like bz2.open(mode='rt'). With a prefix, only the
+     frames that can contain rule_keys starting with it are read.
+  """
+  if zstandard is None:
+    raise ModuleNotFoundError('Frame archives need the zstandard package')
+  frames = load_index(frames_path)['frames']
+  if prefix is not None:
+    frames = prefix_frames(frames, prefix)
+  return io.TextIOWrapper(io.BufferedReader(FrameReader(frames_path, frames, jobs)))
+
+
+# prefix_rows()
+# -------------------------------------------------------------------------------------------------
+def prefix_rows(table_name: str, path: Path, prefix: str):
+  """Generate the rows, normalized as by read_rows(), of the rules in an archive file whose
+     rule_keys start with prefix. Without a current frame archive, the whole bz2 file is read.
+  """
+  if frames := current_frames(path):
+    with open_frames(frames, prefix) as infile:
+      rows = (row for row in csv.reader(infile) if row[0].startswith(prefix))
+      if table_name == 'source_courses':
+        yield from map(normalize_source_course, rows)
+      else:
+        yield from rows
+  else:
+    yield from (row for row in read_rows(table_name, path) if row[0].startswith(prefix))
+
+
+# main()
+# -------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+  parser = ArgumentParser('Recompress archive sets into zstd frame archives')
+  parser.add_argument('archive_dates', nargs='*', metavar='YYYY-MM-DD',
+                      help='default is all archive dates without current frame archives')
+  parser.add_argument('--force', '-f', action='store_true')
+  parser.add_argument('--level', '-l', type=int, default=level)
+  parser.add_argument('--frame_bytes', '-fb', type=int, default=frame_bytes)
+  parser.add_argument('--jobs', '-j', type=int, default=jobs)
+  parser.add_argument('--prefix', '-p', metavar='RULE_KEY_PREFIX',
+                      help='instead of recompressing, list the rows of the archive dates’ rules '
+                      'that start with this prefix')
+  args = parser.parse_args()
+
+  if zstandard is None:
+    exit('Frame archives need the zstandard package')
+  archive_dates = args.archive_dates if args.archive_dates else load_catalog().dates
+
+  if args.prefix:
+    for archive_date in archive_dates:
+      for table_name in table_columns:
+        path = archive_path(archive_date, table_name)
+        for row in prefix_rows(table_name, path, args.prefix):
+          print(archive_date, table_name, ','.join(map(str, row)))
+    exit()
+
+  for archive_date in archive_dates:
+    for table_name in table_columns:
+      path = archive_path(archive_date, table_name)
+      if current_frames(path) and not args.force:
+        continue
+      print(f'{path.name} ', end='', flush=True)
+      target = recompress(path, args.frame_bytes, args.level, args.jobs)
+      index = load_index(target)
+      print(f'{path.stat().st_size:,} → {target.stat().st_size:,} bytes in '
+            f'{len(index['frames'])} frames')
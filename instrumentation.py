@@ -0,0 +1,199 @@
+"""Per-phase timing, throughput, and memory instrumentation for mk_tables.py and mk_descriptions.py.
+
+   Each phase of a run (decompress/parse, insert, catalog fetch, description build, db update)
+   records its wall time, rows processed, rows/second, and the process’s peak RSS so far. The
+   records are kept for a summary at the end of the run, and are optionally appended as JSON
+   lines to a log file. With profiling enabled, each Phase block also runs a sampling profiler
+   and prints the functions where the samples landed.
+"""
+
+import json
+import os
+import resource
+import signal
+import sys
+import time
+
+from collections import Counter
+from pathlib import Path
+
+log_path = None
+profiling = False
+phases = []
+
+
+# configure()
+# -------------------------------------------------------------------------------------------------
+def configure(log_json: str | None = None, profile: bool = False):
+  """Set the JSON lines log file (None for no log) and whether to profile Phase blocks."""
+  global log_path, profiling
+  log_path = Path(log_json) if log_json else None
+  profiling = profile
+
+
+# settings()
+# -------------------------------------------------------------------------------------------------
+def settings() -> tuple:
+  """The arguments to configure() that reproduce this process’s configuration, for worker
+     processes, which don’t inherit it unless they are forked.
+  """
+  return (str(log_path) if log_path else None, profiling)
+
+
+# detailed()
+# -------------------------------------------------------------------------------------------------
+def detailed() -> bool:
+  """Whether phases are logged or profiled, and worth the cost of finer-grained metering, such
+     as MeteredRows’ timing of every row.
+  """
+  return log_path is not None or profiling
+
+
+# peak_rss_mb()
+# -------------------------------------------------------------------------------------------------
+def peak_rss_mb() -> float:
+  """Peak resident set size of this process so far, in MB."""
+  max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # ru_maxrss is in kilobytes on Linux and bytes on macOS
+  return max_rss / (1 << 20 if sys.platform == 'darwin' else 1 << 10)
+
+
+# record()
+# -------------------------------------------------------------------------------------------------
+def record(name: str, seconds: float, rows: int = 0, **fields) -> dict:
+  """Record a completed phase, and append it to the log file if there is one."""
+  entry = {'script': Path(sys.argv[0]).name,
+           'pid': os.getpid(),
+           'phase': name,
+           **fields,
+           'seconds': round(seconds, 6),
+           'rows': rows,
+           'rows_per_sec': round(rows / seconds, 1) if seconds > 0 else None,
+           'peak_rss_mb': round(peak_rss_mb(), 1),
+           'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+  phases.append(entry)
+  if log_path:
+    # One write per line in append mode, so concurrent worker processes don’t interleave lines.
+    with open(log_path, 'a') as log_file:
+      log_file.write(json.dumps(entry) + '\n')
+  return entry
+
+
+# summary()
+# -------------------------------------------------------------------------------------------------
+def summary(file=sys.stdout):
+  """Print a table of the phases recorded by this process."""
+  if not phases:
+    return
+  width = max(len(entry['phase']) for entry in phases)
+  print(f'{"Phase":{width}} {"Seconds":>9} {"Rows":>12} {"Rows/sec":>12} {"Peak MB":>9}',
+        file=file)
+  for entry in phases:
+    rate = f'{entry['rows_per_sec']:,.0f}' if entry['rows_per_sec'] else ''
+    print(f'{entry['phase']:{width}} {entry['seconds']:9.2f} {entry['rows']:>12,} {rate:>12} '
+          f'{entry['peak_rss_mb']:9.1f}', file=file)
+
+
+class MeteredRows:
+  """Iterate over rows, counting them and timing how long it takes to produce them (the
+     decompress/parse share of a load). Each row costs a generator step and two clock reads, so
+     it’s used only when detailed() is true.
+  """
+
+  def __init__(self, rows):
+    self.iterator = iter(rows)
+    self.rows = 0
+    self.seconds = 0.0
+
+  def __iter__(self):
+    perf_counter = time.perf_counter
+    iterator = self.iterator
+    while True:
+      start = perf_counter()
+      try:
+        row = next(iterator)
+      except StopIteration:
+        self.seconds += perf_counter() - start
+        return
+      self.seconds += perf_counter() - start
+      self.rows += 1
+      yield row
+
+
+class Sampler:
+  """Sampling profiler: a SIGPROF timer interrupts the main thread every interval seconds of CPU
+     time, and the functions on the stack at that moment are counted.
+  """
+
+  def __init__(self, interval: float = 0.005):
+    self.interval = interval
+    self.samples = 0
+    self.own = Counter()          # Samples with the function at the top of the stack
+    self.cumulative = Counter()   # Samples with the function anywhere on the stack
+    self.previous_handler = None
+
+  def sample(self, signum, frame):
+    self.samples += 1
+    seen = set()
+    top = True
+    while frame is not None:
+      code = frame.f_code
+      key = (code.co_name, Path(code.co_filename).name, code.co_firstlineno)
+      if top:
+        self.own[key] += 1
+        top = False
+      if key not in seen:
+        self.cumulative[key] += 1
+        seen.add(key)
+      frame = frame.f_back
+
+  def start(self):
+    self.previous_handler = signal.signal(signal.SIGPROF, self.sample)
+    signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+  def stop(self):
+    signal.setitimer(signal.ITIMER_PROF, 0, 0)
+    signal.signal(signal.SIGPROF, self.previous_handler or signal.SIG_DFL)
+
+  def report(self, title: str, limit: int = 15, file=sys.stderr):
+    print(f'\nProfile of {title}: {self.samples:,} samples every {self.interval * 1000:.0f} ms',
+          file=file)
+    if not self.samples:
+      return
+    print(f'{"Own %":>7} {"Cum %":>7}  Function', file=file)
+    for key, count in self.own.most_common(limit):
+      name, filename, lineno = key
+      print(f'{100 * count / self.samples:7.1f} {100 * self.cumulative[key] / self.samples:7.1f}'
+            f'  {name} ({filename}:{lineno})', file=file)
+
+
+class Phase:
+  """Time a block as a named phase, recording it on exit.
+
+     Set rows to the number of rows processed, and excluded to any seconds of the block that
+     belong to a different phase (such as the decompress/parse time of a load).
+  """
+
+  def __init__(self, name: str, rows: int = 0, **fields):
+    self.name = name
+    self.rows = rows
+    self.fields = fields
+    self.excluded = 0.0
+    self.elapsed = 0.0
+    self.sampler = None
+
+  def __enter__(self):
+    if profiling:
+      self.sampler = Sampler()
+      self.sampler.start()
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.elapsed = time.perf_counter() - self.start
+    if self.sampler:
+      self.sampler.stop()
+      self.sampler.report(self.name)
+    if exc_type is None:
+      record(self.name, self.elapsed - self.excluded, self.rows, **self.fields)
+    return False
@@ -3,12 +3,23 @@
 
 import psycopg
 
-with psycopg.connect('dbname=cuny_curriculum') as conn:
+
+# list_schemata()
+# -------------------------------------------------------------------------------------------------
+def list_schemata(conn) -> list:
+  """Names of the archive schemata, in date order."""
   with conn.cursor() as cursor:
     cursor.execute("""
     select schema_name
       from information_schema.schemata
      where schema_name ~* '^a20'
     order by schema_name""")
-    for row in cursor:
-      print(row[0])
+    return [row[0] for row in cursor]
+
+
+# main()
+# -------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+  with psycopg.connect('dbname=cuny_curriculum') as conn:
+    for schema_name in list_schemata(conn):
+      print(schema_name)
@@ -1,42 +1,212 @@
 #! /usr/local/bin/python3
 # OBSOLETE: Use the module of the same name in the rule_descriptions project instead.
 """Generate the canonical description for each rule in a schema’s transfer_rules table.
+
+   Each distinct description is stored once, in the public rule_descriptions dictionary, keyed by
+   a digest of its text; a schema’s transfer_rules rows refer to theirs by description_id, and
+   their description column is left empty. The schema’s described_rules view gives each rule
+   with its description text, and is where readers of transfer_rules.description should look.
+
+   Descriptions no rule refers to any more are pruned from the dictionary when schemata are
+   dropped (clear_schemata.py) or replaced by a rebuild (mk_tables.py --rebuild); until then,
+   ones replaced by rewriting a schema’s descriptions stay in it.
 """
 
-import psycopg
+import functools
+import hashlib
+import pickle
 import shutil
+import sys
 
+from archive_files import cache_dir
 from argparse import ArgumentParser
-from collections import defaultdict, namedtuple
-from dataclasses import dataclass
-from psycopg.rows import dict_row
+from array import array
+from backends import add_backend_arguments, get_backend, postgres
+from collections import namedtuple
+from columnar_cache import cached_archive, from_float32
+from dataclasses import dataclass, field
+from instrumentation import configure, Phase, summary
+from pathlib import Path
+
+
+# group_rows()
+# -------------------------------------------------------------------------------------------------
+def group_rows(keys: array, num_keys: int) -> tuple:
+  """Counting sort of row numbers by a small-integer key column. Returns (order, offsets): the rows
+     with key k are order[offsets[k]:offsets[k + 1]], in their original order.
+  """
+  offsets = array('I', bytes(4 * (num_keys + 1)))
+  for key in keys:
+    offsets[key + 1] += 1
+  for key in range(num_keys):
+    offsets[key + 1] += offsets[key]
+  next_slot = array('I', offsets[:-1])
+  order = array('I', bytes(4 * len(keys)))
+  for row, key in enumerate(keys):
+    order[next_slot[key]] = row
+    next_slot[key] += 1
+  return order, offsets
+
+
+class CourseRows:
+  """One side (source or destination) of the rules’ courses, as parallel arrays with one entry
+     per course row. Courses are stored as indexes into the context’s list of catalog courses.
+
+     Once all rows are added, group() indexes them by rule. Looking up rules by course needs
+     group_by_course() as well.
+  """
+
+  def __init__(self, with_grades: bool):
+    self.rule_id = array('I')
+    self.course = array('I')
+    self.min_grade = array('d') if with_grades else None
+    self.max_grade = array('d') if with_grades else None
+    self.by_rule = (array('I'), array('I', [0]))
+    self.by_course = None
+
+  def __len__(self):
+    return len(self.rule_id)
+
+  def group(self, num_rules: int):
+    self.by_rule = group_rows(self.rule_id, num_rules)
+
+  def group_by_course(self, num_courses: int):
+    self.by_course = group_rows(self.course, num_courses)
+
+  def rule_rows(self, rule_id: int):
+    """Row numbers of a rule’s courses."""
+    order, offsets = self.by_rule
+    if rule_id + 1 >= len(offsets):
+      return array('I')
+    return order[offsets[rule_id]:offsets[rule_id + 1]]
+
+  def course_rules(self, course: int) -> set:
+    """Ids of the rules with a course on this side."""
+    order, offsets = self.by_course
+    if course + 1 >= len(offsets):
+      return set()
+    rule_id = self.rule_id
+    return {rule_id[row] for row in order[offsets[course]:offsets[course + 1]]}
 
 
 @dataclass
 class Context:
-    source_courses: dict
-    destination_courses: dict
-    transfer_rules: dict
+    # Rules are numbered in the order they are first seen: rule_ids maps rule_key to number, and
+    # rule_keys maps number to rule_key.
+    rule_ids: dict = field(default_factory=dict)
+    rule_keys: list = field(default_factory=list)
+    # Courses referenced by the rules, numbered the same way; courses holds each one’s
+    # CatalogCourse, or None if it is not in cuny_courses.
+    course_numbers: dict = field(default_factory=dict)
+    courses: list = field(default_factory=list)
+    source_courses: CourseRows = field(default_factory=lambda: CourseRows(with_grades=True))
+    destination_courses: CourseRows = field(default_factory=lambda: CourseRows(with_grades=False))
+    # Generated descriptions, by rule_key
+    descriptions: dict = field(default_factory=dict)
+    # Description input fingerprints, by rule id
+    fingerprints: array = field(default_factory=lambda: array('Q'))
+    # Generated descriptions, by fingerprint
+    fingerprint_descriptions: dict = field(default_factory=dict)
+
+
+class CatalogCourse:
+  """The cuny_courses columns that go into descriptions, with the strings interned: there are
+     only a few hundred distinct institutions and disciplines, and a few thousand catalog numbers.
+  """
+  __slots__ = ('institution', 'discipline', 'catalog_number', 'is_active', 'is_mesg', 'is_bkcr')
+
+  def __init__(self, institution: str, discipline: str, catalog_number: str, is_active: bool,
+               is_mesg: bool, is_bkcr: bool):
+    self.institution = sys.intern(institution)
+    self.discipline = sys.intern(discipline)
+    self.catalog_number = sys.intern(catalog_number)
+    self.is_active = is_active
+    self.is_mesg = is_mesg
+    self.is_bkcr = is_bkcr
+
+  @property
+  def course(self) -> str:
+    return f'{self.discipline} {self.catalog_number}'
+
+
+# Module-wide db access, opened on first use. The backend can be changed before then.
+backend = postgres
+_cursor = None
+
+# Advisory lock key: writing descriptions takes it shared, and pruning the dictionary exclusively,
+# so a prune can’t delete a description that a write has found but not yet referred to.
+dictionary_lock = 20250424
 
+# Changes when the form of the courses_cache() snapshot changes
+snapshot_format = 3
+
+
+# db_cursor()
+# -------------------------------------------------------------------------------------------------
+def db_cursor():
+  """The module’s dict-row cursor, connecting to the database the first time it’s needed."""
+  global _cursor
+  if _cursor is None:
+    _cursor = backend.dict_cursor(backend.connect(autocommit=True))
+  return _cursor
+
+
+# courses_cache()
+# -------------------------------------------------------------------------------------------------
+@functools.cache
+def courses_cache() -> dict:
+  """The cuny_courses info used regardless of the schema being processed, keyed by
+     (course_id, offer_nbr).
+
+     For PostgreSQL, the rows are kept in an on-disk snapshot along with a freshness stamp: the
+     table’s version number, which a trigger bumps with every change (backends.table_stamp()). The
+     stamp is read before the rows, so a change committed in between leaves the snapshot stale and
+     it is fetched again next time. The catalog is fetched from the database only when the stamp
+     has changed since the snapshot was taken.
+     A SQLite file is local, so its catalog is always read from the file.
+  """
+  cursor = db_cursor()
+  stamp = backend.table_stamp(cursor, 'cuny_courses')
+
+  snapshot_path = Path(cache_dir, 'cuny_courses.pickle')
+  try:
+    with open(snapshot_path, 'rb') as snapshot_file:
+      snapshot = pickle.load(snapshot_file)
+    if (stamp is not None and snapshot.get('format') == snapshot_format
+       and snapshot['stamp'] == stamp):
+      return snapshot['courses']
+  except (FileNotFoundError, pickle.UnpicklingError, EOFError, KeyError, AttributeError):
+    pass
 
-# Module-wide db access
-conn = psycopg.connect('dbname=cuny_curriculum', autocommit=True)
-cursor = conn.cursor(row_factory=dict_row)
+  cursor.execute("""
+  select course_id, offer_nbr, institution, discipline, catalog_number,
+         course_status = 'A' as is_active,
+         designation in ('MLA', 'MNL') as is_mesg,
+         lower(attributes) like '%bkcr%' as is_bkcr
+    from cuny_courses""")
+  courses = {(row['course_id'], row['offer_nbr']):
+             CatalogCourse(row['institution'], row['discipline'], row['catalog_number'],
+                           row['is_active'], row['is_mesg'], row['is_bkcr'])
+             for row in cursor}
+
+  if stamp is None:
+    return courses
+
+  # Pickle keeps one copy of each shared (interned) string, so the sharing survives the snapshot.
+  snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+  temp_path = snapshot_path.with_suffix('.tmp')
+  with open(temp_path, 'wb') as snapshot_file:
+    pickle.dump({'format': snapshot_format, 'stamp': stamp, 'courses': courses}, snapshot_file,
+                protocol=pickle.HIGHEST_PROTOCOL)
+  temp_path.replace(snapshot_path)
+  return courses
 
-# The cuny_courses cache will be used regardless of the schema being processed
-cursor.execute("""
-select course_id, offer_nbr, institution, discipline||' '||catalog_number as course, title,
-       course_status = 'A' as is_active,
-       designation in ('MLA', 'MNL') as is_mesg,
-       attributes ~* 'bkcr' as is_bkcr
-  from cuny_courses""")
-courses_cache = {(row['course_id'], row['offer_nbr']): row for row in cursor}
 
 # Some basic characteristics of the CUNY catalog
-# print(f'{len(courses_cache):8,} courses')
-# print(f'{sum(1 for c in courses_cache if c['is_active']):8,} active')
-# print(f'{sum(1 for c in courses_cache if c['is_active'] and c['is_mesg']):8,} message')
-# exit(f'{sum(1 for c in courses_cache if c['is_active'] and c['is_bkcr']):8,} blanket')
+# print(f'{len(courses_cache()):8,} courses')
+# print(f'{sum(1 for c in courses_cache().values() if c.is_active):8,} active')
+# print(f'{sum(1 for c in courses_cache().values() if c.is_active and c.is_mesg):8,} message')
+# exit(f'{sum(1 for c in courses_cache().values() if c.is_active and c.is_bkcr):8,} blanket')
 
 Course = namedtuple('Course', 'institution course title')
 
@@ -124,11 +294,366 @@ def grade_restriction(min_grade: float, max_grade: float) -> str:
 
 def describe(rule_key: str, ctx: Context) -> str:
   """Gather source and destination course_id:offer_nbr values, and format the rule description.
+
+     Rules with the same fingerprint have the same source and destination courses, so each
+     fingerprint’s description is formatted once, listing the courses in the order of the first
+     such rule’s rows, and shared by the rest.
+  """
+  rule_id = ctx.rule_ids.get(rule_key)
+  if rule_id is None:
+    ctx.descriptions[rule_key] = ' => '
+    return ctx.descriptions[rule_key]
+  key = ctx.fingerprints[rule_id]
+  if (description := ctx.fingerprint_descriptions.get(key)) is None:
+    source_courses = [source_course(ctx, row) for row in ctx.source_courses.rule_rows(rule_id)]
+    destination_courses = [destination_course(ctx, row)
+                           for row in ctx.destination_courses.rule_rows(rule_id)]
+    description = ctx.fingerprint_descriptions[key] = (f'{oxfordize(source_courses)}'
+                                                       f' => '
+                                                       f'{oxfordize(destination_courses)}')
+  ctx.descriptions[rule_key] = description
+  return description
+
+
+# add_fingerprint()
+# -------------------------------------------------------------------------------------------------
+def add_fingerprint(ctx: Context, rule_id: int, inputs: tuple):
+  """Fold one course row’s description inputs into its rule’s fingerprint.
+
+     The row hashes are summed, so a rule’s fingerprint doesn’t depend on the order in which its
+     rows are read.
+  """
+  row_hash = hashlib.blake2b(repr(inputs).encode(), digest_size=8).digest()
+  ctx.fingerprints[rule_id] = (ctx.fingerprints[rule_id] + int.from_bytes(row_hash)) % 2**64
+
+
+# fingerprint()
+# -------------------------------------------------------------------------------------------------
+def fingerprint(ctx: Context, rule_key: str) -> str:
+  """Hex string fingerprint of all the inputs to a rule’s description."""
+  rule_id = ctx.rule_ids.get(rule_key)
+  return f'{0 if rule_id is None else ctx.fingerprints[rule_id]:016x}'
+
+
+# stored_fingerprints()
+# -------------------------------------------------------------------------------------------------
+def stored_fingerprints(schema_name: str) -> dict:
+  """Fingerprints saved with the schema’s descriptions when they were last written, if any.
+     Descriptions written before the rule_descriptions dictionary have none.
+  """
+  cursor = db_cursor()
+  if not backend.column_exists(cursor, schema_name, 'transfer_rules', 'description_id'):
+    return dict()
+  cursor.execute(f"""
+  select rule_key, fingerprint from {backend.table(schema_name, 'transfer_rules')}
+   where fingerprint is not null and description_id is not null
+  """)
+  return {row['rule_key']: row['fingerprint'] for row in cursor}
+
+
+# description_digest()
+# -------------------------------------------------------------------------------------------------
+def description_digest(description: str) -> str:
+  """The key of a description in the rule_descriptions dictionary."""
+  return hashlib.blake2b(description.encode(), digest_size=16).hexdigest()
+
+
+# create_dictionary()
+# -------------------------------------------------------------------------------------------------
+def create_dictionary(cursor, schema_name: str):
+  """Create the rule_descriptions dictionary if it doesn’t exist yet, add the description_id
+     and fingerprint columns to the schema’s transfer_rules table if it doesn’t have them, and
+     create the schema’s described_rules view if it doesn’t have one.
+  """
+  dictionary = backend.table('public', 'rule_descriptions')
+  cursor.execute(f"""
+  create table if not exists {dictionary} (
+    id          {backend.serial_key},
+    digest      text unique not null,
+    description text not null
+  )
+  """)
+  transfer_rules = backend.table(schema_name, 'transfer_rules')
+  if not backend.column_exists(cursor, schema_name, 'transfer_rules', 'description_id'):
+    cursor.execute(f"""
+    alter table {transfer_rules} add column description_id integer references {dictionary}(id)
+    """)
+    # Deleting from the dictionary looks up the rules referring to each description.
+    backend.create_index(cursor, schema_name, 'transfer_rules', ('description_id', ))
+  if not backend.column_exists(cursor, schema_name, 'transfer_rules', 'fingerprint'):
+    cursor.execute(f'alter table {transfer_rules} add column fingerprint text')
+  # Rules without a description_id keep any text written by earlier versions.
+  if not backend.column_exists(cursor, schema_name, 'described_rules', 'description'):
+    cursor.execute(f"""
+    create view {backend.table(schema_name, 'described_rules')} as
+    select t.id, t.rule_key, t.effective_date,
+           coalesce(d.description, t.description) as description
+      from {transfer_rules} t left join {dictionary} d on d.id = t.description_id
+    """)
+
+
+# write_descriptions()
+# -------------------------------------------------------------------------------------------------
+def write_descriptions(schema_name: str, rows) -> int:
+  """Write (rule_key, description, fingerprint) rows to the schema’s transfer_rules table.
+
+     Rules refer to their descriptions in the rule_descriptions dictionary, so each distinct
+     description is staged once, and added to the dictionary only if no rule in any schema has
+     had it before. The rules’ description_ids are then set with a single update that touches
+     only the rules whose description or fingerprint differs, clearing the text left in their
+     description column by earlier versions; described_rules has the text. Holding the dictionary
+     lock shared keeps prune_dictionary() from deleting a description between the insert, which
+     skips ones already there, and the update that refers to it. Returns the number of rules
+     updated.
+  """
+  cursor = db_cursor()
+  transfer_rules = backend.table(schema_name, 'transfer_rules')
+  dictionary = backend.table('public', 'rule_descriptions')
+  create_dictionary(cursor, schema_name)
+  with backend.transaction(cursor.connection):
+    backend.create_temp_table(cursor, 'description_updates',
+                              'rule_key text, digest text, fingerprint text')
+    backend.create_temp_table(cursor, 'staged_descriptions', 'digest text, description text')
+    with Phase('db update (stage)') as phase:
+      descriptions = dict()   # Distinct descriptions by digest
+      updates = []
+      for rule_key, description, fingerprint in rows:
+        digest = description_digest(description)
+        descriptions[digest] = description
+        updates.append((rule_key, digest, fingerprint))
+      phase.rows = backend.copy_rows(cursor, 'description_updates',
+                                     ('rule_key', 'digest', 'fingerprint'), updates)
+      backend.copy_rows(cursor, 'staged_descriptions', ('digest', 'description'),
+                        descriptions.items())
+      cursor.execute('analyze description_updates')
+    num_rows = phase.rows
+    with Phase('db update (apply)') as phase:
+      backend.advisory_lock(cursor, dictionary_lock, shared=True)
+      # SQLite needs the where clause to parse “on conflict” after a select.
+      cursor.execute(f"""
+      insert into {dictionary} (digest, description)
+      select digest, description from staged_descriptions where true
+      on conflict (digest) do nothing
+      """)
+      num_new = cursor.rowcount
+      cursor.execute(f"""
+      update {transfer_rules} as t
+         set description_id = d.id,
+             description = '',
+             fingerprint = u.fingerprint
+        from description_updates u join {dictionary} d on d.digest = u.digest
+       where t.rule_key = u.rule_key
+         and (t.description_id {backend.is_distinct} d.id
+              or t.fingerprint {backend.is_distinct} u.fingerprint)
+      """)
+      phase.rows = num_updated = cursor.rowcount
+  print(f'Update db: {num_rows:,} descriptions staged ({len(descriptions):,} distinct, '
+        f'{num_new:,} new); {num_updated:,} rules updated')
+  return num_updated
+
+
+# prune_dictionary()
+# -------------------------------------------------------------------------------------------------
+def prune_dictionary(cursor) -> int:
+  """Delete the descriptions in the rule_descriptions dictionary that no rule in any schema refers
+     to. Returns the number deleted.
+  """
+  if not backend.column_exists(cursor, 'public', 'rule_descriptions', 'id'):
+    return 0
+  backend.advisory_lock(cursor, dictionary_lock)
+  # One anti-join per schema, each of which can use a hash join, however many rules there are.
+  tables = [backend.table(schema_name, 'transfer_rules')
+            for schema_name in backend.list_schemata(cursor.connection)
+            if backend.column_exists(cursor, schema_name, 'transfer_rules', 'description_id')]
+  unreferenced = ' and '.join(f"""
+    not exists (select 1 from {table} t where t.description_id = d.id)""" for table in tables)
+  cursor.execute(f"""
+  delete from {backend.table('public', 'rule_descriptions')} as d
+  {'where ' + unreferenced if tables else ''}
+  """)
+  return cursor.rowcount
+
+
+# rule_number()
+# -------------------------------------------------------------------------------------------------
+def rule_number(ctx: Context, rule_key: str) -> int:
+  """A rule’s id, numbering the rule if it hasn’t been seen before."""
+  rule_id = ctx.rule_ids.get(rule_key)
+  if rule_id is None:
+    rule_id = ctx.rule_ids[rule_key] = len(ctx.rule_keys)
+    ctx.rule_keys.append(rule_key)
+    ctx.fingerprints.append(0)
+  return rule_id
+
+
+# course_number()
+# -------------------------------------------------------------------------------------------------
+def course_number(ctx: Context, course_id: int, offer_nbr: int) -> int:
+  """A course’s index in ctx.courses, adding it if it hasn’t been seen before."""
+  key = (course_id, offer_nbr)
+  number = ctx.course_numbers.get(key)
+  if number is None:
+    number = ctx.course_numbers[key] = len(ctx.courses)
+    ctx.courses.append(courses_cache().get(key))
+  return number
+
+
+# add_source_course()
+# -------------------------------------------------------------------------------------------------
+def add_source_course(ctx: Context, rule_id: int, course_id: int, offer_nbr: int,
+                      min_grade: float, max_grade: float):
+  """Add a rule’s source course row to the context."""
+  number = course_number(ctx, course_id, offer_nbr)
+  rows = ctx.source_courses
+  rows.rule_id.append(rule_id)
+  rows.course.append(number)
+  rows.min_grade.append(min_grade)
+  rows.max_grade.append(max_grade)
+  if course := ctx.courses[number]:
+    inputs = (course.course, course.is_active)
+  else:
+    inputs = None
+  add_fingerprint(ctx, rule_id, ('source', course_id, offer_nbr, min_grade, max_grade, inputs))
+
+
+# add_destination_course()
+# -------------------------------------------------------------------------------------------------
+def add_destination_course(ctx: Context, rule_id: int, course_id: int, offer_nbr: int):
+  """Add a rule’s destination course row to the context."""
+  number = course_number(ctx, course_id, offer_nbr)
+  rows = ctx.destination_courses
+  rows.rule_id.append(rule_id)
+  rows.course.append(number)
+  if course := ctx.courses[number]:
+    inputs = (course.course, course.is_active, course.is_mesg, course.is_bkcr)
+  else:
+    inputs = None
+  add_fingerprint(ctx, rule_id, ('destination', course_id, offer_nbr, inputs))
+
+
+# source_course()
+# -------------------------------------------------------------------------------------------------
+def source_course(ctx: Context, row: int) -> str:
+  """The formatted string for a source course row."""
+  rows = ctx.source_courses
+  course = ctx.courses[rows.course[row]]
+  if course is None:
+    return 'UnknownInactive'
+  restriction = grade_restriction(rows.min_grade[row], rows.max_grade[row])
+  status = '' if course.is_active else '[Inactive]'
+  return f'{course.course}{restriction}{status}'
+
+
+# destination_course()
+# -------------------------------------------------------------------------------------------------
+def destination_course(ctx: Context, row: int) -> str:
+  """The formatted string for a destination course row."""
+  course = ctx.courses[ctx.destination_courses.course[row]]
+  if course is None:
+    return 'UnknownInactive'
+  status = '' if course.is_active else '[Inactive]'
+  status += '[MESG]' if course.is_mesg else ''
+  status += '[BKCR]' if course.is_bkcr else ''
+  return f'{course.course}{status}'
+
+
+# group_courses()
+# -------------------------------------------------------------------------------------------------
+def group_courses(ctx: Context):
+  """Index both sides’ course rows by rule, once all of them have been added."""
+  for rows in (ctx.source_courses, ctx.destination_courses):
+    rows.group(len(ctx.rule_keys))
+
+
+# rules_for_course()
+# -------------------------------------------------------------------------------------------------
+def rules_for_course(ctx: Context, course: tuple, sending: bool, receiving: bool) -> set:
+  """The rule_keys of the rules with a (course_id, offer_nbr) as a source course (sending) and/or
+     as a destination course (receiving).
+  """
+  number = ctx.course_numbers.get(course)
+  if number is None:
+    return set()
+  # Only lookups by course need the course index, so it is built by the first one.
+  for rows in (ctx.source_courses, ctx.destination_courses):
+    if rows.by_course is None:
+      rows.group_by_course(len(ctx.courses))
+  rule_ids = set()
+  if sending:
+    rule_ids |= ctx.source_courses.course_rules(number)
+  if receiving:
+    rule_ids |= ctx.destination_courses.course_rules(number)
+  return {ctx.rule_keys[rule_id] for rule_id in rule_ids}
+
+
+# load_context()
+# -------------------------------------------------------------------------------------------------
+def load_context(schema_name: str) -> Context:
+  """Build the context for the rules in a schema."""
+  ctx = Context()
+  cursor = db_cursor()
+
+  # Counts are reported after reading, because SQLite cursors don’t know the rowcount of a
+  # select.
+  cursor.execute(f'select rule_key from {backend.table(schema_name, 'transfer_rules')}')
+  for row in cursor:
+    rule_number(ctx, row['rule_key'])
+  s = '' if len(ctx.rule_keys) == 1 else 's'
+  print(f'{len(ctx.rule_keys):,} transfer rule{s}')
+
+  cursor.execute(f"""
+  select rule_key, course_id, offer_nbr, min_grade, max_grade
+    from {backend.table(schema_name, 'source_courses')}
+  """)
+  for row in cursor:
+    add_source_course(ctx, rule_number(ctx, row['rule_key']), row['course_id'], row['offer_nbr'],
+                      row['min_grade'], row['max_grade'])
+  s = '' if len(ctx.source_courses) == 1 else 's'
+  print(f'{len(ctx.source_courses):,} source course{s}')
+
+  cursor.execute(f"""
+  select rule_key, course_id, offer_nbr
+    from {backend.table(schema_name, 'destination_courses')}
+  """)
+  for row in cursor:
+    add_destination_course(ctx, rule_number(ctx, row['rule_key']), row['course_id'],
+                           row['offer_nbr'])
+  s = '' if len(ctx.destination_courses) == 1 else 's'
+  print(f'{len(ctx.destination_courses):,} destination course{s}')
+
+  group_courses(ctx)
+  return ctx
+
+
+# load_cached_context()
+# -------------------------------------------------------------------------------------------------
+def load_cached_context(archive_date: str) -> Context:
+  """Build the context for the rules in the columnar cache of an archive set.
+
+     The cache’s rule_key dictionary numbers the rules, so its rule ids are used as they are. A
+     missing or stale cache is (re-)built first.
   """
-  ctx.transfer_rules[rule_key] = (f'{oxfordize(ctx.source_courses[rule_key])}'
-                                  f' => '
-                                  f'{oxfordize(ctx.destination_courses[rule_key])}')
-  return ctx.transfer_rules[rule_key]
+  archive = cached_archive(archive_date)
+  ctx = Context(rule_ids={rule_key: rule_id for rule_id, rule_key in enumerate(archive.rule_keys)},
+                rule_keys=archive.rule_keys,
+                fingerprints=array('Q', bytes(8 * len(archive.rule_keys))))
+  print(f'{archive.num_rows('transfer_rules'):,} transfer rules')
+
+  print(f'{archive.num_rows('source_courses'):,} source courses')
+  for rule_id, course_id, offer_nbr, min_grade, max_grade in zip(
+      *[archive.column('source_courses', column)
+        for column in ('rule_key', 'course_id', 'offer_nbr', 'min_grade', 'max_grade')]):
+    add_source_course(ctx, rule_id, course_id, offer_nbr,
+                      from_float32(min_grade), from_float32(max_grade))
+
+  print(f'{archive.num_rows('destination_courses'):,} destination courses')
+  for rule_id, course_id, offer_nbr in zip(
+      *[archive.column('destination_courses', column)
+        for column in ('rule_key', 'course_id', 'offer_nbr')]):
+    add_destination_course(ctx, rule_id, course_id, offer_nbr)
+
+  group_courses(ctx)
+  return ctx
 
 
 # main()
@@ -139,26 +664,38 @@ if __name__ == '__main__':
   # Command line options
   parser = ArgumentParser('Generate rule description')
   parser.add_argument('--schema_name', '-sn')
+  parser.add_argument('--archive_date', '-ad',
+                      help='read rules from the columnar cache of this archive set')
   parser.add_argument('--sending_institution', '-si', default='QCC01')
   parser.add_argument('--receiving_institution', '-ri', default='QNS01')
   parser.add_argument('--subject', '-su', default='SEYS')
   parser.add_argument('--catalog_number', '-cn', default='^49.*')
   parser.add_argument('--direction', '-di', default='both')
   parser.add_argument('--update_db', '-up', action='store_true')
-  parser.add_argument('rule_keys', nargs='*', default=['all'])
+  parser.add_argument('--incremental', '-in', action='store_true',
+                      help='only regenerate descriptions whose inputs have changed')
+  parser.add_argument('--log_json', '-lj', metavar='PATH',
+                      help='append per-phase timings to PATH as JSON lines')
+  parser.add_argument('--profile', '-p', action='store_true',
+                      help='run a sampling profiler over each phase')
+  add_backend_arguments(parser)
+  parser.add_argument('rule_keys', nargs='*', default=[],
+                      help='“all”, or rule_keys; default is the rules for the courses matching '
+                      'the institution, subject, and catalog number options')
   args = parser.parse_args()
+  configure(args.log_json, args.profile)
+  backend = get_backend(args.backend, args.db)
+  cursor = db_cursor()
 
   # Which schema?
-  cursor.execute("""
-  select schema_name
-    from information_schema.schemata
-   where schema_name ~* '^a20'
-   order by schema_name
-  """)
-  schemata = [row['schema_name'] for row in cursor]
+  schemata = backend.list_schemata(cursor.connection)
   if len(schemata) < 1:
     exit('No schemata available')
-  if args.schema_name:
+  if args.archive_date:
+    schema_name = f'a{args.archive_date.replace('-', '')}'
+    if (args.update_db or args.incremental) and schema_name not in schemata:
+      exit(f'{schema_name} not found')
+  elif args.schema_name:
     schema_name = args.schema_name
     if schema_name not in schemata:
       exit(f'{schema_name} not found')
@@ -168,84 +705,49 @@ if __name__ == '__main__':
 
   print(f'Generate descriptions for {schema_name}')
 
-  # Create the context for this schema
-  ctx = Context(defaultdict(list), defaultdict(list), dict())
-  # source_courses
-  cursor.execute(f'select * from {schema_name}.source_courses')
-  s = '' if cursor.rowcount == 1 else 's'
-  print(f'{cursor.rowcount:,} source course{s}')
-  for source_course in cursor:
-    try:
-      course_details = courses_cache[(source_course['course_id'], source_course['offer_nbr'])]
-      course_details['grade_restriction'] = grade_restriction(source_course['min_grade'],
-                                                              source_course['max_grade'])
-      status = '' if course_details['is_active'] else '[Inactive]'
-    except KeyError:
-      course_details = {'is_active': False,
-                        'course': 'Unknown',
-                        'status': 'Inactive',
-                        'grade_restriction': ''}
-    ctx.source_courses[source_course['rule_key']].append(f'{course_details['course']}'
-                                                         f'{course_details['grade_restriction']}'
-                                                         f'{status}')
-  # destination_courses
-  cursor.execute(f'select * from {schema_name}.destination_courses')
-  s = '' if cursor.rowcount == 1 else 's'
-  print(f'{cursor.rowcount:,} destination course{s}')
-  for destination_course in cursor:
-    try:
-      course_details = courses_cache[(destination_course['course_id'],
-                                      destination_course['offer_nbr'])]
-      status = '' if course_details['is_active'] else '[Inactive]'
-      status += '[MESG]' if course_details['is_mesg'] else ''
-      status += '[BKCR]' if course_details['is_bkcr'] else ''
-    except KeyError:
-      course_details = {'course': 'Unknown'}
-      status = 'Inactive'
-    ctx.destination_courses[destination_course['rule_key']].append(f'{course_details['course']}'
-                                                                   f'{status}')
-  # transfer_rules
-  cursor.execute(f'select * from {schema_name}.transfer_rules')
-  s = '' if cursor.rowcount == 1 else 's'
-  print(f'{cursor.rowcount:,} transfer rule{s}')
-  ctx.transfer_rules = {row['rule_key']: row['description'] for row in cursor}
+  # Fetch the catalog, and create the context for this schema or cached archive set
+  with Phase('catalog fetch') as phase:
+    phase.rows = len(courses_cache())
+  with Phase('context build') as phase:
+    if args.archive_date:
+      ctx = load_cached_context(args.archive_date)
+    else:
+      ctx = load_context(schema_name)
+    phase.rows = len(ctx.source_courses) + len(ctx.destination_courses)
 
   rule_keys = args.rule_keys
-  do_update = False
+  do_update = args.update_db  # Have to ask for it explicitly
 
   if 'all' in rule_keys:
-    do_update = args.update_db  # Have to ask for it explicitly
     print(f'Generating all descriptions with {do_update=}')
     terminal_width = shutil.get_terminal_size().columns
     max_desc_width = terminal_width - 24 - 1  # 24 for rule_key, 1 space
 
+    # Which rules need new descriptions?
+    if args.incremental:
+      fingerprints = stored_fingerprints(schema_name)
+      stale_rules = [rule_key for rule_key in ctx.rule_keys
+                     if fingerprints.get(rule_key) != fingerprint(ctx, rule_key)]
+      print(f'{len(stale_rules):,} changed; '
+            f'{len(ctx.rule_keys) - len(stale_rules):,} unchanged rules skipped')
+    else:
+      stale_rules = ctx.rule_keys
+
     # Generate the descriptions
-    for rule_key in ctx.transfer_rules:
-      description = describe(rule_key, ctx)
-      if not do_update:
-        print(f'\x1b[2K\r{rule_key:24} {description[:max_desc_width]}', end='', flush=True)
+    with Phase('description build', rows=len(stale_rules)):
+      for rule_key in stale_rules:
+        description = describe(rule_key, ctx)
+        if not do_update:
+          print(f'\x1b[2K\r{rule_key:24} {description[:max_desc_width]}', end='', flush=True)
 
     if do_update:
-      # Bulk update the schema’s transfer_rules table, 100K rows at a time.
-      print('\nUpdate db')
-      sql = psycopg.sql
-      transfer_rules_list = list(ctx.transfer_rules.items())
-      chunk_size = 100_000
-      num_rules = len(transfer_rules_list)
-      for index in range(0, num_rules, chunk_size):
-        print(f'\r{index:,}/{num_rules:,}', end='')
-        chunk = transfer_rules_list[index:index + chunk_size]
-        values_sql = sql.SQL(', ').join(sql.SQL('({},{})').format(sql.Literal(rule_key),
-                                                                  sql.Literal(description))
-                                        for rule_key, description in chunk)
-        query = sql.SQL("""
-        update {schema_name}.transfer_rules as t
-           set description = v.description
-          from (values {values}) as v(rule_key, description)
-         where t.rule_key = v.rule_key
-        """).format(schema_name=sql.Identifier(schema_name), values=values_sql)
-        cursor.execute(query)
+      # Bulk update the schema’s transfer_rules table, saving the fingerprints for the next
+      # incremental run.
+      print()
+      write_descriptions(schema_name, ((rule_key, ctx.descriptions[rule_key],
+                                        fingerprint(ctx, rule_key)) for rule_key in stale_rules))
     print()
+    summary()
     exit()
 
   courses = dict()  # to short-circuit rule_keys lookup below
@@ -254,14 +756,16 @@ if __name__ == '__main__':
     # Allow regex for subject/catalog_nbr
     subject = f'^{args.subject.strip('^$')}$'
     catalog_number = f'^{args.catalog_number.strip('^$')}'
-    cursor.execute("""
+    regex, p = backend.regex_match, backend.param
+    cursor.execute(f"""
     select course_id, offer_nbr, discipline||' '||catalog_number as course, title, institution
       from cuny_courses
-     where (institution ~* %s or institution ~* %s)
-       and discipline ~* %s
-       and catalog_number ~* %s
+     where (institution {regex} {p} or institution {regex} {p})
+       and discipline {regex} {p}
+       and catalog_number {regex} {p}
     """, (args.sending_institution, args.receiving_institution, subject, catalog_number))
-    match cursor.rowcount:
+    rows = cursor.fetchall()
+    match len(rows):
       case 0:
         exit(f'No matching courses for {args.subject} {args.catalog_number} in'
              f'{args.sending_institution} or {args.receiving_institution}')
@@ -269,11 +773,11 @@ if __name__ == '__main__':
         s = ''
       case _:
         s = 's'
-    print(f'There are {cursor.rowcount} {args.subject.strip('^$')} '
+    print(f'There are {len(rows)} {args.subject.strip('^$')} '
           f'{args.catalog_number.strip('^$')} course{s}')
     courses = {(row['course_id'], row['offer_nbr']):
                Course._make([row['institution'][0:3].lower(),
-                             row['course'], row['title']]) for row in cursor}
+                             row['course'], row['title']]) for row in rows}
 
     for course in courses.values():
       print(f'  {course.institution} {course.course}: {course.title}')
@@ -284,41 +788,33 @@ if __name__ == '__main__':
   if not (sending or receiving):
     exit(f'“{args.direction}” is not “sending”, “receiving”, or “both”')
 
+  # Look up the rules for all the courses in the context’s course indexes
+  matching_rules = set()
   for course in courses:
-    cursor.execute(f"""
-    select distinct rule_key from {schema_name}.source_courses
-     where course_id = %s and offer_nbr = %s
-    union
-    select distinct rule_key from {schema_name}.destination_courses
-     where course_id = %s and offer_nbr = %s
-    """, course + course)
-    for row in cursor:
-      rule_key = row['rule_key']
-      src, dst, *_ = rule_key.split(':')
-      if ((src[0:3].lower() == args.sending_institution[0:3].lower()) and
-          (dst[0:3].lower() == args.receiving_institution[0:3].lower())):
-        if sending:
-          rule_keys.append(rule_key)
-        if receiving:
-          rule_keys.append(rule_key)
+    matching_rules |= rules_for_course(ctx, course, sending, receiving)
+  sending_institution = args.sending_institution[0:3].lower()
+  receiving_institution = args.receiving_institution[0:3].lower()
+  rule_keys += [rule_key for rule_key in matching_rules
+                if rule_key[0:3].lower() == sending_institution
+                and rule_key[6:9].lower() == receiving_institution]
 
   num_rules = len(rule_keys)
   if num_rules:
     s = '' if num_rules == 1 else 's'
     num_keys = len(rule_keys)
     n = 0
-    for rule_key in sorted(rule_keys):
-      n += 1
-      description = describe(rule_key, ctx)
-      print(f'\r{n:,}/{num_keys:,} ', end='')
-      if do_update:
-        cursor.execute(f"""
-        update {schema_name}.transfer_rules
-           set description = %s
-         where rule_key = %s
-        """, (description, rule_key))
-      else:
-        print(f'{rule_key:22} {description:100}', end='')
+    with Phase('description build', rows=num_keys):
+      for rule_key in sorted(rule_keys):
+        n += 1
+        description = describe(rule_key, ctx)
+        print(f'\r{n:,}/{num_keys:,} ', end='')
+        if not do_update:
+          print(f'{rule_key:22} {description:100}', end='')
+    if do_update:
+      print()
+      write_descriptions(schema_name, ((rule_key, ctx.descriptions[rule_key],
+                                        fingerprint(ctx, rule_key)) for rule_key in rule_keys))
   else:
     print('No matching rules')
   print()
+  summary()
@@ -6,164 +6,497 @@
    Each archive gets its own date-named schema.
 """
 
-import bz2
-import csv
 import datetime
-import psycopg
+import os
+import partitioned_tables
 import subprocess
 import sys
+import time
 
+from archive_catalog import check_archive_set, load_catalog
+from archive_files import table_columns
 from argparse import ArgumentParser
-from bisect import bisect_left
-from pathlib import Path
-from statistics import statistics
+from async_ingest import load_tables
+from backends import add_backend_arguments, get_backend, postgres
+from columnar_cache import archive_rows
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from instrumentation import (configure, detailed, MeteredRows, Phase, record, settings,
+                             summary)
+from mk_descriptions import prune_dictionary
+from statistics import count_rule_keys, rule_key_statistics, RunLengths
+from temporal_rules import load_archives
+
+
+# create_tables()
+# -------------------------------------------------------------------------------------------------
+def create_tables(cursor, schema_name: str, backend=postgres, constraints: bool = True,
+                  unlogged: bool = False):
+  """(Re-)create the schema and its three empty tables.
+
+     Without constraints, the ids are not primary keys and rule_key is neither unique nor a
+     foreign key until add_constraints(). Unlogged (PostgreSQL) tables skip the write-ahead log,
+     and are emptied if the server crashes; set_logged() makes them ordinary tables.
+  """
+  backend.create_schema(cursor, schema_name)
+  transfer_rules = backend.table(schema_name, 'transfer_rules')
+  serial_key = backend.serial_key if constraints else 'serial'
+  unique = ' unique' if constraints else ''
+  references = f' references {transfer_rules}(rule_key)' if constraints else ''
+  create_table = 'create unlogged table' if unlogged else 'create table'
+
+  cursor.execute(f"""
+  {create_table} {transfer_rules} (
+    id                      {serial_key},
+    rule_key                text{unique},
+    effective_date          date,
+    description             text default ''
+  )
+  """)
+
+  cursor.execute(f"""
+  {create_table} {backend.table(schema_name, 'source_courses')} (
+    id          {serial_key},
+    rule_key    text{references},
+    src_inst    text,
+    dst_inst    text,
+    course_id   integer,
+    offer_nbr   integer,
+    min_credits real,
+    max_credits real,
+    credit_src  text,
+    min_grade   real,
+    max_grade   real      )
+  """)
+
+  cursor.execute(f"""
+  {create_table} {backend.table(schema_name, 'destination_courses')} (
+    id        {serial_key},
+    rule_key  text{references},
+    course_id integer,
+    offer_nbr integer,
+    credits   real      )
+  """)
+
+
+# add_constraints()
+# -------------------------------------------------------------------------------------------------
+def add_constraints(cursor, schema_name: str):
+  """Add the constraints left out by create_tables(constraints=False) to loaded PostgreSQL tables.
+
+     Each constraint is checked in one pass over its table, instead of row by row during the load.
+  """
+  for table_name in table_columns:
+    cursor.execute(f"""
+    alter table {schema_name}.{table_name} add primary key (id)
+    """)
+  cursor.execute(f"""
+  alter table {schema_name}.transfer_rules add unique (rule_key)
+  """)
+  for table_name in ['source_courses', 'destination_courses']:
+    cursor.execute(f"""
+    alter table {schema_name}.{table_name}
+      add foreign key (rule_key) references {schema_name}.transfer_rules(rule_key)
+    """)
+
+
+# set_logged()
+# -------------------------------------------------------------------------------------------------
+def set_logged(cursor, schema_name: str):
+  """Make a schema’s unlogged tables ordinary (crash-safe) tables. Do this before adding the
+     constraints and indexes, which would otherwise be rewritten along with the tables.
+  """
+  for table_name in table_columns:
+    cursor.execute(f'alter table {schema_name}.{table_name} set logged')
+
+
+# swap_schema()
+# -------------------------------------------------------------------------------------------------
+def swap_schema(conn, staging_name: str, schema_name: str):
+  """Replace a schema with a fully built staging schema, renaming both in one short transaction,
+     so readers see either the complete old tables or the complete new ones. Then drop the old
+     schema, and the descriptions in the rule_descriptions dictionary only its rules used.
+  """
+  # Neither name starts with a20, so schema listings never include them.
+  retired_name = f'old_{schema_name}'
+  with conn.cursor() as cursor:
+    cursor.execute(f'drop schema if exists {retired_name} cascade')
+    conn.commit()
+    with Phase('swap schema'):
+      cursor.execute("""
+      select 1 from information_schema.schemata where schema_name = %s
+      """, (schema_name, ))
+      if cursor.rowcount > 0:
+        cursor.execute(f'alter schema {schema_name} rename to {retired_name}')
+      cursor.execute(f'alter schema {staging_name} rename to {schema_name}')
+      conn.commit()
+    with Phase('drop old schema'):
+      cursor.execute(f'drop schema if exists {retired_name} cascade')
+      prune_dictionary(cursor)
+      conn.commit()
+
+
+# publish_staging()
+# -------------------------------------------------------------------------------------------------
+def publish_staging(conn, staging_name: str, schema_name: str, archive_date: str):
+  """Finish a staging schema loaded without constraints, and swap it in for schema_name."""
+  with conn.cursor() as cursor:
+    with Phase('set logged', archive_date=archive_date):
+      set_logged(cursor, staging_name)
+    with Phase('add constraints', archive_date=archive_date):
+      add_constraints(cursor, staging_name)
+    with Phase('create indexes', archive_date=archive_date):
+      create_indexes(cursor, staging_name)
+    with Phase('analyze', archive_date=archive_date):
+      for table_name in table_columns:
+        cursor.execute(f'analyze {staging_name}.{table_name}')
+  conn.commit()
+  swap_schema(conn, staging_name, schema_name)
+
+
+# drop_staging()
+# -------------------------------------------------------------------------------------------------
+def drop_staging(conn, staging_name: str):
+  """Drop what is left of a staging schema after a failed rebuild."""
+  conn.rollback()
+  with conn.cursor() as cursor:
+    cursor.execute(f'drop schema if exists {staging_name} cascade')
+  conn.commit()
+
+
+# create_indexes()
+# -------------------------------------------------------------------------------------------------
+def create_indexes(cursor, schema_name: str, backend=postgres):
+  """Index the course tables by rule_key and by (course_id, offer_nbr), after they are loaded."""
+  for table_name in ['source_courses', 'destination_courses']:
+    backend.create_index(cursor, schema_name, table_name, ('rule_key', ))
+    backend.create_index(cursor, schema_name, table_name, ('course_id', 'offer_nbr'))
+
+
+# insert_rows()
+# -------------------------------------------------------------------------------------------------
+def insert_rows(cursor, schema_name: str, table_name: str, rows, backend=postgres,
+                table: str | None = None) -> int:
+  """Load rows into a table one insert statement at a time. Return the number of rows.
+
+     The rows go into table if given (such as a partition being loaded), else the schema’s table.
+  """
+  columns = table_columns[table_name]
+  placeholders = ', '.join([backend.param] * len(columns))
+  query = f"""
+  insert into {table or backend.table(schema_name, table_name)} ({', '.join(columns)})
+  values ({placeholders})
+  """
+  num_rows = 0
+  for row in rows:
+    cursor.execute(query, row)
+    num_rows += 1
+  return num_rows
+
+
+# copy_rows()
+# -------------------------------------------------------------------------------------------------
+def copy_rows(cursor, schema_name: str, table_name: str, rows, backend=postgres,
+              table: str | None = None) -> int:
+  """Bulk-load rows into a table: COPY FROM STDIN for PostgreSQL, executemany for SQLite.
+     Return the number of rows.
+  """
+  return backend.copy_rows(cursor, table or backend.table(schema_name, table_name),
+                           table_columns[table_name], rows)
+
+
+loaders = {'copy': copy_rows, 'insert': insert_rows}
+
+
+# build_schema()
+# -------------------------------------------------------------------------------------------------
+def build_schema(archive_date: str, loader: str = 'copy', verbose: bool = True,
+                 rule_counts: dict | None = None, backend=postgres,
+                 layout: str = 'schemata', rebuild: bool = False, archive_set=None) -> dict:
+  """Create the schema for an archive date and load the three archive files into it.
+
+     With the partitioned layout, the files are loaded into standalone tables that then replace
+     the archive date’s partitions of the partitioned tables (partitioned_tables.py).
+     To rebuild (PostgreSQL), the files are loaded into an unlogged staging schema without
+     constraints, which replaces the archive date’s schema once it is complete; readers see the
+     old schema until then.
+     If rule_counts is a dict, the rows per rule_key of each table are counted into a
+     statistics.RunLengths under the table’s name as the rows are loaded.
+     archive_set is the date’s archive set from archive_catalog.check_archive_set(), if the caller
+     has it.
+     Returns a dict of (num_rows, seconds) tuples keyed by table name.
+  """
+  if loader == 'pipeline':
+    return build_schema_pipelined(archive_date, verbose, rule_counts, backend, rebuild,
+                                  archive_set)
+  partitioned = layout == 'partitioned'
+  schema_name = f'a{archive_date.replace('-', '')}'
+  target_name = f'staging_{schema_name}' if rebuild else schema_name
+  load = loaders[loader]
+  timings = dict()
+  with backend.connect() as conn:
+    with conn.cursor() as cursor:
+      if partitioned:
+        partitioned_tables.create_tables(cursor)
+        tables = partitioned_tables.create_partitions(cursor, archive_date)
+        # Don’t hold locks on the partitioned tables while loading.
+        conn.commit()
+      else:
+        create_tables(cursor, target_name, backend, constraints=not rebuild, unlogged=rebuild)
+        tables = dict()
+      try:
+        for table_name in table_columns:
+          if verbose:
+            print(f'{table_name + ":":21}', end='')
+            sys.stdout.flush()
+          # When the phases are logged or profiled, the rows are metered, and the insert phase
+          # excludes the time spent decompressing and parsing them; otherwise the load phase
+          # includes it.
+          metered = detailed()
+          with Phase(f'{table_name} {'insert' if metered else 'load'}',
+                     archive_date=archive_date) as phase:
+            rows = archive_rows(archive_date, table_name, archive_set)
+            if metered:
+              rows = MeteredRows(rows)
+            counted_rows = rows
+            if rule_counts is not None:
+              run_lengths = rule_counts.setdefault(table_name, RunLengths())
+              counted_rows = count_rule_keys(rows, run_lengths)
+            phase.rows = num_rows = load(cursor, target_name, table_name, counted_rows, backend,
+                                         tables.get(table_name))
+            if metered:
+              phase.excluded = rows.seconds
+          if metered:
+            record(f'{table_name} decompress/parse', rows.seconds, rows.rows,
+                   archive_date=archive_date)
+          seconds = phase.elapsed
+          timings[table_name] = (num_rows, seconds)
+          if verbose:
+            print(f'{num_rows:>12,} rows {seconds:8.1f} sec '
+                  f'{num_rows / seconds:>10,.0f} rows/sec')
+        if partitioned:
+          # Attaching builds the partitioned tables’ indexes on the partitions.
+          conn.commit()
+          with Phase('attach partitions', archive_date=archive_date):
+            partitioned_tables.attach_partitions(cursor, archive_date)
+        elif rebuild:
+          publish_staging(conn, target_name, schema_name, archive_date)
+        else:
+          with Phase('create indexes', archive_date=archive_date):
+            create_indexes(cursor, schema_name, backend)
+      except BaseException:
+        if partitioned:
+          # The tables created for loading were committed; the date’s partitions are untouched.
+          conn.rollback()
+          partitioned_tables.drop_loaded_tables(cursor, archive_date)
+          conn.commit()
+        elif rebuild:
+          drop_staging(conn, target_name)
+        raise
+  return timings
+
+
+# build_schema_pipelined()
+# -------------------------------------------------------------------------------------------------
+def build_schema_pipelined(archive_date: str, verbose: bool = True,
+                           rule_counts: dict | None = None, backend=postgres,
+                           rebuild: bool = False, archive_set=None) -> dict:
+  """Same as build_schema(), but the three tables load concurrently, each with its files being
+     decompressed and parsed in another process while the rows are copied (async_ingest.py).
+
+     The tables are created without constraints, which are added once all three are loaded.
+  """
+  schema_name = f'a{archive_date.replace('-', '')}'
+  target_name = f'staging_{schema_name}' if rebuild else schema_name
+  with backend.connect() as conn:
+    with conn.cursor() as cursor:
+      create_tables(cursor, target_name, backend, constraints=False, unlogged=rebuild)
+    # The loading connections have to see the tables.
+    conn.commit()
+    try:
+      timings = load_tables(backend.conninfo, archive_date, target_name, rule_counts,
+                            archive_set)
+      if verbose:
+        for table_name, (num_rows, seconds) in timings.items():
+          print(f'{table_name + ":":21}{num_rows:>12,} rows {seconds:8.1f} sec '
+                f'{num_rows / seconds:>10,.0f} rows/sec')
+      if rebuild:
+        publish_staging(conn, target_name, schema_name, archive_date)
+        return timings
+    except BaseException:
+      if rebuild:
+        drop_staging(conn, target_name)
+      raise
+    with conn.cursor() as cursor:
+      with Phase('add constraints', archive_date=archive_date):
+        add_constraints(cursor, schema_name)
+      with Phase('create indexes', archive_date=archive_date):
+        create_indexes(cursor, schema_name, backend)
+  return timings
+
+
+# build_archive()
+# -------------------------------------------------------------------------------------------------
+def build_archive(archive_date: str, loader: str, backend=postgres,
+                  layout: str = 'schemata', rebuild: bool = False, archive_set=None) -> tuple:
+  """Process pool worker: build one archive date’s schema using its own connection.
+
+     Returns (archive_date, timings, seconds, error), where error is None on success.
+  """
+  start = time.perf_counter()
+  try:
+    timings = build_schema(archive_date, loader, verbose=False, backend=backend, layout=layout,
+                           rebuild=rebuild, archive_set=archive_set)
+    error = None
+  except Exception as err:
+    timings = dict()
+    error = f'{type(err).__name__}: {err}'
+  return archive_date, timings, time.perf_counter() - start, error
+
+
+# build_archives()
+# -------------------------------------------------------------------------------------------------
+def build_archives(archive_dates: list, loader: str, jobs: int, backend=postgres,
+                   layout: str = 'schemata', rebuild: bool = False, catalog=None):
+  """Build the schemata (or partitions) for a list of archive dates concurrently, and summarize
+     the results. Each date’s archive set is checked here, and passed on to its worker.
+  """
+  catalog = catalog or load_catalog()
+  print(f'Building {len(archive_dates)} archive {layout} with {jobs} jobs')
+  if layout == 'partitioned':
+    # Create the partitioned tables before the workers race to.
+    with backend.connect() as conn:
+      with conn.cursor() as cursor:
+        partitioned_tables.create_tables(cursor)
+  start = time.perf_counter()
+  results = []
+  # Workers started by spawn or forkserver don’t inherit the instrumentation configuration.
+  with ProcessPoolExecutor(max_workers=jobs, initializer=configure,
+                           initargs=settings()) as executor:
+    futures = [executor.submit(build_archive, archive_date, loader, backend, layout, rebuild,
+                               check_archive_set(catalog, archive_date))
+               for archive_date in archive_dates]
+    for future in as_completed(futures):
+      archive_date, timings, seconds, error = future.result()
+      results.append((archive_date, timings, seconds, error))
+      status = 'FAILED' if error else 'done'
+      print(f'{len(results):4}/{len(archive_dates)} {archive_date} {status} {seconds:8.1f} sec')
+
+  # Summary
+  print(f'\n{"Archive":10} {"Rules":>10} {"Source":>12} {"Destination":>12} {"Seconds":>9}')
+  failures = []
+  for archive_date, timings, seconds, error in sorted(results):
+    if error:
+      failures.append((archive_date, error))
+      print(f'{archive_date:10} {"FAILED":>10} {"":>12} {"":>12} {seconds:9.1f}')
+    else:
+      counts = [timings[table_name][0] for table_name in table_columns]
+      print(f'{archive_date:10} {counts[0]:>10,} {counts[1]:>12,} {counts[2]:>12,} {seconds:9.1f}')
+  print(f'{len(results) - len(failures)} succeeded, {len(failures)} failed '
+        f'in {time.perf_counter() - start:.1f} sec')
+  for archive_date, error in failures:
+    print(f'  {archive_date}: {error}')
+
+
+# normalize_date()
+# -------------------------------------------------------------------------------------------------
+def normalize_date(date_str: str) -> str:
+  """Use the date command to convert a date string to YYYY-MM-DD form."""
+  try:
+    result = subprocess.run(['date', '--date', date_str, '+%Y-%m-%d'],
+                            capture_output=True,
+                            text=True,
+                            check=True)
+  except subprocess.CalledProcessError:
+    exit(f'Invalid archive date string: {date_str}')
+  return result.stdout.strip()
+
 
 # main()
 # -------------------------------------------------------------------------------------------------
 if __name__ == '__main__':
 
   # Get list of available archives
-  archive_dir = Path(Path.home(), 'Projects/cuny_curriculum/rules_archive')
-  if not archive_dir.is_dir():
-    exit('Rules archive dir not found')
-  archive_dates = []
-  for file_path in archive_dir.glob('*effective*'):
-    archive_dates.append(file_path.name[0:10])
-  archive_dates.sort()
+  try:
+    catalog = load_catalog(verbose=True)
+  except FileNotFoundError as err:
+    exit(err)
+  archive_dates = catalog.dates
+  if not archive_dates:
+    exit('No complete archive sets available')
   print(f'{len(archive_dates)} archives between {archive_dates[0]} to {archive_dates[-1]}')
 
   # Get requested archive date: default is the latest one available.
   parser = ArgumentParser('Create a set of transfer rule tables ')
 
   parser.add_argument('--archive_date', '-ad', default=f'{datetime.date.today()}')
-  parser.add_argument('--statistics', '-s')
+  parser.add_argument('--all', '-a', action='store_true')
+  parser.add_argument('--range', '-r', nargs=2, metavar=('START', 'END'))
+  parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count())
+  parser.add_argument('--loader', '-l', choices=[*loaders, 'pipeline'], default='copy',
+                      help='pipeline loads the three tables concurrently (PostgreSQL only)')
+  parser.add_argument('--layout', '-lo', choices=['schemata', 'partitioned'], default='schemata',
+                      help='a schema per archive date, or partitions of one set of tables')
+  parser.add_argument('--rebuild', '-rb', action='store_true',
+                      help='load into an unlogged staging schema, and swap it in when complete')
+  parser.add_argument('--temporal', '-t', action='store_true')
+  parser.add_argument('--statistics', '-s', action='store_true')
+  parser.add_argument('--log_json', '-lj', metavar='PATH',
+                      help='append per-phase timings to PATH as JSON lines')
+  parser.add_argument('--profile', '-p', action='store_true',
+                      help='run a sampling profiler over each phase')
+  add_backend_arguments(parser)
   args = parser.parse_args()
-  try:
-    result = subprocess.run(['date', '--date', args.archive_date, '+%Y-%m-%d'],
-                            capture_output=True,
-                            text=True,
-                            check=True)
-  except subprocess.CalledProcessError:
-    exit(f'Invalid archive date string: {args.archive_date}')
-  archive_target = result.stdout.strip()
+  backend = get_backend(args.backend, args.db)
+  if args.temporal and backend.name != 'postgres':
+    exit('The temporal tables need the postgres backend')
+  if args.loader == 'pipeline' and backend.name != 'postgres':
+    exit('The pipeline loader needs the postgres backend')
+  if args.layout == 'partitioned' and (backend.name != 'postgres' or args.loader == 'pipeline'):
+    exit('The partitioned layout needs the postgres backend and the copy or insert loader')
+  if args.rebuild and (backend.name != 'postgres' or args.layout != 'schemata'):
+    exit('Rebuilding needs the postgres backend and the schemata layout')
+  # build_archives() passes this configuration on to its worker processes.
+  configure(args.log_json, args.profile)
+
+  # Build many archive schemata concurrently, or add them to the temporal tables in date order
+  if args.all or args.range:
+    if args.range:
+      archive_dates = catalog.between(*[normalize_date(date_str) for date_str in args.range])
+    if args.temporal:
+      load_archives(archive_dates, catalog)
+    else:
+      # A SQLite file has one writer at a time.
+      jobs = max(1, args.jobs) if backend.name == 'postgres' else 1
+      build_archives(archive_dates, args.loader, jobs, backend, args.layout, args.rebuild,
+                     catalog)
+    exit()
+
+  archive_target = normalize_date(args.archive_date)
 
   # Find the last archive at or before archive_target
-  archive_date_index = min(bisect_left(archive_dates, archive_target), len(archive_dates) - 1)
-  archive_date = archive_dates[archive_date_index]
+  if (archive_set := catalog.at_or_before(archive_target)) is None:
+    exit(f'No archive at or before {archive_target}')
+  archive_date = archive_set.archive_date
   schema_name = f'a{archive_date.replace('-', '')}'
   print(f'{archive_date=} {schema_name}')
+  if not check_archive_set(catalog, archive_date).is_complete:
+    exit(f'{archive_date} archive files have changed, and can’t all be read')
 
-  # Be sure all three archive files are available
-  fail = False
-  source_archive = Path(archive_dir, f'{archive_date}_source_courses.csv.bz2')
-  if not source_archive.is_file():
-    print(f'{archive_date}_source_courses.csv.bz2 is not a file')
-    fail = True
-
-  destination_archive = Path(archive_dir, f'{archive_date}_destination_courses.csv.bz2')
-  if not destination_archive.is_file():
-    print(f'{archive_date}_destination_courses.csv.bz2 is not a file')
-    fail = True
-
-  effective_dates_archive = Path(archive_dir, f'{archive_date}_effective_dates.csv.bz2')
-  if not source_archive.is_file():
-    print(f'{archive_date}_effective_dates.csv.bz2 is not a file')
-    fail = True
-
-  if fail:
+  if args.temporal:
+    load_archives([archive_date], catalog)
     exit()
 
-  # Create the schema and build the tables
-  with psycopg.connect('dbname=cuny_curriculum') as conn:
-    with conn.cursor() as cursor:
-      cursor.execute(f"drop schema if exists {schema_name} cascade")
-      cursor.execute(f"create schema {schema_name}")
-
-      # transfer_rules
-      cursor.execute(f"""
-      create table {schema_name}.transfer_rules (
-        id                      serial primary key,
-        rule_key                text unique,
-        effective_date          date,
-        description             text default ''
-      )
-      """)
-      with bz2.open(effective_dates_archive, mode='rt') as infile:
-        print('transfer_rules:      ', end='')
-        sys.stdout.flush()
-        reader = csv.reader(infile)
-        for line in reader:
-          cursor.execute(f"""
-          insert into {schema_name}.transfer_rules values (default, %s, %s, default)
-          """, line)
-      cursor.execute(f"""
-      select count(*) from {schema_name}.transfer_rules
-      """)
-      print(f'{cursor.fetchone()[0]:,}')
-
-      # source_courses
-      cursor.execute(f"""
-      create table {schema_name}.source_courses (
-        id          serial primary key,
-        rule_key    text references {schema_name}.transfer_rules(rule_key),
-        src_inst    text,
-        dst_inst    text,
-        course_id   integer,
-        offer_nbr   integer,
-        min_credits real,
-        max_credits real,
-        credit_src  text,
-        min_grade   real,
-        max_grade   real      )
-      """)
-      with bz2.open(source_archive, mode='rt') as infile:
-        print('source courses:      ', end='')
-        sys.stdout.flush()
-        reader = csv.reader(infile)
-        for line in reader:
-          # Break out fields for the source and destination institutions
-          rule_key = line[0]
-          src_inst = rule_key[0:5]
-          dst_inst = rule_key[6:11]
-          line = [line[0], src_inst, dst_inst] + line[1:]
-          # Normalize grade range
-          line[-2] = 0. if float(line[-2]) < 0.7 else float(line[-2])
-          line[-1] = min(float(line[-1]), 4.0)
-          cursor.execute(f"""
-          insert into {schema_name}.source_courses
-                 values (default, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-          """, line)
-      cursor.execute(f"""
-      select count(*) from {schema_name}.source_courses
-      """)
-      print(f'{cursor.fetchone()[0]:,}')
-
-      # destination_courses
-      cursor.execute(f"""
-      create table {schema_name}.destination_courses (
-        id        serial primary key,
-        rule_key  text references {schema_name}.transfer_rules(rule_key),
-        course_id integer,
-        offer_nbr integer,
-        credits   real      )
-      """)
-      with bz2.open(destination_archive, mode='rt') as infile:
-        print('destination courses: ', end='')
-        sys.stdout.flush()
-        reader = csv.reader(infile)
-        for line in reader:
-          cursor.execute(f"""
-          insert into {schema_name}.destination_courses values(default, %s, %s, %s, %s)
-          """, line)
-      cursor.execute(f"""
-      select count(*) from {schema_name}.destination_courses
-      """)
-      print(f'{cursor.fetchone()[0]:,}')
+  # Create the schema and build the tables, counting rows per rule_key for the statistics
+  rule_counts = dict() if args.statistics else None
+  build_schema(archive_date, args.loader, rule_counts=rule_counts, backend=backend,
+               layout=args.layout, rebuild=args.rebuild, archive_set=archive_set)
+  print()
+  summary()
 
   # Show mean, median, and frequency distribution for number of source|destination courses per rule?
   if args.statistics:
     for table_name in ['source_courses', 'destination_courses']:
-      mean, median, distribution = statistics(schema_name, table_name)
+      mean, median, distribution = rule_key_statistics(rule_counts[table_name].distribution())
       print(f'{table_name}: {mean:.4} {median:.2}')
       for index, value in distribution.items():
         print(f'[{index}] {value:9,}')
@@ -0,0 +1,212 @@
+#! /usr/local/bin/python3
+"""Keep every archive set in one set of tables partitioned by archive_date, instead of one schema
+   per archive date.
+
+   The archives schema has transfer_rules, source_courses, and destination_courses tables with the
+   same columns as an archive schema’s, plus archive_date, and each is list-partitioned on
+   archive_date. An archive set is loaded into three standalone tables, such as
+   archives.source_courses_20250417_new, which then replace any partitions for its date, and are
+   attached as archives.source_courses_20250417 and so on, in one transaction: a date being
+   reloaded keeps its old rows until the new ones are in. Retiring an archive set detaches and
+   drops its partitions, with no rows to delete.
+
+   Queries can span archive dates without dynamic SQL, and ones that filter on archive_date only
+   scan the partitions for the dates selected.
+"""
+
+from archive_files import table_columns
+from argparse import ArgumentParser
+from backends import postgres
+
+schema_name = 'archives'
+
+# Advisory lock key for changing the partitioned tables’ partitions
+partitions_lock = 20250417
+
+
+# create_tables()
+# -------------------------------------------------------------------------------------------------
+def create_tables(cursor):
+  """Create the archives schema and its partitioned tables if they don’t already exist.
+
+     Indexes are defined on the partitioned tables, and get built on each partition as it is
+     attached.
+  """
+  # Even when they exist, creating the indexes locks the tables.
+  lock_partitions(cursor)
+  cursor.execute(f'create schema if not exists {schema_name}')
+
+  cursor.execute(f"""
+  create table if not exists {schema_name}.transfer_rules (
+    archive_date            date not null,
+    id                      serial,
+    rule_key                text,
+    effective_date          date,
+    description             text default '',
+    unique (archive_date, rule_key)
+  ) partition by list (archive_date)
+  """)
+
+  cursor.execute(f"""
+  create table if not exists {schema_name}.source_courses (
+    archive_date  date not null,
+    id            serial,
+    rule_key      text,
+    src_inst      text,
+    dst_inst      text,
+    course_id     integer,
+    offer_nbr     integer,
+    min_credits   real,
+    max_credits   real,
+    credit_src    text,
+    min_grade     real,
+    max_grade     real
+  ) partition by list (archive_date)
+  """)
+
+  cursor.execute(f"""
+  create table if not exists {schema_name}.destination_courses (
+    archive_date  date not null,
+    id            serial,
+    rule_key      text,
+    course_id     integer,
+    offer_nbr     integer,
+    credits       real
+  ) partition by list (archive_date)
+  """)
+
+  for table_name in ['source_courses', 'destination_courses']:
+    cursor.execute(f"""
+    create index if not exists {table_name}_rule_key on {schema_name}.{table_name} (rule_key)
+    """)
+    cursor.execute(f"""
+    create index if not exists {table_name}_course
+        on {schema_name}.{table_name} (course_id, offer_nbr)
+    """)
+
+
+# partition_name()
+# -------------------------------------------------------------------------------------------------
+def partition_name(table_name: str, archive_date: str) -> str:
+  """The partition of a table for an archive date, such as source_courses_20250417."""
+  return f'{table_name}_{archive_date.replace('-', '')}'
+
+
+# lock_partitions()
+# -------------------------------------------------------------------------------------------------
+def lock_partitions(cursor):
+  """Wait for other transactions changing the partitions to finish, and keep them waiting until
+     this one does. Attaching and detaching lock the three partitioned tables one after another,
+     so concurrent loads could otherwise deadlock.
+  """
+  cursor.execute('select pg_advisory_xact_lock(%s)', (partitions_lock, ))
+
+
+# create_partitions()
+# -------------------------------------------------------------------------------------------------
+def create_partitions(cursor, archive_date: str) -> dict:
+  """(Re-)create empty, standalone tables to load an archive date’s rows into, ready to replace
+     its partitions. Existing partitions for the date are left alone until attach_partitions().
+     Returns the tables’ qualified names keyed by table name.
+
+     Their archive_date defaults to the archive date, so they can be loaded with the same columns
+     as an archive schema’s tables. The check constraints let attach_partitions() skip scanning
+     the loaded rows to prove they belong in the partitions.
+  """
+  drop_loaded_tables(cursor, archive_date)
+  tables = dict()
+  for table_name in table_columns:
+    partition = partition_name(table_name, archive_date)
+    cursor.execute(f"""
+    create table {schema_name}.{partition}_new
+      (like {schema_name}.{table_name} including defaults)
+    """)
+    cursor.execute(f"""
+    alter table {schema_name}.{partition}_new
+      alter column archive_date set default '{archive_date}',
+      add constraint {partition}_date check (archive_date = '{archive_date}')
+    """)
+    tables[table_name] = f'{schema_name}.{partition}_new'
+  return tables
+
+
+# drop_loaded_tables()
+# -------------------------------------------------------------------------------------------------
+def drop_loaded_tables(cursor, archive_date: str):
+  """Drop an archive date’s tables from create_partitions() that were never attached."""
+  for table_name in table_columns:
+    cursor.execute(f"""
+    drop table if exists {schema_name}.{partition_name(table_name, archive_date)}_new
+    """)
+
+
+# attach_partitions()
+# -------------------------------------------------------------------------------------------------
+def attach_partitions(cursor, archive_date: str):
+  """Replace an archive date’s partitions, if any, with its loaded tables, and drop their check
+     constraints, which the partition bounds now enforce. Other transactions see the old
+     partitions until this one commits.
+  """
+  drop_partitions(cursor, archive_date)
+  for table_name in table_columns:
+    partition = partition_name(table_name, archive_date)
+    cursor.execute(f"""
+    alter table {schema_name}.{partition}_new rename to {partition}
+    """)
+    cursor.execute(f"""
+    alter table {schema_name}.{table_name}
+      attach partition {schema_name}.{partition} for values in ('{archive_date}')
+    """)
+    cursor.execute(f"""
+    alter table {schema_name}.{partition} drop constraint {partition}_date
+    """)
+    cursor.execute(f'analyze {schema_name}.{partition}')
+
+
+# list_partitions()
+# -------------------------------------------------------------------------------------------------
+def list_partitions(cursor) -> list:
+  """Archive dates with transfer_rules partitions, in date order."""
+  cursor.execute("""
+  select pg_get_expr(c.relpartbound, c.oid)
+    from pg_inherits i join pg_class c on c.oid = i.inhrelid
+   where i.inhparent = to_regclass(%s)
+  """, (f'{schema_name}.transfer_rules', ))
+  # Bounds are of the form FOR VALUES IN ('2025-04-17')
+  return sorted(row[0].split("'")[1] for row in cursor.fetchall())
+
+
+# drop_partitions()
+# -------------------------------------------------------------------------------------------------
+def drop_partitions(cursor, archive_date: str):
+  """Detach and drop an archive date’s partitions, or its tables that were never attached."""
+  lock_partitions(cursor)
+  for table_name in table_columns:
+    partition = partition_name(table_name, archive_date)
+    cursor.execute("""
+    select 1 from pg_inherits where inhrelid = to_regclass(%s)
+    """, (f'{schema_name}.{partition}', ))
+    if cursor.rowcount > 0:
+      cursor.execute(f"""
+      alter table {schema_name}.{table_name} detach partition {schema_name}.{partition}
+      """)
+    cursor.execute(f'drop table if exists {schema_name}.{partition}')
+
+
+# main()
+# -------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+  parser = ArgumentParser('List the archive dates in the partitioned tables')
+  parser.parse_args()
+
+  with postgres.connect() as conn:
+    with conn.cursor() as cursor:
+      cursor.execute('select to_regclass(%s)', (f'{schema_name}.transfer_rules', ))
+      if cursor.fetchone()[0] is None:
+        exit(f'No partitioned tables in the {schema_name} schema')
+      cursor.execute(f"""
+      select archive_date::text, count(*) from {schema_name}.transfer_rules group by archive_date
+      """)
+      num_rules = dict(cursor.fetchall())
+      for archive_date in list_partitions(cursor):
+        print(f'{archive_date} {num_rules.get(archive_date, 0):>10,} rules')
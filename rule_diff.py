@@ -0,0 +1,210 @@
+#! /usr/local/bin/python3
+"""List the rules added, removed, or changed between two archive sets.
+
+   The three files of each archive set are streamed in rule_key order and merge-joined, first
+   with each other to assemble each rule, and then with the other archive set’s rules, so memory
+   use doesn’t depend on the size of the archives. A current frame archive (frame_archives.py)
+   is in rule_key order already, and is streamed as it is. So is a file that turns out to be in
+   order while its first run_size rows are read, if that is the whole file. Larger bz2 files are
+   put in order with an external merge sort that spills sorted runs to temporary files.
+"""
+
+import heapq
+import pickle
+import sys
+import tempfile
+
+from archive_catalog import check_archive_set, load_catalog
+from archive_files import read_rows
+from argparse import ArgumentParser
+from collections import Counter
+from frame_archives import current_frames
+from itertools import groupby
+from operator import itemgetter
+from pathlib import Path
+
+run_size = 500_000  # Rows held in memory while sorting a file
+rule_key_of = itemgetter(0)
+
+
+# spilled_rows()
+# -------------------------------------------------------------------------------------------------
+def spilled_rows(path: Path):
+  """Generate the rows pickled into a sorted run file."""
+  with open(path, 'rb') as infile:
+    while True:
+      try:
+        yield pickle.load(infile)
+      except EOFError:
+        return
+
+
+# sorted_rows()
+# -------------------------------------------------------------------------------------------------
+def sorted_rows(table_name: str, path: Path):
+  """Generate an archive file’s rows in rule_key order, keeping at most run_size rows in memory.
+
+     The sort is stable, so the rows of each rule keep their order in the file.
+  """
+  if frames := current_frames(path):
+    # Recompression sorted the lines the same way.
+    yield from read_rows(table_name, frames)
+    return
+  rows = read_rows(table_name, path)
+  run = []
+  in_order = True
+  for row in rows:
+    if in_order and run and row[0] < run[-1][0]:
+      in_order = False
+    run.append(row)
+    if len(run) == run_size:
+      break
+  else:
+    # The whole file fits in one run.
+    yield from run if in_order else sorted(run, key=rule_key_of)
+    return
+
+  with tempfile.TemporaryDirectory() as temp_dir:
+    run_paths = []
+    while run:
+      run.sort(key=rule_key_of)
+      run_paths.append(Path(temp_dir, f'run_{len(run_paths)}'))
+      with open(run_paths[-1], 'wb') as outfile:
+        for row in run:
+          pickle.dump(row, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+      run = [row for _, row in zip(range(run_size), rows)]
+    yield from heapq.merge(*[spilled_rows(run_path) for run_path in run_paths], key=rule_key_of)
+
+
+# archive_rules()
+# -------------------------------------------------------------------------------------------------
+def archive_rules(archive_set):
+  """Generate (rule_key, effective_date, source_rows, destination_rows) in rule_key order.
+
+     Course rows for rule_keys that are not in the effective_dates file are skipped.
+  """
+  def groups(table_name):
+    rows = sorted_rows(table_name, archive_set.files[table_name].path)
+    return groupby(rows, key=rule_key_of)
+
+  source_groups = groups('source_courses')
+  destination_groups = groups('destination_courses')
+  source_key, source_rows = next(source_groups, (None, None))
+  destination_key, destination_rows = next(destination_groups, (None, None))
+
+  for rule_key, rows in groups('transfer_rules'):
+    effective_date = list(rows)[-1][1]
+    while source_key is not None and source_key < rule_key:
+      source_key, source_rows = next(source_groups, (None, None))
+    while destination_key is not None and destination_key < rule_key:
+      destination_key, destination_rows = next(destination_groups, (None, None))
+    yield (rule_key,
+           effective_date,
+           list(source_rows) if source_key == rule_key else [],
+           list(destination_rows) if destination_key == rule_key else [])
+
+
+# course_changes()
+# -------------------------------------------------------------------------------------------------
+def course_changes(label: str, old_rows: list, new_rows: list, course_index: int,
+                   details: dict) -> list:
+  """Describe the courses added to, removed from, or changed in one side of a rule.
+
+     Rows are matched by their (course_id, offer_nbr) columns, which start at course_index;
+     details maps a name to the columns of a matched row to compare, such as grades or credits.
+     A rule can list a course more than once, so each course’s values are compared as multisets,
+     and all of them are shown when they differ.
+  """
+  def by_course(rows):
+    courses = dict()
+    for row in rows:
+      courses.setdefault(f'{row[course_index]}.{row[course_index + 1]}', []).append(row)
+    return courses
+
+  def values(rows, columns):
+    return Counter('/'.join(str(row[column]) for column in columns) for row in rows)
+
+  old_courses, new_courses = by_course(old_rows), by_course(new_rows)
+  changes = [f'{label} +{course}' for course in new_courses if course not in old_courses]
+  changes += [f'{label} -{course}' for course in old_courses if course not in new_courses]
+  for course in old_courses.keys() & new_courses.keys():
+    for name, columns in details.items():
+      old_values = values(old_courses[course], columns)
+      new_values = values(new_courses[course], columns)
+      if old_values != new_values:
+        changes.append(f'{label} {course} {name} {', '.join(sorted(old_values.elements()))} → '
+                       f'{', '.join(sorted(new_values.elements()))}')
+  return sorted(changes)
+
+
+# rule_changes()
+# -------------------------------------------------------------------------------------------------
+def rule_changes(old_rule: tuple, new_rule: tuple) -> list:
+  """Differences between two versions of a rule, or an empty list if they are the same."""
+  _, old_effective_date, old_source, old_destination = old_rule
+  _, new_effective_date, new_source, new_destination = new_rule
+  changes = []
+  if old_effective_date != new_effective_date:
+    changes.append(f'effective_date {old_effective_date} → {new_effective_date}')
+  # source_courses rows: rule_key, src_inst, dst_inst, course_id, offer_nbr, min_credits,
+  # max_credits, credit_src, min_grade, max_grade
+  changes += course_changes('source', old_source, new_source, 3,
+                            {'credits': [5, 6, 7], 'grades': [8, 9]})
+  # destination_courses rows: rule_key, course_id, offer_nbr, credits
+  changes += course_changes('destination', old_destination, new_destination, 1,
+                            {'credits': [3]})
+  return changes
+
+
+# diff_archives()
+# -------------------------------------------------------------------------------------------------
+def diff_archives(old_rules, new_rules):
+  """Merge-join two rule streams. Generate (status, rule_key, changes) for each difference,
+     where status is added, removed, or changed.
+  """
+  old_rule = next(old_rules, None)
+  new_rule = next(new_rules, None)
+  while old_rule is not None or new_rule is not None:
+    if new_rule is None or (old_rule is not None and old_rule[0] < new_rule[0]):
+      yield 'removed', old_rule[0], []
+      old_rule = next(old_rules, None)
+    elif old_rule is None or new_rule[0] < old_rule[0]:
+      yield 'added', new_rule[0], []
+      new_rule = next(new_rules, None)
+    else:
+      if changes := rule_changes(old_rule, new_rule):
+        yield 'changed', new_rule[0], changes
+      old_rule = next(old_rules, None)
+      new_rule = next(new_rules, None)
+
+
+# main()
+# -------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+  parser = ArgumentParser('Rules added, removed, or changed between two archive sets')
+  parser.add_argument('--summary', '-s', action='store_true', help='only show the counts')
+  parser.add_argument('old_date', metavar='YYYY-MM-DD')
+  parser.add_argument('new_date', metavar='YYYY-MM-DD')
+  args = parser.parse_args()
+
+  catalog = load_catalog()
+  archive_sets = []
+  for target_date in [args.old_date, args.new_date]:
+    if (archive_set := catalog.at_or_before(target_date)) is None:
+      exit(f'No archive at or before {target_date}')
+    if not check_archive_set(catalog, archive_set.archive_date).is_complete:
+      exit(f'{archive_set.archive_date} archive files have changed, and can’t all be read')
+    archive_sets.append(archive_set)
+  old_set, new_set = archive_sets
+  print(f'{old_set.archive_date} → {new_set.archive_date}', file=sys.stderr)
+
+  counts = Counter()
+  symbols = {'added': '+', 'removed': '-', 'changed': '~'}
+  for status, rule_key, changes in diff_archives(archive_rules(old_set), archive_rules(new_set)):
+    counts[status] += 1
+    if not args.summary:
+      print(f'{symbols[status]} {rule_key}')
+      for change in changes:
+        print(f'    {change}')
+  print(f'{counts['added']:,} added; {counts['removed']:,} removed; {counts['changed']:,} changed',
+        file=sys.stderr)
@@ -0,0 +1,247 @@
+#! /usr/local/bin/python3
+"""How a rule changed over time: a per-rule history index built across all the archive sets.
+
+   The index records, for each rule_key, the archive dates on which the rule was added, changed,
+   or removed, and a compact encoding of the rule at each of those dates. Archive sets in which a
+   rule is unchanged are not recorded. The index is a directory under the cache directory:
+
+     history.txt      Each rule’s history as one record, in rule_key order. A record has one
+                      line per change: the archive date, a tab, and the encoded rule, which is
+                      empty if the rule was removed.
+     rule_keys.txt    The rule_keys, one per line, in the same order.
+     offsets.Q        uint64 offsets of the records in history.txt, plus its total length.
+     meta.json        The archive dates covered and the byte order of offsets.Q.
+
+   A rule_key is found by binary search of the rule_keys, and its whole history is read with a
+   single positioned read. Recently looked up rules are kept in an LRU cache.
+"""
+
+import json
+import os
+import shutil
+import sys
+
+from archive_catalog import check_archive_set, load_catalog
+from archive_files import cache_dir
+from argparse import ArgumentParser
+from array import array
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from rule_diff import archive_rules, rule_changes
+
+history_dir = Path(cache_dir, 'rule_history')
+
+_index = None
+
+
+# encode_rule()
+# -------------------------------------------------------------------------------------------------
+def encode_rule(rule: tuple) -> str:
+  """A rule from rule_diff.archive_rules() as effective_date|source courses|destination courses.
+
+     Courses are separated by semicolons and their values by commas; the institutions are
+     omitted because they are part of the rule_key. Courses are sorted, so that a rule encodes
+     the same way regardless of the order of its rows in the archive files.
+  """
+  _, effective_date, source_rows, destination_rows = rule
+  source = sorted(','.join(map(str, row[3:])) for row in source_rows)
+  destination = sorted(','.join(map(str, row[1:])) for row in destination_rows)
+  return f'{effective_date}|{';'.join(source)}|{';'.join(destination)}'
+
+
+# decode_rule()
+# -------------------------------------------------------------------------------------------------
+def decode_rule(rule_key: str, encoded: str) -> tuple | None:
+  """The (rule_key, effective_date, source_rows, destination_rows) tuple for an encoded rule, in
+     the form rule_diff.rule_changes() compares, or None for a removed rule. Values are strings.
+  """
+  if not encoded:
+    return None
+  effective_date, source, destination = encoded.split('|')
+  src_inst, dst_inst = rule_key[0:5], rule_key[6:11]
+  return (rule_key,
+          effective_date,
+          [[rule_key, src_inst, dst_inst, *course.split(',')]
+           for course in source.split(';') if course],
+          [[rule_key, *course.split(',')] for course in destination.split(';') if course])
+
+
+# archive_states()
+# -------------------------------------------------------------------------------------------------
+def archive_states(archive_set) -> dict:
+  """Every rule in an archive set, encoded, keyed by rule_key."""
+  return {rule[0]: encode_rule(rule) for rule in archive_rules(archive_set)}
+
+
+# build_index()
+# -------------------------------------------------------------------------------------------------
+def build_index(jobs: int = os.cpu_count(), verbose: bool = True) -> Path:
+  """(Re-)build the history index from all the complete archive sets. Returns its directory.
+
+     Archive sets are read in parallel, and compared in date order with the previous set. At most
+     jobs archive sets are read ahead of the comparisons, so finished ones don’t pile up in
+     memory.
+  """
+  catalog = load_catalog()
+  # Check the files of every set, since all of them are read; a set can turn out incomplete.
+  for archive_date in catalog.dates:
+    check_archive_set(catalog, archive_date)
+  histories = dict()  # List of (archive_date, encoded rule) keyed by rule_key
+  previous = dict()
+  with ProcessPoolExecutor(max_workers=jobs) as executor:
+    archive_dates = iter(catalog.dates)
+    pending = deque()
+
+    def submit_next():
+      if (archive_date := next(archive_dates, None)) is not None:
+        pending.append((archive_date,
+                        executor.submit(archive_states, catalog.archive_sets[archive_date])))
+
+    for _ in range(jobs):
+      submit_next()
+    while pending:
+      archive_date, future = pending.popleft()
+      states = future.result()
+      submit_next()
+      num_changes = 0
+      for rule_key, encoded in states.items():
+        if previous.get(rule_key) != encoded:
+          histories.setdefault(rule_key, []).append((archive_date, encoded))
+          num_changes += 1
+      for rule_key in previous.keys() - states.keys():
+        histories[rule_key].append((archive_date, ''))
+        num_changes += 1
+      previous = states
+      if verbose:
+        print(f'{archive_date} {len(states):>10,} rules {num_changes:>10,} changes')
+
+  # Write into a scratch directory, and rename it into place when complete.
+  scratch_dir = history_dir.with_name(f'{history_dir.name}.tmp')
+  shutil.rmtree(scratch_dir, ignore_errors=True)
+  scratch_dir.mkdir(parents=True)
+  rule_keys = sorted(histories)
+  offsets = array('Q', [0])
+  with open(Path(scratch_dir, 'history.txt'), 'wb') as outfile:
+    for rule_key in rule_keys:
+      record = ''.join(f'{archive_date}\t{encoded}\n'
+                       for archive_date, encoded in histories[rule_key]).encode()
+      outfile.write(record)
+      offsets.append(offsets[-1] + len(record))
+  Path(scratch_dir, 'rule_keys.txt').write_text(''.join(f'{key}\n' for key in rule_keys))
+  with open(Path(scratch_dir, 'offsets.Q'), 'wb') as outfile:
+    offsets.tofile(outfile)
+  meta = {'dates': catalog.dates, 'rules': len(rule_keys), 'byteorder': sys.byteorder}
+  Path(scratch_dir, 'meta.json').write_text(json.dumps(meta, indent=1))
+  shutil.rmtree(history_dir, ignore_errors=True)
+  scratch_dir.rename(history_dir)
+  open_index.cache_clear()
+  rule_history.cache_clear()
+  return history_dir
+
+
+class HistoryIndex:
+  """Read access to a built history index."""
+
+  def __init__(self, path: Path = history_dir):
+    self.meta = json.loads(Path(path, 'meta.json').read_text())
+    if self.meta['byteorder'] != sys.byteorder:
+      raise ValueError(f'rule history index was written with {self.meta['byteorder']}-endian '
+                       'byte order')
+    self.rule_keys = Path(path, 'rule_keys.txt').read_text().splitlines()
+    self.offsets = array('Q')
+    with open(Path(path, 'offsets.Q'), 'rb') as infile:
+      self.offsets.frombytes(infile.read())
+    self.fd = os.open(Path(path, 'history.txt'), os.O_RDONLY)
+
+  def record(self, rule_key: str) -> str | None:
+    """A rule’s history record, or None if the rule_key is not in any archive set."""
+    index = bisect_left(self.rule_keys, rule_key)
+    if index == len(self.rule_keys) or self.rule_keys[index] != rule_key:
+      return None
+    start, end = self.offsets[index], self.offsets[index + 1]
+    return os.pread(self.fd, end - start, start).decode()
+
+
+# open_index()
+# -------------------------------------------------------------------------------------------------
+@lru_cache(maxsize=1)
+def open_index() -> HistoryIndex:
+  """The history index, opened once per process."""
+  if not Path(history_dir, 'meta.json').is_file():
+    raise FileNotFoundError(f'No rule history index in {history_dir}; build it with --build')
+  return HistoryIndex()
+
+
+# rule_history()
+# -------------------------------------------------------------------------------------------------
+@lru_cache(maxsize=4096)
+def rule_history(rule_key: str) -> tuple:
+  """A rule’s history: (archive_date, rule) for each archive date on which it was added,
+     changed, or removed, where rule is as returned by decode_rule() (None when removed). Empty
+     if the rule_key is not in any archive set.
+  """
+  record = open_index().record(rule_key)
+  if record is None:
+    return ()
+  return tuple((archive_date, decode_rule(rule_key, encoded))
+               for archive_date, encoded in (line.split('\t')
+                                             for line in record.splitlines()))
+
+
+# describe_rule()
+# -------------------------------------------------------------------------------------------------
+def describe_rule(rule: tuple) -> list:
+  """Lines listing a rule’s effective date and courses."""
+  _, effective_date, source_rows, destination_rows = rule
+  lines = [f'effective_date {effective_date}']
+  lines += [f'source {row[3]}.{row[4]} credits {'/'.join(row[5:8])} grades {'/'.join(row[8:])}'
+            for row in source_rows]
+  lines += [f'destination {row[1]}.{row[2]} credits {row[3]}' for row in destination_rows]
+  return lines
+
+
+# main()
+# -------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+  parser = ArgumentParser('Show how transfer rules changed across the archive sets')
+  parser.add_argument('rule_keys', nargs='*', metavar='RULE_KEY')
+  parser.add_argument('--build', '-b', action='store_true',
+                      help='(re-)build the history index first')
+  parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count())
+  args = parser.parse_args()
+
+  if args.build:
+    build_index(args.jobs)
+  elif not args.rule_keys:
+    parser.error('nothing to do: give one or more rule_keys, or --build')
+
+  try:
+    index = open_index()
+  except FileNotFoundError as err:
+    exit(err)
+  if args.rule_keys and (catalog_dates := load_catalog().dates) != index.meta['dates']:
+    print(f'The history index covers {len(index.meta['dates'])} archive sets, but there are '
+          f'{len(catalog_dates)} now; rebuild it with --build', file=sys.stderr)
+
+  for rule_key in args.rule_keys:
+    print(rule_key)
+    history = rule_history(rule_key)
+    if not history:
+      print('    not in any archive set')
+    previous = None
+    for archive_date, rule in history:
+      if rule is None:
+        print(f'  {archive_date} removed')
+        lines = []
+      elif previous is None:
+        print(f'  {archive_date} added')
+        lines = describe_rule(rule)
+      else:
+        print(f'  {archive_date} changed')
+        lines = rule_changes(previous, rule)
+      for line in lines:
+        print(f'    {line}')
+      previous = rule
@@ -2,15 +2,44 @@
 # OBSOLETE Separate schemas for each archive date no longer being use.
 """ Generate descriptive statistics for one of the tables in a transfer archive schema.
 """
-import psycopg
+import csv
+import json
+import re
 import sys
 
+from archive_files import archive_path, read_batches
+from argparse import ArgumentParser
+from backends import add_backend_arguments, get_backend, postgres
+from collections import Counter
+from columnar_cache import ColumnarArchive, is_cached
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+from list_schemata import list_schemata
+
 
 # statistics()
 # -------------------------------------------------------------------------------------------------
-def statistics(schema, table_name):
+def statistics(schema, table_name, conn=None, backend=postgres):
   """Return mean, median, and frequency distribution of rows per key for a table.
+
+     Uses conn if given, otherwise opens a connection for the query. SQLite has no
+     percentile_cont, so for it the database computes the frequency distribution and the
+     statistics are computed from that here.
   """
+  if conn is None:
+    with backend.connect() as conn:
+      return statistics(schema, table_name, conn, backend)
+
+  if backend.name == 'sqlite':
+    with conn.cursor() as cursor:
+      cursor.execute(f"""
+      select row_count, count(*)
+        from (select count(*) as row_count from {backend.table(schema, table_name)}
+              group by rule_key)
+       group by row_count
+      """)
+      return rule_key_statistics(dict(cursor.fetchall()))
+
   query = f"""
     WITH rule_key_counts AS (
         -- First, count rows per rule_key
@@ -56,27 +85,191 @@ def statistics(schema, table_name):
     ORDER BY sort_order, row_count;
     """
 
-  with psycopg.connect('dbname=cuny_curriculum') as conn:
-    with conn.cursor() as cursor:
-      cursor.execute(query)
-      mean, median = cursor.fetchone()[-2:]
-      distribution = dict()
-      for row in cursor:
-        distribution[row[0]] = row[1]
+  with conn.cursor() as cursor:
+    cursor.execute(query)
+    mean, median = cursor.fetchone()[-2:]
+    distribution = dict()
+    for row in cursor:
+      distribution[row[0]] = row[1]
+  return mean, median, distribution
+
+
+# summarize()
+# -------------------------------------------------------------------------------------------------
+def summarize(distribution: dict) -> tuple:
+  """Mean and median of the row counts in a {row_count: frequency} distribution.
+
+     The median interpolates between the two middle values for an even number of keys, like
+     percentile_cont(0.5).
+  """
+  num_keys = sum(distribution.values())
+  if num_keys == 0:
+    return None, None
+  mean = sum(row_count * frequency for row_count, frequency in distribution.items()) / num_keys
+  middle = [(num_keys - 1) // 2, num_keys // 2]
+  values = []
+  seen = 0
+  for row_count in sorted(distribution):
+    seen += distribution[row_count]
+    while middle and middle[0] < seen:
+      values.append(row_count)
+      middle.pop(0)
+  return mean, (values[0] + values[1]) / 2
+
+
+class RunLengths:
+  """The {row_count: frequency} distribution of rows per rule_key, from a single pass over the
+     rows in any order.
+
+     Rows are counted a run of equal rule_keys at a time, into a Counter keyed by rule_key, so
+     memory grows with the number of rules; the archive files aren’t sorted by rule_key, so
+     only the per-rule counts tell which runs belong to the same rule.
+  """
+
+  def __init__(self):
+    self.counts = Counter()
+
+  def add(self, rule_key, count: int = 1):
+    """Count count rows with a rule_key."""
+    self.counts[rule_key] += count
+
+  def update(self, rule_keys):
+    """Count a sequence of rule_keys."""
+    counts = self.counts
+    for rule_key, group in groupby(rule_keys):
+      counts[rule_key] += sum(1 for _ in group)
+
+  def distribution(self) -> dict:
+    return dict(Counter(self.counts.values()))
+
+
+# count_rule_keys()
+# -------------------------------------------------------------------------------------------------
+def count_rule_keys(rows, run_lengths: RunLengths):
+  """Pass rows through unchanged, counting the rows for each rule_key (the first column).
+
+     Lets a loader gather the statistics in the same pass that loads the rows.
+  """
+  for row in rows:
+    run_lengths.add(row[0])
+    yield row
+
+
+# rule_key_statistics()
+# -------------------------------------------------------------------------------------------------
+def rule_key_statistics(distribution: dict) -> tuple:
+  """Mean, median, and (sorted) frequency distribution from a {row_count: frequency} dict.
+
+     The distribution is a counting histogram, so the exact median is found by walking it,
+     without sorting the per-rule counts.
+  """
+  distribution = dict(sorted(distribution.items()))
+  mean, median = summarize(distribution)
   return mean, median, distribution
 
 
+# archive_statistics()
+# -------------------------------------------------------------------------------------------------
+def archive_statistics(archive_date: str, table_name: str) -> tuple:
+  """Same as statistics(), but computed from an archive set rather than a schema.
+
+     The rule_keys are read in one pass, from the columnar cache of the archive set if there is
+     one, otherwise from the archive file. No database is involved.
+  """
+  run_lengths = RunLengths()
+  if is_cached(archive_date):
+    batches = [ColumnarArchive(archive_date).column(table_name, 'rule_key')]
+  else:
+    batches = (columns[0] for columns in read_batches(table_name,
+                                                      archive_path(archive_date, table_name)))
+  for rule_keys in batches:
+    run_lengths.update(rule_keys)
+  return rule_key_statistics(run_lengths.distribution())
+
+
+# time_series()
+# -------------------------------------------------------------------------------------------------
+def time_series(jobs: int, backend=postgres) -> list:
+  """Statistics for both course tables of every archive schema, in archive date order.
+
+     With PostgreSQL, the queries run concurrently, sharing a pool of jobs connections. A SQLite
+     file is queried one table at a time over a single connection.
+  """
+  table_names = ['source_courses', 'destination_courses']
+  if backend.name == 'sqlite':
+    with backend.connect() as conn:
+      results = {(schema, table_name): statistics(schema, table_name, conn, backend)
+                 for schema in backend.list_schemata(conn)
+                 for table_name in table_names}
+  else:
+    from psycopg_pool import ConnectionPool
+
+    with ConnectionPool(backend.conninfo, min_size=1, max_size=jobs) as pool:
+      with pool.connection() as conn:
+        schemata = list_schemata(conn)
+
+      def pooled_statistics(schema, table_name):
+        with pool.connection() as conn:
+          return statistics(schema, table_name, conn)
+
+      with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {(schema, table_name): executor.submit(pooled_statistics, schema, table_name)
+                   for schema in schemata
+                   for table_name in table_names}
+        results = {key: future.result() for key, future in futures.items()}
+
+  series = []
+  for (schema, table_name), (mean, median, distribution) in results.items():
+    # An empty table has no mean or median.
+    series.append({'archive_date': f'{schema[1:5]}-{schema[5:7]}-{schema[7:9]}',
+                   'table_name': table_name,
+                   'num_rules': sum(distribution.values()),
+                   'mean': None if mean is None else float(mean),
+                   'median': None if median is None else float(median),
+                   'distribution': {str(row_count): frequency
+                                    for row_count, frequency in distribution.items()}})
+  return series
+
+
 # main()
 # -------------------------------------------------------------------------------------------------
 if __name__ == '__main__':
-  if len(sys.argv) == 2:
-    schema = sys.argv[1]
-  else:
-    # This schema might work
-    schema = 'a20250417'
+  parser = ArgumentParser('Rows per rule_key statistics for transfer archive course tables')
+  parser.add_argument('schema', nargs='?', default='a20250417',  # This schema might work
+                      help='schema name, or archive date (YYYY-MM-DD) to read the archive files')
+  parser.add_argument('--all', '-a', action='store_true',
+                      help='time series for all archive schemata')
+  parser.add_argument('--jobs', '-j', type=int, default=8)
+  parser.add_argument('--format', '-f', choices=['csv', 'json'], default='csv')
+  add_backend_arguments(parser)
+  args = parser.parse_args()
+  backend = get_backend(args.backend, args.db)
+
+  if args.all:
+    series = time_series(max(1, args.jobs), backend)
+    if args.format == 'json':
+      json.dump(series, sys.stdout, indent=1)
+      print()
+    else:
+      writer = csv.writer(sys.stdout)
+      writer.writerow(['archive_date', 'table_name', 'num_rules', 'mean', 'median',
+                       'distribution'])
+      for point in series:
+        writer.writerow([point['archive_date'], point['table_name'], point['num_rules'],
+                         '' if point['mean'] is None else f'{point['mean']:.4f}', point['median'],
+                         json.dumps(point['distribution'])])
+    exit()
 
+  schema = args.schema
   for table_name in ['source_courses', 'destination_courses']:
-    mean, median, distribution = statistics(schema, table_name)
+    if re.match(r'^\d{4}-\d{2}-\d{2}$', schema):
+      # An archive date rather than a schema name
+      mean, median, distribution = archive_statistics(schema, table_name)
+    else:
+      mean, median, distribution = statistics(schema, table_name, backend=backend)
+    if mean is None:
+      print(f'{table_name}: no rows')
+      continue
     print(f'{table_name}: {mean:.4} {median:.2}')
     for index, value in distribution.items():
       print(f'[{index}] {value:9,}')
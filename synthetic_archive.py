@@ -0,0 +1,207 @@
+#! /usr/local/bin/python3
+"""Generate synthetic rules_archive sets, and the matching cuny_courses rows, for benchmarking.
+
+   Each institution gets a catalog of courses in a handful of disciplines. Rules map one or more
+   courses at a sending institution to one or more courses at a receiving institution, with
+   rule_keys in the SRC01-DST01-DISC-n form. The numbers of source and destination courses per
+   rule follow a geometric distribution, so most rules have one course on each side and a few
+   have many, as in the real archives. A small fraction of courses are inactive, message
+   (MLA/MNL), or blanket credit (BKCR) courses, and a small fraction of rules carry grade
+   requirements.
+
+   Successive archive dates differ by a configurable fraction of changed, added, and removed
+   rules.
+"""
+
+import bz2
+import csv
+import datetime
+import random
+
+from archive_files import archive_path, archive_suffixes
+from argparse import ArgumentParser
+from backends import courses_columns
+from dataclasses import dataclass
+from pathlib import Path
+
+institutions = ['BAR01', 'BCC01', 'BKL01', 'BMC01', 'CSI01', 'CTY01', 'HOS01', 'HTR01', 'JJC01',
+                'KCC01', 'LAG01', 'LEH01', 'MEC01', 'NCC01', 'NYT01', 'QCC01', 'QNS01', 'SPS01',
+                'YRK01']
+disciplines = ['ACCT', 'ANTH', 'ART', 'BIO', 'CHEM', 'CSCI', 'ECON', 'ENGL', 'HIST', 'MATH',
+               'MUS', 'PHIL', 'PHYS', 'POLS', 'PSYC', 'SOC', 'SPAN', 'THEA']
+
+
+@dataclass
+class Rule:
+  rule_key: str
+  effective_date: str
+  # Lists of [course_id, offer_nbr, min_credits, max_credits, credit_src, min_grade, max_grade]
+  source_courses: list
+  # Lists of [course_id, offer_nbr, credits]
+  destination_courses: list
+
+
+# geometric()
+# -------------------------------------------------------------------------------------------------
+def geometric(rng: random.Random, p: float, limit: int) -> int:
+  """Number of trials to the first success, at most limit: 1 with probability p, and so on."""
+  n = 1
+  while n < limit and rng.random() > p:
+    n += 1
+  return n
+
+
+# make_courses()
+# -------------------------------------------------------------------------------------------------
+def make_courses(rng: random.Random, courses_per_institution: int) -> dict:
+  """cuny_courses rows, keyed by institution and then discipline."""
+  courses = {institution: {discipline: [] for discipline in disciplines}
+             for institution in institutions}
+  course_id = 100_000
+  for institution in institutions:
+    for _ in range(courses_per_institution):
+      course_id += 1
+      discipline = rng.choice(disciplines)
+      roll = rng.random()
+      designation = 'MLA' if roll < 0.02 else 'MNL' if roll < 0.04 else 'RLA'
+      attributes = 'BKCR' if rng.random() < 0.03 else ''
+      status = 'I' if rng.random() < 0.1 else 'A'
+      # Cross-listed courses share a course_id with different offer_nbr values.
+      for offer_nbr in range(1, 3 if rng.random() < 0.05 else 2):
+        courses[institution][discipline].append(
+            [course_id, offer_nbr, institution, discipline, f'{rng.randint(100, 499)}',
+             f'{discipline} Course {course_id}', status, designation, attributes])
+  return courses
+
+
+# make_rule()
+# -------------------------------------------------------------------------------------------------
+def make_rule(rng: random.Random, courses: dict, rule_key: str, src: str, dst: str,
+              discipline: str) -> Rule:
+  """A rule with a skewed number of source and destination courses."""
+  source_courses = []
+  for course in rng.sample(courses[src][discipline],
+                           min(geometric(rng, 0.7, 8), len(courses[src][discipline]))):
+    credits = rng.choice([0, 1, 3, 3, 3, 4])
+    min_grade, max_grade = (0.0, 4.3) if rng.random() > 0.05 else (rng.choice([1.7, 2.0]), 4.3)
+    source_courses.append([course[0], course[1], credits, credits, 'E', min_grade, max_grade])
+  destination_courses = []
+  for course in rng.sample(courses[dst][discipline],
+                           min(geometric(rng, 0.8, 5), len(courses[dst][discipline]))):
+    destination_courses.append([course[0], course[1], rng.choice([0, 1, 3, 3, 3, 4])])
+  effective_date = datetime.date(2010, 1, 1) + datetime.timedelta(days=rng.randint(0, 5000))
+  return Rule(rule_key, effective_date.isoformat(), source_courses, destination_courses)
+
+
+# add_rules()
+# -------------------------------------------------------------------------------------------------
+def add_rules(rng: random.Random, courses: dict, rules: dict, num_rules: int):
+  """Add num_rules new rules to the rules dict, which is keyed by rule_key."""
+  target = len(rules) + num_rules
+  next_numbers = dict()
+  while len(rules) < target:
+    src, dst = rng.sample(institutions, 2)
+    discipline = rng.choice(disciplines)
+    if not courses[src][discipline] or not courses[dst][discipline]:
+      continue
+    prefix = f'{src}-{dst}-{discipline}'
+    number = next_numbers.get(prefix, 1)
+    while (rule_key := f'{prefix}-{number}') in rules:
+      number += 1
+    next_numbers[prefix] = number + 1
+    rules[rule_key] = make_rule(rng, courses, rule_key, src, dst, discipline)
+
+
+# evolve()
+# -------------------------------------------------------------------------------------------------
+def evolve(rng: random.Random, courses: dict, rules: dict, change_rate: float) -> dict:
+  """The next archive’s rules: change_rate of the rules are changed, and about a tenth as many
+     are removed and added.
+  """
+  rules = dict(rules)
+  rule_keys = list(rules)
+  num_changes = min(int(len(rule_keys) * change_rate), len(rule_keys))
+  for rule_key in rng.sample(rule_keys, num_changes):
+    src, dst, discipline, _ = rule_key.split('-')
+    rules[rule_key] = make_rule(rng, courses, rule_key, src, dst, discipline)
+  for rule_key in rng.sample(rule_keys, num_changes // 10):
+    del rules[rule_key]
+  add_rules(rng, courses, rules, num_changes // 10)
+  return rules
+
+
+# write_archive()
+# -------------------------------------------------------------------------------------------------
+def write_archive(rules: dict, archive_date: str, archive_dir: Path):
+  """Write an archive set’s three files in the same form as the real archives."""
+  files = {table_name: bz2.open(archive_path(archive_date, table_name, archive_dir), 'wt',
+                                newline='')
+           for table_name in archive_suffixes}
+  writers = {table_name: csv.writer(file) for table_name, file in files.items()}
+  for rule in rules.values():
+    writers['transfer_rules'].writerow([rule.rule_key, rule.effective_date])
+    for course in rule.source_courses:
+      writers['source_courses'].writerow([rule.rule_key] + course)
+    for course in rule.destination_courses:
+      writers['destination_courses'].writerow([rule.rule_key] + course)
+  for file in files.values():
+    file.close()
+
+
+# write_courses()
+# -------------------------------------------------------------------------------------------------
+def write_courses(courses: dict, path: Path):
+  """Write the cuny_courses rows as a CSV file with a header row."""
+  with open(path, 'w', newline='') as outfile:
+    writer = csv.writer(outfile)
+    writer.writerow(courses_columns)
+    for by_discipline in courses.values():
+      for discipline_courses in by_discipline.values():
+        writer.writerows(discipline_courses)
+
+
+# generate()
+# -------------------------------------------------------------------------------------------------
+def generate(archive_dir: Path, num_rules: int, num_dates: int = 1,
+             courses_per_institution: int = 2_000, change_rate: float = 0.01,
+             first_date: str = '2025-01-01', seed: int = 0) -> list:
+  """Write num_dates archive sets, a week apart, and cuny_courses.csv to archive_dir.
+
+     Returns the list of archive dates.
+  """
+  rng = random.Random(seed)
+  archive_dir = Path(archive_dir)
+  archive_dir.mkdir(parents=True, exist_ok=True)
+  courses = make_courses(rng, courses_per_institution)
+  write_courses(courses, Path(archive_dir, 'cuny_courses.csv'))
+  rules = dict()
+  add_rules(rng, courses, rules, num_rules)
+  archive_dates = []
+  for index in range(num_dates):
+    archive_date = (datetime.date.fromisoformat(first_date)
+                    + datetime.timedelta(weeks=index)).isoformat()
+    if index:
+      rules = evolve(rng, courses, rules, change_rate)
+    write_archive(rules, archive_date, archive_dir)
+    archive_dates.append(archive_date)
+  return archive_dates
+
+
+# main()
+# -------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+  parser = ArgumentParser('Generate synthetic rules archive sets')
+  parser.add_argument('archive_dir')
+  parser.add_argument('--rules', '-r', type=int, default=100_000)
+  parser.add_argument('--dates', '-d', type=int, default=1)
+  parser.add_argument('--courses', '-c', type=int, default=2_000,
+                      help='courses per institution')
+  parser.add_argument('--change_rate', '-cr', type=float, default=0.01)
+  parser.add_argument('--first_date', '-fd', default='2025-01-01')
+  parser.add_argument('--seed', '-s', type=int, default=0)
+  args = parser.parse_args()
+
+  archive_dates = generate(args.archive_dir, args.rules, args.dates, args.courses,
+                           args.change_rate, args.first_date, args.seed)
+  print(f'{len(archive_dates)} archive sets from {archive_dates[0]} to {archive_dates[-1]} '
+        f'in {args.archive_dir}')
@@ -0,0 +1,332 @@
+#! /usr/local/bin/python3
+"""Keep every archive set in one set of temporal tables instead of one schema per archive date.
+
+   Each version of a rule (its effective date plus its source and destination course rows) is
+   stored once, with a validity range [valid_from, valid_to) of archive dates. A new archive is
+   diffed against the current versions, so only the rules that were added, changed, or removed
+   since the previous archive get written. The diff is done by the database: the new archive’s
+   rule digests are copied into a staging table and anti-joined with the current versions’.
+
+   Each loaded archive records the SHA-256 checksums of its files from the archive catalog, and
+   an archive set whose files are the same as the previous one’s is recorded without being read.
+
+   The point-in-time view for an archive date is a schema, such as t20250417 (never the name
+   mk_tables.py gives the archive date’s own schema), containing transfer_rules, source_courses,
+   and destination_courses views that select the rows valid on that date.
+"""
+
+import datetime
+import hashlib
+import psycopg
+import sys
+import time
+
+from archive_catalog import ArchiveSet, check_archive_set, load_catalog
+from archive_files import archive_path, read_rows, table_columns
+from argparse import ArgumentParser
+from collections import defaultdict
+
+schema_name = 'temporal'
+
+
+# create_tables()
+# -------------------------------------------------------------------------------------------------
+def create_tables(cursor):
+  """Create the temporal schema and its tables if they don’t already exist."""
+  cursor.execute(f"create schema if not exists {schema_name}")
+
+  cursor.execute(f"""
+  create table if not exists {schema_name}.archives (
+    archive_date  date primary key,
+    num_rules     integer,
+    num_added     integer,
+    num_changed   integer,
+    num_removed   integer,
+    loaded_at     timestamptz default now()
+  )
+  """)
+  # Added after the first archives were loaded
+  cursor.execute(f'alter table {schema_name}.archives add column if not exists checksums text')
+
+  cursor.execute(f"""
+  create table if not exists {schema_name}.transfer_rules (
+    rule_key        text,
+    effective_date  date,
+    digest          text,
+    valid_from      date,
+    valid_to        date,
+    primary key (rule_key, valid_from)
+  )
+  """)
+
+  cursor.execute(f"""
+  create table if not exists {schema_name}.source_courses (
+    rule_key    text,
+    src_inst    text,
+    dst_inst    text,
+    course_id   integer,
+    offer_nbr   integer,
+    min_credits real,
+    max_credits real,
+    credit_src  text,
+    min_grade   real,
+    max_grade   real,
+    valid_from  date,
+    valid_to    date
+  )
+  """)
+
+  cursor.execute(f"""
+  create table if not exists {schema_name}.destination_courses (
+    rule_key    text,
+    course_id   integer,
+    offer_nbr   integer,
+    credits     real,
+    valid_from  date,
+    valid_to    date
+  )
+  """)
+
+  for table_name in table_columns:
+    cursor.execute(f"""
+    create index if not exists {table_name}_current
+        on {schema_name}.{table_name} (rule_key) where valid_to is null
+    """)
+    cursor.execute(f"""
+    create index if not exists {table_name}_validity
+        on {schema_name}.{table_name} (valid_from, valid_to)
+    """)
+
+
+# read_archive()
+# -------------------------------------------------------------------------------------------------
+def read_archive(archive_date: str) -> dict:
+  """Group an archive set’s rows by rule_key.
+
+     Returns {rule_key: (effective_date, source_rows, destination_rows)}, with the course rows
+     in sorted order so that equal rules compare equal regardless of their order in the files.
+  """
+  effective_dates = dict(read_rows('transfer_rules',
+                                   archive_path(archive_date, 'transfer_rules')))
+  source_rows = defaultdict(list)
+  for row in read_rows('source_courses', archive_path(archive_date, 'source_courses')):
+    source_rows[row[0]].append(tuple(row))
+  destination_rows = defaultdict(list)
+  for row in read_rows('destination_courses', archive_path(archive_date, 'destination_courses')):
+    destination_rows[row[0]].append(tuple(row))
+  return {rule_key: (effective_date,
+                     sorted(source_rows[rule_key]),
+                     sorted(destination_rows[rule_key]))
+          for rule_key, effective_date in effective_dates.items()}
+
+
+# digest()
+# -------------------------------------------------------------------------------------------------
+def digest(rule: tuple) -> str:
+  """Fingerprint of a rule’s effective date and course rows."""
+  return hashlib.blake2b(repr(rule).encode(), digest_size=16).hexdigest()
+
+
+# archive_checksums()
+# -------------------------------------------------------------------------------------------------
+def archive_checksums(archive_set: ArchiveSet) -> str:
+  """The SHA-256 checksums of an archive set’s files, in table_columns order."""
+  return ','.join(archive_set.files[table_name].sha256 for table_name in table_columns)
+
+
+# load_archive()
+# -------------------------------------------------------------------------------------------------
+def load_archive(cursor, archive_date: str, archive_set: ArchiveSet | None = None) -> tuple:
+  """Record the rules added, changed, or removed by an archive set.
+
+     Archive dates have to be loaded in chronological order. Returns (num_added, num_changed,
+     num_removed). With the archive set’s catalog entry, a set whose files have the same
+     checksums as the latest loaded archive’s is recorded as unchanged without reading it. Raises
+     ValueError if archive_date is not a YYYY-MM-DD date after the latest loaded archive.
+  """
+  archive_date = datetime.date.fromisoformat(archive_date).isoformat()
+  cursor.execute(f"""
+  select archive_date::text, num_rules, checksums from {schema_name}.archives
+   order by archive_date desc limit 1
+  """)
+  latest, num_rules, latest_checksums = cursor.fetchone() or (None, None, None)
+  if latest and latest >= archive_date:
+    raise ValueError(f'{archive_date} is not after the latest loaded archive ({latest})')
+  checksums = archive_checksums(archive_set) if archive_set else None
+
+  if checksums and checksums == latest_checksums:
+    cursor.execute(f"""
+    insert into {schema_name}.archives (archive_date, num_rules, num_added, num_changed,
+                                        num_removed, checksums)
+    values (%s, %s, 0, 0, 0, %s)
+    """, (archive_date, num_rules, checksums))
+    return 0, 0, 0
+
+  rules = read_archive(archive_date)
+
+  # Stage the new digests, and diff them against the current versions’ in the database
+  cursor.execute("""
+  create temporary table staged_rules (rule_key text primary key, digest text) on commit drop
+  """)
+  with cursor.copy('copy staged_rules (rule_key, digest) from stdin') as copy:
+    for rule_key, rule in rules.items():
+      copy.write_row((rule_key, digest(rule)))
+  cursor.execute('analyze staged_rules')
+
+  # Rules without a current version with the same digest: added or changed
+  cursor.execute(f"""
+  create temporary table new_versions on commit drop as
+  select s.rule_key, s.digest, t.rule_key is not null as is_changed
+    from staged_rules s
+    left join {schema_name}.transfer_rules t on t.rule_key = s.rule_key and t.valid_to is null
+   where t.digest is distinct from s.digest
+  """)
+  # Current versions without a staged rule with the same digest: changed or removed
+  cursor.execute(f"""
+  create temporary table closed_rules on commit drop as
+  select t.rule_key
+    from {schema_name}.transfer_rules t
+   where t.valid_to is null
+     and not exists (select 1 from staged_rules s
+                      where s.rule_key = t.rule_key and s.digest = t.digest)
+  """)
+  cursor.execute('analyze new_versions, closed_rules')
+  cursor.execute("""
+  select count(*) filter (where not is_changed), count(*) filter (where is_changed),
+         (select count(*) from closed_rules)
+    from new_versions
+  """)
+  num_added, num_changed, num_closed = cursor.fetchone()
+  num_removed = num_closed - num_changed
+
+  # Close the current versions of changed and removed rules
+  for table_name in table_columns:
+    cursor.execute(f"""
+    update {schema_name}.{table_name} t
+       set valid_to = %s
+      from closed_rules c
+     where t.rule_key = c.rule_key
+       and t.valid_to is null
+    """, (archive_date, ))
+
+  # Open new versions of added and changed rules
+  cursor.execute('select rule_key, digest from new_versions')
+  new_versions = cursor.fetchall()
+  with cursor.copy(f"""
+  copy {schema_name}.transfer_rules (rule_key, effective_date, digest, valid_from) from stdin
+  """) as copy:
+    for rule_key, rule_digest in new_versions:
+      copy.write_row((rule_key, rules[rule_key][0], rule_digest, archive_date))
+  for index, table_name in [(1, 'source_courses'), (2, 'destination_courses')]:
+    columns = ', '.join(table_columns[table_name])
+    with cursor.copy(f"""
+    copy {schema_name}.{table_name} ({columns}, valid_from) from stdin
+    """) as copy:
+      for rule_key, _ in new_versions:
+        for row in rules[rule_key][index]:
+          copy.write_row(row + (archive_date, ))
+
+  cursor.execute(f"""
+  insert into {schema_name}.archives (archive_date, num_rules, num_added, num_changed,
+                                      num_removed, checksums)
+  values (%s, %s, %s, %s, %s, %s)
+  """, (archive_date, len(rules), num_added, num_changed, num_removed, checksums))
+
+  return num_added, num_changed, num_removed
+
+
+# load_archives()
+# -------------------------------------------------------------------------------------------------
+def load_archives(archive_dates: list, catalog=None):
+  """Load archive sets into the temporal tables in date order, skipping ones already loaded.
+     Each set’s files are checked against the archive catalog (loaded if not given) first.
+  """
+  if catalog is None:
+    catalog = load_catalog()
+  with psycopg.connect('dbname=cuny_curriculum') as conn:
+    with conn.cursor() as cursor:
+      create_tables(cursor)
+      conn.commit()
+      cursor.execute(f'select archive_date::text from {schema_name}.archives')
+      loaded = {row[0] for row in cursor}
+      for archive_date in sorted(archive_dates):
+        if archive_date in loaded:
+          print(f'{archive_date} already loaded')
+          continue
+        start = time.perf_counter()
+        archive_set = check_archive_set(catalog, archive_date)
+        if archive_set is None or not archive_set.is_complete:
+          exit(f'{archive_date} archive files are missing or can’t all be read')
+        try:
+          num_added, num_changed, num_removed = load_archive(cursor, archive_date, archive_set)
+        except ValueError as err:
+          exit(err)
+        conn.commit()
+        print(f'{archive_date} {num_added:9,} added {num_changed:9,} changed '
+              f'{num_removed:9,} removed {time.perf_counter() - start:8.1f} sec')
+
+
+# create_views()
+# -------------------------------------------------------------------------------------------------
+def create_views(cursor, archive_date: str) -> str:
+  """Create a point-in-time schema of views showing the tables as of an archive date.
+
+     The views contain the same rows as the schema mk_tables.py builds for the archive date,
+     but the id values are generated by row_number() rather than taken from the original load.
+     Returns the schema name. Raises ValueError if archive_date is not a YYYY-MM-DD date, or if
+     the view schema holds anything but views.
+  """
+  archive_date = datetime.date.fromisoformat(archive_date).isoformat()
+  view_schema = f't{archive_date.replace('-', '')}'
+  cursor.execute("""
+  select count(*) from information_schema.tables
+   where table_schema = %s and table_type != 'VIEW'
+  """, (view_schema, ))
+  if cursor.fetchone()[0]:
+    raise ValueError(f'{view_schema} holds tables, not temporal views')
+  valid = f"valid_from <= '{archive_date}' and (valid_to is null or valid_to > '{archive_date}')"
+  cursor.execute(f"drop schema if exists {view_schema} cascade")
+  cursor.execute(f"create schema {view_schema}")
+  cursor.execute(f"""
+  create view {view_schema}.transfer_rules as
+  select row_number() over (order by rule_key)::integer as id, rule_key, effective_date,
+         ''::text as description
+    from {schema_name}.transfer_rules
+   where {valid}
+  """)
+  for table_name in ['source_courses', 'destination_courses']:
+    cursor.execute(f"""
+    create view {view_schema}.{table_name} as
+    select row_number() over (order by rule_key)::integer as id,
+           {', '.join(table_columns[table_name])}
+      from {schema_name}.{table_name}
+     where {valid}
+    """)
+  return view_schema
+
+
+# main()
+# -------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+  parser = ArgumentParser('Create point-in-time views of the temporal transfer rule tables')
+  parser.add_argument('archive_dates', nargs='+', metavar='YYYY-MM-DD')
+  args = parser.parse_args()
+  archive_dates = []
+  for archive_date in args.archive_dates:
+    try:
+      archive_dates.append(datetime.date.fromisoformat(archive_date).isoformat())
+    except ValueError:
+      parser.error(f'{archive_date} is not a YYYY-MM-DD date')
+
+  with psycopg.connect('dbname=cuny_curriculum') as conn:
+    with conn.cursor() as cursor:
+      cursor.execute(f'select min(archive_date)::text from {schema_name}.archives')
+      first = cursor.fetchone()[0]
+      for archive_date in archive_dates:
+        if first is None or archive_date < first:
+          print(f'{archive_date} is before the first loaded archive', file=sys.stderr)
+          continue
+        try:
+          print(f'{archive_date}: {create_views(cursor, archive_date)}')
+        except ValueError as err:
+          print(err, file=sys.stderr)
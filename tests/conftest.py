@@ -0,0 +1,45 @@
+"""Fixtures shared by the tests: a small synthetic rules archive (synthetic_archive.py), written
+   once per test session to a temporary directory.
+
+   The tools read the archive and cache directory locations from the environment when they are
+   imported, so both are set here, before any test module imports them.
+"""
+
+import os
+import pytest
+import shutil
+import sys
+import tempfile
+
+from pathlib import Path
+
+test_dir = Path(tempfile.mkdtemp(prefix='rules_archive_tests_'))
+os.environ['RULES_ARCHIVE_DIR'] = str(Path(test_dir, 'archives'))
+os.environ['RULES_ARCHIVE_CACHE'] = str(Path(test_dir, 'cache'))
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import synthetic_archive
+
+from archive_catalog import load_catalog
+
+
+# pytest_sessionfinish()
+# -------------------------------------------------------------------------------------------------
+def pytest_sessionfinish(session, exitstatus):
+  shutil.rmtree(test_dir, ignore_errors=True)
+
+
+# archive_dates()
+# -------------------------------------------------------------------------------------------------
+@pytest.fixture(scope='session')
+def archive_dates() -> list:
+  """Three weekly archive sets of 600 rules, with 5% of the rules changing each week."""
+  return synthetic_archive.generate(os.environ['RULES_ARCHIVE_DIR'], num_rules=600, num_dates=3,
+                                    courses_per_institution=40, change_rate=0.05)
+
+
+# catalog()
+# -------------------------------------------------------------------------------------------------
+@pytest.fixture(scope='session')
+def catalog(archive_dates):
+  return load_catalog(os.environ['RULES_ARCHIVE_DIR'])
@@ -0,0 +1,114 @@
+"""The archive catalog’s manifest, and how it notices archive files that change."""
+
+import archive_catalog
+import bz2
+import os
+import pytest
+import shutil
+
+from archive_catalog import check_archive_set, load_catalog
+from archive_files import archive_path
+
+
+# archive_dir()
+# -------------------------------------------------------------------------------------------------
+@pytest.fixture
+def archive_dir(archive_dates, tmp_path):
+  """A copy of the synthetic archive that a test can change, with a manifest of its own."""
+  return shutil.copytree(os.environ['RULES_ARCHIVE_DIR'], tmp_path / 'archives')
+
+
+# scans()
+# -------------------------------------------------------------------------------------------------
+@pytest.fixture
+def scans(monkeypatch) -> list:
+  """The names of the files scanned, in the order scanned."""
+  scanned = []
+
+  def try_scan_file(path):
+    scanned.append(path.name)
+    return scan(path)
+
+  scan = archive_catalog.try_scan_file
+  monkeypatch.setattr(archive_catalog, 'try_scan_file', try_scan_file)
+  return scanned
+
+
+# rewrite()
+# -------------------------------------------------------------------------------------------------
+def rewrite(path, data: bytes):
+  """Replace a file’s contents in place, which leaves its directory’s mtime unchanged."""
+  dir_mtime_ns = path.parent.stat().st_mtime_ns
+  stat = path.stat()
+  with open(path, 'r+b') as outfile:
+    outfile.write(data)
+    outfile.truncate()
+  os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+  assert path.parent.stat().st_mtime_ns == dir_mtime_ns
+
+
+# test_manifest()
+# -------------------------------------------------------------------------------------------------
+def test_manifest(archive_dir, archive_dates, scans):
+  catalog = load_catalog(archive_dir)
+  assert catalog.dates == archive_dates
+  assert len(scans) == 3 * len(archive_dates)
+  archive_file = catalog.archive_sets[archive_dates[0]].files['destination_courses']
+  with bz2.open(archive_file.path) as infile:
+    assert archive_file.rows == sum(1 for _ in infile)
+
+  # Unchanged files aren’t scanned again, and the manifest is replaced without leftovers.
+  scans.clear()
+  assert load_catalog(archive_dir, check_files=True).archive_sets == catalog.archive_sets
+  assert scans == []
+  assert [path.name for path in catalog.manifest_path.parent.glob('manifest_*')
+          if path.suffix == '.tmp'] == []
+
+
+# test_changed_file()
+# -------------------------------------------------------------------------------------------------
+def test_changed_file(archive_dir, archive_dates, scans):
+  catalog = load_catalog(archive_dir)
+  path = archive_path(archive_dates[1], 'transfer_rules', archive_dir)
+  old_file = catalog.archive_sets[archive_dates[1]].files['transfer_rules']
+  rewrite(path, bz2.compress(b'SRC01-DST01-ACCT-1,2025-01-01\n'))
+  scans.clear()
+
+  # Loading the catalog stats only the directory, so it doesn’t notice.
+  catalog = load_catalog(archive_dir)
+  assert catalog.archive_sets[archive_dates[1]].files['transfer_rules'] == old_file
+  # Checking the set before using it does, rescanning only the changed file.
+  archive_set = check_archive_set(catalog, archive_dates[1])
+  assert scans == [path.name]
+  assert archive_set.is_complete and archive_set.files['transfer_rules'].rows == 1
+  assert archive_set.files['transfer_rules'].sha256 != old_file.sha256
+  # The manifest was saved with the change.
+  scans.clear()
+  catalog = load_catalog(archive_dir)
+  assert catalog.archive_sets[archive_dates[1]].files['transfer_rules'].rows == 1
+  assert check_archive_set(catalog, archive_dates[1]) == archive_set
+  assert scans == []
+
+
+# test_bad_file()
+# -------------------------------------------------------------------------------------------------
+def test_bad_file(archive_dir, archive_dates, scans):
+  catalog = load_catalog(archive_dir)
+  path = archive_path(archive_dates[0], 'source_courses', archive_dir)
+  data = path.read_bytes()
+  rewrite(path, data[:len(data) // 2])
+
+  # A file that can’t be decompressed makes its set incomplete, and is remembered as bad.
+  assert not check_archive_set(catalog, archive_dates[0]).is_complete
+  assert catalog.dates == archive_dates[1:]
+  assert 'EOFError' in catalog.bad_files[str(path)]['error']
+  scans.clear()
+  catalog = load_catalog(archive_dir, check_files=True)
+  assert catalog.dates == archive_dates[1:] and str(path) in catalog.bad_files
+  assert scans == []
+
+  # Once the file is fixed, checking the files finds it again.
+  rewrite(path, data)
+  catalog = load_catalog(archive_dir, check_files=True)
+  assert catalog.dates == archive_dates and catalog.bad_files == {}
+  assert scans == [path.name]
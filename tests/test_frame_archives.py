@@ -0,0 +1,98 @@
+"""Frame archives: recompression into rule_key order, the frame index, and prefix lookups."""
+
+import bz2
+import csv
+import io
+import os
+import pytest
+
+from archive_files import archive_path, read_rows
+from frame_archives import (current_frames, load_index, prefix_frames, prefix_rows, recompress,
+                            sorted_lines)
+
+pytest.importorskip('zstandard')
+
+
+# frames()
+# -------------------------------------------------------------------------------------------------
+@pytest.fixture(scope='module')
+def frames(archive_dates):
+  """The first archive set’s source_courses file, recompressed into frames of about 4KB."""
+  path = archive_path(archive_dates[0], 'source_courses')
+  return path, recompress(path, frame_bytes=4096, jobs=2)
+
+
+# test_frames_sorted_by_rule_key()
+# -------------------------------------------------------------------------------------------------
+def test_frames_sorted_by_rule_key(frames):
+  path, target = frames
+  rows = list(read_rows('source_courses', path))
+  # The sort is stable, so each rule’s rows keep their order in the file.
+  assert list(read_rows('source_courses', target)) == sorted(rows, key=lambda row: row[0])
+
+
+# test_frame_index()
+# -------------------------------------------------------------------------------------------------
+def test_frame_index(frames):
+  path, target = frames
+  index = load_index(target)
+  assert index['rows'] == sum(1 for _ in read_rows('source_courses', path))
+  assert len(index['frames']) > 1
+  offset = 0
+  for frame_offset, length, num_lines, first_key, last_key in index['frames']:
+    assert frame_offset == offset and num_lines > 0 and first_key <= last_key
+    offset += length
+  assert offset == target.stat().st_size
+  last_keys = [frame[4] for frame in index['frames']]
+  assert last_keys == sorted(last_keys)
+
+
+# test_current_frames()
+# -------------------------------------------------------------------------------------------------
+def test_current_frames(frames, archive_dates):
+  path, target = frames
+  assert current_frames(path) == target
+  assert current_frames(archive_path(archive_dates[-1], 'source_courses')) is None
+  # A bz2 path reads the bz2 file in its own order, even with a current frame archive.
+  with bz2.open(path, 'rt') as infile:
+    file_keys = [row[0] for row in csv.reader(infile)]
+  assert [row[0] for row in read_rows('source_courses', path)] == file_keys
+  # Once the bz2 file changes, the frame archive is out of date.
+  stat = path.stat()
+  os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+  try:
+    assert current_frames(path) is None
+  finally:
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+  assert current_frames(path) == target
+
+
+# test_prefix_rows()
+# -------------------------------------------------------------------------------------------------
+def test_prefix_rows(frames):
+  path, target = frames
+  rows = list(read_rows('source_courses', path))
+  prefix = rows[len(rows) // 2][0][:11]  # A sending/receiving institution pair
+  expected = [row for row in rows if row[0].startswith(prefix)]
+  assert expected
+  assert sorted(prefix_rows('source_courses', path, prefix)) == sorted(expected)
+  index = load_index(target)
+  assert len(prefix_frames(index['frames'], prefix)) < len(index['frames'])
+  assert list(prefix_rows('source_courses', path, 'ZZZ99')) == []
+
+
+# test_sorted_lines_quoted()
+# -------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize('run_bytes', [1 << 20, 200])
+def test_sorted_lines_quoted(tmp_path, run_bytes):
+  """Quoted values, including ones with commas and newlines, survive sorting in one run or
+     many.
+  """
+  rows = [[f'K{index % 7}', value, str(index)]
+          for index, value in enumerate(['plain', 'a,b', 'say "hi"', 'two\nlines', ''] * 20)]
+  text = io.StringIO()
+  csv.writer(text, lineterminator='\n').writerows(rows)
+  path = tmp_path / 'quoted.csv.bz2'
+  path.write_bytes(bz2.compress(text.getvalue().encode()))
+  records = b''.join(sorted_lines(path, run_bytes)).decode()
+  assert list(csv.reader(io.StringIO(records, newline=''))) == sorted(rows, key=lambda row: row[0])
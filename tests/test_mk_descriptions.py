@@ -0,0 +1,113 @@
+"""The rule_descriptions dictionary: each distinct description stored once, and pruned when no
+   rule refers to it, using the SQLite backend.
+"""
+
+import mk_descriptions
+import pytest
+
+from backends import SQLiteBackend
+from mk_tables import create_tables
+
+
+# sqlite()
+# -------------------------------------------------------------------------------------------------
+@pytest.fixture
+def sqlite(tmp_path, monkeypatch):
+  """An empty SQLite file as mk_descriptions’ database."""
+  backend = SQLiteBackend(tmp_path / 'rules.db')
+  monkeypatch.setattr(mk_descriptions, 'backend', backend)
+  monkeypatch.setattr(mk_descriptions, '_cursor', None)
+  yield backend
+  if mk_descriptions._cursor is not None:
+    mk_descriptions._cursor.connection.close()
+
+
+# add_schema()
+# -------------------------------------------------------------------------------------------------
+def add_schema(backend, schema_name: str, rule_keys: list):
+  with backend.connect() as conn, conn.cursor() as cursor:
+    create_tables(cursor, schema_name, backend)
+    for rule_key in rule_keys:
+      cursor.execute(f"""
+      insert into {backend.table(schema_name, 'transfer_rules')} (rule_key, effective_date)
+      values (?, '2025-01-01')
+      """, (rule_key, ))
+
+
+# write()
+# -------------------------------------------------------------------------------------------------
+def write(schema_name: str, descriptions: dict) -> int:
+  return mk_descriptions.write_descriptions(schema_name,
+                                            [(rule_key, description, f'{len(description):016x}')
+                                             for rule_key, description in descriptions.items()])
+
+
+# query()
+# -------------------------------------------------------------------------------------------------
+def query(backend, sql: str) -> list:
+  with backend.connect() as conn, conn.cursor() as cursor:
+    cursor.execute(sql)
+    return cursor.fetchall()
+
+
+# dictionary()
+# -------------------------------------------------------------------------------------------------
+def dictionary(backend) -> list:
+  return sorted(row[0] for row in query(backend, 'select description from rule_descriptions'))
+
+
+# prune()
+# -------------------------------------------------------------------------------------------------
+def prune(backend) -> int:
+  with backend.connect() as conn, conn.cursor() as cursor:
+    return mk_descriptions.prune_dictionary(cursor)
+
+
+# test_dedup()
+# -------------------------------------------------------------------------------------------------
+def test_dedup(sqlite):
+  add_schema(sqlite, 'a20250101', ['K1', 'K2', 'K3'])
+  add_schema(sqlite, 'a20250108', ['K1', 'K4'])
+  assert prune(sqlite) == 0  # No dictionary yet
+
+  assert write('a20250101', {'K1': 'X => Y', 'K2': 'X => Y', 'K3': 'Z => Y'}) == 3
+  assert dictionary(sqlite) == ['X => Y', 'Z => Y']
+  rows = dict(query(sqlite, 'select rule_key, description_id from a20250101_transfer_rules'))
+  assert rows['K1'] == rows['K2'] != rows['K3']
+  # The text is in the dictionary, and described_rules, not transfer_rules.
+  assert {row[0] for row in query(sqlite, 'select description from a20250101_transfer_rules')
+          } == {''}
+  assert dict(query(sqlite, 'select rule_key, description from a20250101_described_rules')) == {
+    'K1': 'X => Y', 'K2': 'X => Y', 'K3': 'Z => Y'}
+
+  # Writing the same descriptions again changes nothing.
+  assert write('a20250101', {'K1': 'X => Y', 'K2': 'X => Y', 'K3': 'Z => Y'}) == 0
+  # Another schema shares the descriptions already in the dictionary.
+  assert write('a20250108', {'K1': 'X => Y', 'K4': 'W => Y'}) == 2
+  assert dictionary(sqlite) == ['W => Y', 'X => Y', 'Z => Y']
+  assert prune(sqlite) == 0
+
+
+# test_prune()
+# -------------------------------------------------------------------------------------------------
+def test_prune(sqlite):
+  add_schema(sqlite, 'a20250101', ['K1', 'K2', 'K3'])
+  add_schema(sqlite, 'a20250108', ['K1', 'K4'])
+  write('a20250101', {'K1': 'X => Y', 'K2': 'X => Y', 'K3': 'Z => Y'})
+  write('a20250108', {'K1': 'X => Y', 'K4': 'W => Y'})
+
+  # A rewritten description stays in the dictionary until it is pruned.
+  assert write('a20250101', {'K3': 'V => Y'}) == 1
+  assert dictionary(sqlite) == ['V => Y', 'W => Y', 'X => Y', 'Z => Y']
+  assert prune(sqlite) == 1
+  assert dictionary(sqlite) == ['V => Y', 'W => Y', 'X => Y']
+
+  # Dropping a schema leaves the descriptions only it referred to.
+  with sqlite.connect() as conn, conn.cursor() as cursor:
+    cursor.execute('drop view a20250108_described_rules')
+    sqlite.create_schema(cursor, 'a20250108')
+  assert prune(sqlite) == 1
+  assert dictionary(sqlite) == ['V => Y', 'X => Y']
+  assert prune(sqlite) == 0
+  assert dict(query(sqlite, 'select rule_key, description from a20250101_described_rules')) == {
+    'K1': 'X => Y', 'K2': 'X => Y', 'K3': 'V => Y'}
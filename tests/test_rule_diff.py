@@ -0,0 +1,85 @@
+"""rule_diff’s merge-join of two archive sets, against a diff of the whole sets in memory."""
+
+import pytest
+import rule_diff
+
+from archive_files import read_rows
+from collections import defaultdict
+from rule_diff import archive_rules, course_changes, diff_archives, rule_changes, sorted_rows
+
+
+# without_frames()
+# -------------------------------------------------------------------------------------------------
+@pytest.fixture(autouse=True)
+def without_frames(monkeypatch):
+  """Sort the bz2 files even if another test has left frame archives of them."""
+  monkeypatch.setattr(rule_diff, 'current_frames', lambda path: None)
+
+
+# whole_rules()
+# -------------------------------------------------------------------------------------------------
+def whole_rules(archive_set) -> dict:
+  """An archive set’s rules as read_rows() gives them, keyed by rule_key."""
+  def grouped(table_name):
+    rules = defaultdict(list)
+    for row in read_rows(table_name, archive_set.files[table_name].path):
+      rules[row[0]].append(row)
+    return rules
+
+  source, destination = grouped('source_courses'), grouped('destination_courses')
+  return {rule_key: (rule_key, effective_date, source[rule_key], destination[rule_key])
+          for rule_key, effective_date in read_rows('transfer_rules',
+                                                    archive_set.files['transfer_rules'].path)}
+
+
+# test_sorted_rows()
+# -------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize('run_size', [rule_diff.run_size, 97])
+def test_sorted_rows(catalog, monkeypatch, run_size):
+  """In one run, or merged from many, the rows come in stable rule_key order."""
+  monkeypatch.setattr(rule_diff, 'run_size', run_size)
+  path = catalog.archive_sets[catalog.dates[0]].files['source_courses'].path
+  rows = list(read_rows('source_courses', path))
+  assert list(sorted_rows('source_courses', path)) == sorted(rows, key=lambda row: row[0])
+
+
+# test_diff_archives()
+# -------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize('run_size', [rule_diff.run_size, 97])
+def test_diff_archives(catalog, monkeypatch, run_size):
+  monkeypatch.setattr(rule_diff, 'run_size', run_size)
+  old_set, new_set = (catalog.archive_sets[archive_date] for archive_date in catalog.dates[:2])
+  old_rules, new_rules = whole_rules(old_set), whole_rules(new_set)
+  expected = {(rule_key, 'added') for rule_key in new_rules.keys() - old_rules.keys()}
+  expected |= {(rule_key, 'removed') for rule_key in old_rules.keys() - new_rules.keys()}
+  expected |= {(rule_key, 'changed') for rule_key in old_rules.keys() & new_rules.keys()
+               if rule_changes(old_rules[rule_key], new_rules[rule_key])}
+
+  differences = list(diff_archives(archive_rules(old_set), archive_rules(new_set)))
+  assert {(rule_key, status) for status, rule_key, _ in differences} == expected
+  assert len(differences) == len(expected)
+  assert all(changes for status, _, changes in differences if status == 'changed')
+  assert any(status == 'changed' for status, _, _ in differences)
+
+
+# test_unchanged_archive()
+# -------------------------------------------------------------------------------------------------
+def test_unchanged_archive(catalog):
+  archive_set = catalog.archive_sets[catalog.dates[0]]
+  assert list(diff_archives(archive_rules(archive_set), archive_rules(archive_set))) == []
+
+
+# test_course_changes_duplicates()
+# -------------------------------------------------------------------------------------------------
+def test_course_changes_duplicates():
+  """A course listed twice in a rule is compared as a multiset of its values."""
+  def row(min_grade, max_grade):
+    return ['K', 'SRC01', 'DST01', 10, 1, 3.0, 3.0, 'C', min_grade, max_grade]
+
+  details = {'grades': [8, 9]}
+  old_rows = [row(0.0, 4.0), row(2.0, 4.0)]
+  assert course_changes('source', old_rows, old_rows[::-1], 3, details) == []
+  assert (course_changes('source', old_rows, [row(1.0, 4.0), row(2.0, 4.0)], 3, details)
+          == ['source 10.1 grades 0.0/4.0, 2.0/4.0 → 1.0/4.0, 2.0/4.0'])
+  assert (course_changes('source', old_rows, [row(2.0, 4.0)], 3, details)
+          == ['source 10.1 grades 0.0/4.0, 2.0/4.0 → 2.0/4.0'])
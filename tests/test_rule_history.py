@@ -0,0 +1,58 @@
+"""rule_history: the rule encoding, and histories read back from a built index."""
+
+import rule_history
+
+from rule_diff import archive_rules, rule_changes
+from rule_history import (archive_states, build_index, decode_rule, encode_rule, HistoryIndex,
+                          open_index)
+
+
+# test_encode_decode()
+# -------------------------------------------------------------------------------------------------
+def test_encode_decode(catalog):
+  """Decoding gives back the rule, with its values as strings, and encodes the same way again."""
+  num_rules = 0
+  for rule in archive_rules(catalog.archive_sets[catalog.dates[0]]):
+    encoded = encode_rule(rule)
+    decoded = decode_rule(rule[0], encoded)
+    assert decoded[:2] == rule[:2]
+    assert len(decoded[2]) == len(rule[2]) and len(decoded[3]) == len(rule[3])
+    assert rule_changes(rule, decoded) == []
+    assert encode_rule(decoded) == encoded
+    num_rules += 1
+  assert num_rules == catalog.archive_sets[catalog.dates[0]].files['transfer_rules'].rows
+  assert decode_rule('SRC01-DST01-ACCT-1', '') is None
+
+
+# test_encoding_ignores_row_order()
+# -------------------------------------------------------------------------------------------------
+def test_encoding_ignores_row_order(catalog):
+  rule = next(rule for rule in archive_rules(catalog.archive_sets[catalog.dates[0]])
+              if len(rule[2]) > 1)
+  assert encode_rule((*rule[:2], rule[2][::-1], rule[3][::-1])) == encode_rule(rule)
+
+
+# test_index()
+# -------------------------------------------------------------------------------------------------
+def test_index(catalog):
+  """Replaying each rule’s history gives its state in every archive set."""
+  build_index(jobs=2, verbose=False)
+  index = open_index()
+  assert isinstance(index, HistoryIndex) and index.meta['dates'] == catalog.dates
+  states = {archive_date: archive_states(catalog.archive_sets[archive_date])
+            for archive_date in catalog.dates}
+  rule_keys = set().union(*states.values())
+  assert index.rule_keys == sorted(rule_keys)
+  for rule_key in rule_keys:
+    history = dict(rule_history.rule_history(rule_key))
+    assert history
+    state = None
+    for archive_date in catalog.dates:
+      if archive_date in history:
+        # Only changes are recorded.
+        rule = history[archive_date]
+        encoded = None if rule is None else encode_rule(rule)
+        assert encoded != state
+        state = encoded
+      assert state == states[archive_date].get(rule_key)
+  assert rule_history.rule_history('ZZZ99-ZZZ99-NONE-1') == ()